@@ -0,0 +1,275 @@
+"""
+Локальный SSH сервер-заглушка на paramiko для офлайн замеров работы с флотом.
+
+Любой логин/пароль/ключ принимается. У каждого SSH пользователя своя
+«файловая система» — каталог <root>/<user>: абсолютные пути /etc, /var,
+/usr, /opt в командах и в SFTP переписываются внутрь него. Команды
+выполняются настоящим sh (значит run_many, tail, grep, sha256sum работают
+как на ноде), а systemctl, apt-get, ufw и rsyslogd подменены заглушками,
+так что на машине, где идёт замер, ничего не устанавливается и не
+перезапускается. latency добавляет задержку к каждой команде (имитация RTT).
+
+  with FakeSSHServer(latency=0.02) as server:
+      node = Node("n1", host="127.0.0.1", port=server.port, user="n1", auth_method="password")
+"""
+import os
+import re
+import shutil
+import signal
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+
+import paramiko
+
+_ABS_PATH_RE = re.compile(r"(?<![\w./-])/(etc|var|usr|opt)(?=/|\b)")
+
+_STUBS = {
+    "systemctl": '[ "$1" = "is-active" ] && echo active\nexit 0\n',
+    "apt-get": "exit 0\n",
+    "ufw": 'echo "Rule added"\nexit 0\n',
+    "rsyslogd": "exit 0\n",
+}
+
+_SANDBOX_DIRS = ("etc/rsyslog.d", "var/log/remnanode", "usr/local/bin", "var/lib")
+
+
+class _Interface(paramiko.ServerInterface):
+    def __init__(self, server, transport):
+        self.server = server
+        self.transport = transport
+        self.user = None
+
+    def get_allowed_auths(self, username):
+        return "password,publickey"
+
+    def check_auth_password(self, username, password):
+        self.user = username
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_auth_publickey(self, username, key):
+        self.user = username
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self.server._exec, args=(self.user, channel, command.decode()),
+                         daemon=True).start()
+        return True
+
+
+class _SandboxSFTP(paramiko.SFTPServerInterface):
+    """SFTP поверх каталога-песочницы пользователя."""
+
+    def __init__(self, interface, server):
+        super().__init__(interface)
+        self.root = server.root_for(interface.user)
+
+    def _real(self, path):
+        return os.path.join(self.root, os.path.normpath("/" + path).lstrip("/"))
+
+    def _call(self, func, *args):
+        try:
+            func(*args)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def open(self, path, flags, attr):
+        real = self._real(path)
+        try:
+            fd = os.open(real, flags, 0o644)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        if flags & os.O_WRONLY:
+            mode = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            mode = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            mode = "rb"
+        handle = paramiko.SFTPHandle(flags)
+        f = os.fdopen(fd, mode)
+        handle.filename = real
+        handle.readfile = f
+        handle.writefile = f
+        return handle
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self._real(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def list_folder(self, path):
+        real = self._real(path)
+        try:
+            return [paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(real, name)), name)
+                    for name in os.listdir(real)]
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def remove(self, path):
+        return self._call(os.remove, self._real(path))
+
+    def rename(self, oldpath, newpath):
+        return self._call(os.rename, self._real(oldpath), self._real(newpath))
+
+    def posix_rename(self, oldpath, newpath):
+        return self._call(os.replace, self._real(oldpath), self._real(newpath))
+
+    def mkdir(self, path, attr):
+        return self._call(os.mkdir, self._real(path))
+
+    def rmdir(self, path):
+        return self._call(os.rmdir, self._real(path))
+
+    def chattr(self, path, attr):
+        if attr.st_mode is not None:
+            return self._call(os.chmod, self._real(path), attr.st_mode)
+        return paramiko.SFTP_OK
+
+
+class FakeSSHServer:
+    """SSH сервер на 127.0.0.1 в фоновом потоке; root — каталог песочниц (по умолчанию временный)."""
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, root=None):
+        self.latency = latency
+        self._own_root = root is None
+        self.root = root or tempfile.mkdtemp(prefix="ddlog-fake-ssh-")
+        self.bin_dir = os.path.join(self.root, ".bin")
+        os.makedirs(self.bin_dir, exist_ok=True)
+        for name, body in _STUBS.items():
+            path = os.path.join(self.bin_dir, name)
+            with open(path, "w") as f:
+                f.write("#!/bin/sh\n" + body)
+            os.chmod(path, 0o755)
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(1024)
+        self.host, self.port = self.sock.getsockname()
+        self.connections = 0
+        self.commands = 0
+        self._lock = threading.Lock()
+        self._transports = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def root_for(self, user):
+        """Каталог-«корень» ноды с этим SSH пользователем."""
+        root = os.path.join(self.root, user or "_anon")
+        if not os.path.isdir(root):
+            for sub in _SANDBOX_DIRS:
+                os.makedirs(os.path.join(root, sub), exist_ok=True)
+        return root
+
+    def start(self):
+        self._thread = threading.Thread(target=self._accept_loop, name="fake-ssh", daemon=True)
+        self._thread.start()
+        return self
+
+    def _accept_loop(self):
+        self.sock.settimeout(0.5)
+        while not self._stop.is_set():
+            try:
+                client, _ = self.sock.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            threading.Thread(target=self._serve, args=(client,), daemon=True).start()
+
+    def _serve(self, client):
+        transport = paramiko.Transport(client)
+        transport.add_server_key(self.host_key)
+        interface = _Interface(self, transport)
+        transport.set_subsystem_handler("sftp", paramiko.SFTPServer, _SandboxSFTP, self)
+        with self._lock:
+            self.connections += 1
+            self._transports.append(transport)
+        try:
+            transport.start_server(server=interface)
+        except (paramiko.SSHException, EOFError, OSError):
+            return
+        # каналы обслуживаются в check_channel_exec_request; accept() не вызываем —
+        # брошенный объект Channel закрывается сборщиком мусора
+
+    def _exec(self, user, channel, command):
+        with self._lock:
+            self.commands += 1
+        if self.latency:
+            time.sleep(self.latency)
+        root = self.root_for(user)
+        command = _ABS_PATH_RE.sub(lambda m: f"{root}/{m.group(1)}", command)
+        env = dict(os.environ, PATH=f"{self.bin_dir}:{os.environ.get('PATH', '/usr/bin:/bin')}", HOME=root)
+        proc = subprocess.Popen(["sh", "-c", command], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                stdin=subprocess.DEVNULL, env=env, cwd=root, start_new_session=True)
+
+        def pump_stderr():
+            for chunk in iter(lambda: os.read(proc.stderr.fileno(), 65536), b""):
+                try:
+                    channel.sendall_stderr(chunk)
+                except OSError:
+                    break
+
+        def watch_close():
+            # клиент закрыл канал (например, конец просмотра tail -F) — гасим процесс
+            while proc.poll() is None:
+                if channel.closed or not channel.get_transport().is_active():
+                    _kill(proc)
+                    return
+                time.sleep(0.2)
+
+        err_thread = threading.Thread(target=pump_stderr, daemon=True)
+        err_thread.start()
+        threading.Thread(target=watch_close, daemon=True).start()
+        try:
+            for chunk in iter(lambda: os.read(proc.stdout.fileno(), 65536), b""):
+                channel.sendall(chunk)
+        except OSError:
+            _kill(proc)
+        status = proc.wait()
+        if status < 0:
+            status = 128 - status  # убит сигналом, как в sh
+        err_thread.join(1)
+        proc.stdout.close()
+        proc.stderr.close()
+        try:
+            channel.send_exit_status(status)
+            channel.close()
+        except (OSError, EOFError):
+            pass
+
+    def close(self):
+        self._stop.set()
+        self.sock.close()
+        with self._lock:
+            transports, self._transports = self._transports, []
+        for transport in transports:
+            transport.close()
+        if self._thread:
+            self._thread.join(2)
+        if self._own_root:
+            shutil.rmtree(self.root, ignore_errors=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _kill(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
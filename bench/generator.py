@@ -0,0 +1,132 @@
+"""
+Детерминированный генератор строк access-лога xray.
+
+  python -m bench.generator --lines 1000000 --out /tmp/xray.out.log
+  python -m bench.generator --size 200M --users 5000 --ips 50000 --out /tmp/xray.out.log
+  python -m bench.generator --rate 20000 --duration 60 --out /tmp/xray.out.log   # дописывать с темпом
+
+Одинаковые seed и параметры дают байт-в-байт одинаковый файл, поэтому
+результаты прогонов на разных версиях можно сравнивать.
+"""
+import argparse
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.utils import parse_size
+
+DEFAULT_SEED = 42
+DEFAULT_START = datetime(2024, 1, 2, 15, 0, 0)
+
+_DOMAINS = ("www.google.com", "api.telegram.org", "i.ytimg.com", "www.youtube.com", "graph.instagram.com",
+            "rr3---sn-4g5e6nsz.googlevideo.com", "cdn.discordapp.com", "web.whatsapp.com",
+            "gateway.icloud.com", "update.microsoft.com", "s3.amazonaws.com", "github.com")
+_ROUTES = ("[VLESS_TCP_REALITY >> DIRECT]", "[VLESS_TCP_REALITY -> DIRECT]", "[TROJAN_WS >> DIRECT]",
+           "[SHADOWSOCKS >> BLOCK]", "[VLESS_GRPC >> DIRECT]")
+_ERRORS = ("[Info] [1877393641] proxy/vless/inbound: firstLen = 517",
+           "[Warning] [3917252401] app/dispatcher: default route for tcp:1.1.1.1:853",
+           "[Error] transport/internet/tcp: failed to accept REALITY connection > EOF")
+
+
+class XrayLogGenerator:
+    """
+    Поток правдоподобных строк xray: accepted/rejected/служебные строки,
+    users пользователей, у каждого своя доля из ips адресов, время идёт
+    вперёд на rate строк в секунду лог-времени.
+    """
+
+    def __init__(self, seed=DEFAULT_SEED, users=1000, ips=10000, start=DEFAULT_START, rate=5000,
+                 rejected_share=0.02, error_share=0.01):
+        self.rng = random.Random(seed)
+        self.users = [f"user{i}@example.com" for i in range(users)]
+        self.ips = [f"{10 + i // 65536 % 200}.{i // 256 % 256}.{i % 256}.{(i * 7) % 250 + 1}" for i in range(ips)]
+        self.clock = start
+        self.step = timedelta(seconds=1 / rate) if rate else timedelta(0)
+        self.rejected_share = rejected_share
+        self.error_share = error_share
+
+    def line(self):
+        rng = self.rng
+        self.clock += self.step
+        stamp = self.clock.strftime("%Y/%m/%d %H:%M:%S.%f")
+        roll = rng.random()
+        if roll < self.error_share:
+            return f"{stamp} {rng.choice(_ERRORS)}"
+        user = rng.randrange(len(self.users))
+        # у пользователя «свои» адреса: небольшой сдвиг от его номера
+        ip = self.ips[(user * 31 + int(rng.expovariate(0.7))) % len(self.ips)]
+        src = f"{ip}:{rng.randrange(1024, 65535)}"
+        if roll < self.error_share + self.rejected_share:
+            return f"{stamp} from {src} rejected  proxy/vless/encoding: invalid request user id"
+        network = "udp" if rng.random() < 0.1 else "tcp"
+        dest = rng.choice(_DOMAINS)
+        port = 443 if rng.random() < 0.9 else rng.choice((80, 53, 853, 5222))
+        return (f"{stamp} from tcp:{src} accepted {network}:{dest}:{port} "
+                f"{rng.choice(_ROUTES)} email: {self.users[user]}")
+
+    def lines(self, count):
+        for _ in range(count):
+            yield self.line()
+
+    def write(self, path, lines=None, size=None, mode="w"):
+        """Записать lines строк или до size байт; вернуть (строк, байт)."""
+        written = count = 0
+        batch = []
+        with open(path, mode, encoding="utf-8") as f:
+            while (lines is None or count < lines) and (size is None or written < size):
+                line = self.line() + "\n"
+                batch.append(line)
+                written += len(line.encode())
+                count += 1
+                if len(batch) >= 4096:
+                    f.write("".join(batch))
+                    batch = []
+            f.write("".join(batch))
+        return count, written
+
+    def append_at_rate(self, path, rate, duration, stop=None):
+        """Дописывать в path rate строк/с в течение duration секунд (как живой xray)."""
+        tick = 0.05
+        per_tick = max(1, int(rate * tick))
+        total = 0
+        deadline = time.monotonic() + duration
+        with open(path, "a", encoding="utf-8") as f:
+            next_tick = time.monotonic()
+            while time.monotonic() < deadline and not (stop and stop.is_set()):
+                f.write("".join(self.line() + "\n" for _ in range(per_tick)))
+                f.flush()
+                total += per_tick
+                next_tick += tick
+                time.sleep(max(0.0, next_tick - time.monotonic()))
+        return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--lines", type=int)
+    parser.add_argument("--size", help="объём файла вместо --lines, например 200M")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--ips", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--rate", type=int, help="дописывать в файл с таким темпом, строк/с")
+    parser.add_argument("--duration", type=float, default=60, help="сколько секунд дописывать (--rate)")
+    args = parser.parse_args(argv)
+
+    gen = XrayLogGenerator(args.seed, args.users, args.ips)
+    if args.rate:
+        total = gen.append_at_rate(args.out, args.rate, args.duration)
+        print(f"Дописано {total} строк в {args.out}")
+        return
+    if args.lines is None and args.size is None:
+        args.lines = 100000
+    count, size = gen.write(args.out, args.lines, parse_size(args.size) if args.size else None)
+    print(f"Записано {count} строк, {size} байт в {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Замер холодного старта без сети.
+
+  python -m bench.startup --runs 20
+
+Меряет время до готовности argparse (main.py --help) в новом процессе,
+импорт main без paramiko/rich/requests и get_public_ip по кэшу/override.
+Сеть не нужна: DDLOG_PUBLIC_IP задан, кэш кладётся во временный каталог.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+HEAVY_MODULES = ("paramiko", "rich", "requests")
+
+
+def _run(cmd, env, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": round(statistics.median(timings), 2), "min_ms": round(min(timings), 2)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as state_dir:
+        env = dict(os.environ, DDLOG_STATE_DIR=state_dir, DDLOG_PUBLIC_IP="203.0.113.10")
+        result = {
+            "python_baseline": _run([sys.executable, "-c", "pass"], env, args.runs),
+            "main_help": _run([sys.executable, "main.py", "--help"], env, args.runs),
+        }
+        check = (
+            "import sys, main; "
+            f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+        )
+        loaded = subprocess.run([sys.executable, "-c", check], cwd=ROOT, env=env,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        result["heavy_modules_on_import"] = loaded.split(",") if loaded else []
+
+        os.environ["DDLOG_STATE_DIR"] = state_dir
+        os.environ.pop("DDLOG_PUBLIC_IP", None)
+        from utils import utils
+        utils.STATE_DIR = state_dir
+        utils.write_json_atomic(os.path.join(state_dir, "public_ip.json"),
+                                {"ip": "203.0.113.10", "checked": time.time()})
+        start = time.perf_counter()
+        ip = utils.get_public_ip()
+        result["public_ip_cached_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        result["public_ip"] = ip
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
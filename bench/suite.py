@@ -0,0 +1,418 @@
+"""
+Набор воспроизводимых замеров без сети и без настоящих нод.
+
+  python -m bench.suite --out results.json
+  python -m bench.suite --only fleet --fleet-sizes 1,10,100,500 --latency-ms 20
+  python -m bench.suite --out new.json --compare results.json
+
+Входные данные — детерминированный генератор (bench.generator), удалённые
+ноды — локальный SSH сервер-заглушка (bench.fake_ssh). Результат — JSON с
+метаданными прогона; --compare печатает отношение new/base по каждой метрике.
+
+Замеры:
+  parse    parse_xray_line, строк/с
+  convert  convert_old_xray_log_to_json, строк/с и МБ/с
+  ingest   LogFollower: файл → разбор → JSON + sinks, строк/с
+  tail     живой просмотр (build_tail_command + _reader) локально и по SSH, с фильтром и без
+  syslog   встроенный приёмник syslog
+  pipeline разбор пачек {нода: строки} в потоке (0) и в ParsePool на N процессах,
+           строк/с, ускорение и сохранение порядка строк внутри ноды
+  report   отчёт по хранилищу (utils.reports): загрузка колонками, группировки, экспорт .npz
+  fleet    bring_up_nodes (холодный и повторный), add_node, remove_remote_node на N нодах
+"""
+import argparse
+import builtins
+import contextlib
+import getpass
+import io
+import json
+import os
+import platform
+import queue
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from bench.generator import XrayLogGenerator, DEFAULT_SEED
+from utils import utils
+from utils.xray_parser import parse_xray_line
+from utils.follower import LogFollower
+from utils.viewer import build_tail_command, _Source, _reader
+from utils.syslog_server import benchmark_syslog_server
+
+BENCHMARKS = ("parse", "convert", "ingest", "tail", "syslog", "pipeline", "report", "fleet")
+PIPELINE_NODES = 50
+PIPELINE_BATCH_LINES = 2000
+CENTRAL_IP = "192.0.2.1"
+
+
+def _rate(count, seconds):
+    return round(count / seconds) if seconds else None
+
+
+def bench_parse(log_path, lines):
+    with open(log_path, "r", encoding="utf-8") as f:
+        data = f.readlines()
+    start = time.perf_counter()
+    for line in data:
+        parse_xray_line(line)
+    seconds = time.perf_counter() - start
+    return {"lines": len(data), "seconds": round(seconds, 3), "lines_per_s": _rate(len(data), seconds)}
+
+
+def bench_convert(log_path, tmp):
+    json_path = os.path.join(tmp, "convert.json")
+    size = os.path.getsize(log_path)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        utils.convert_old_xray_log_to_json(log_path, json_path)
+    seconds = time.perf_counter() - start
+    with open(json_path, "rb") as f:
+        count = sum(1 for _ in f)
+    return {"lines": count, "seconds": round(seconds, 3), "lines_per_s": _rate(count, seconds),
+            "mb_per_s": round(size / seconds / 1024 ** 2, 1) if seconds else None}
+
+
+def bench_ingest(log_path, lines, tmp):
+    done = threading.Event()
+    seen = [0]
+
+    def sink(records):
+        seen[0] += len(records)
+        if seen[0] >= lines:
+            done.set()
+
+    follower = LogFollower(log_path, os.path.join(tmp, "ingest.json"), flush_interval=0.1, sinks=[sink])
+    start = time.perf_counter()
+    follower.start()
+    done.wait(600)
+    seconds = time.perf_counter() - start
+    follower.stop()
+    return {"lines": seen[0], "seconds": round(seconds, 3), "lines_per_s": _rate(seen[0], seconds)}
+
+
+def _tail_once(node, command, expected, timeout=300):
+    out = queue.Queue()
+    stop = threading.Event()
+    start = time.perf_counter()
+    source = _Source(node, command)
+    threading.Thread(target=_reader, args=(source, out, stop), daemon=True).start()
+    got = 0
+    deadline = time.monotonic() + timeout
+    try:
+        while got < expected and time.monotonic() < deadline:
+            try:
+                _, chunk = out.get(timeout=1)
+            except queue.Empty:
+                continue
+            if chunk is None:
+                break
+            got += len(chunk)
+    finally:
+        seconds = time.perf_counter() - start
+        stop.set()
+        source.close()
+    return {"lines": got, "seconds": round(seconds, 3), "lines_per_s": _rate(got, seconds)}
+
+
+def bench_tail(log_path, lines, server=None, node=None):
+    from utils.nodes import Node
+
+    email = "user7@example.com"
+    pattern = re.compile(r"email: " + re.escape(email) + r"( |$)")
+    with open(log_path, "r", encoding="utf-8") as f:
+        matching = sum(1 for line in f if pattern.search(line))
+    result = {}
+    local = Node("bench-local")
+    result["local"] = _tail_once(local, build_tail_command(log_path, lines), lines)
+    result["local_email_filter"] = _tail_once(local, build_tail_command(log_path, lines, email=email), matching)
+    if node is not None:
+        remote_path = "/var/log/remnanode/xray.out.log"
+        target = os.path.join(server.root_for(node.user), remote_path.lstrip("/"))
+        with open(log_path, "rb") as src, open(target, "wb") as dst:
+            dst.write(src.read())
+        result["ssh"] = _tail_once(node, build_tail_command(remote_path, lines), lines)
+        result["ssh_email_filter"] = _tail_once(node, build_tail_command(remote_path, lines, email=email),
+                                                matching)
+    return result
+
+
+def bench_syslog(tmp, lines):
+    with tempfile.TemporaryDirectory(dir=tmp) as out_dir:
+        return benchmark_syslog_server(out_dir, nodes=50, connections=100, lines=lines)
+
+
+def _pipeline_batches(log_path):
+    """Строки лога, разложенные по PIPELINE_NODES нодам пачками, как их отдаёт NodeWriters."""
+    per_node = {}
+    with open(log_path, "rb") as f:
+        for i, line in enumerate(f):
+            per_node.setdefault(f"bench{i % PIPELINE_NODES}", []).append(line.rstrip(b"\n"))
+    batches = []
+    for start in range(0, max(len(v) for v in per_node.values()), PIPELINE_BATCH_LINES):
+        for node, node_lines in per_node.items():
+            if node_lines[start:start + PIPELINE_BATCH_LINES]:
+                batches.append({node: node_lines[start:start + PIPELINE_BATCH_LINES]})
+    return per_node, batches
+
+
+def bench_pipeline(log_path, worker_counts):
+    from utils.pipeline import ParsePool
+    from utils.sinks import emit_syslog_lines, register_record_sink, unregister_record_sink
+
+    per_node, batches = _pipeline_batches(log_path)
+    total = sum(len(v) for v in per_node.values())
+    expected = {node: [line.decode().strip() for line in node_lines] for node, node_lines in per_node.items()}
+    result = {"lines": total, "nodes": len(per_node), "cpus": os.cpu_count()}
+    baseline = None
+    for workers in worker_counts:
+        seen = {}
+        count = [0]
+        done = threading.Event()
+
+        def sink(records):
+            for record in records:
+                seen.setdefault(record["node"], []).append(record["message"])
+            count[0] += len(records)
+            if count[0] >= total:
+                done.set()
+
+        register_record_sink(sink)
+        try:
+            startup = 0.0
+            if workers:
+                pool, startup = _timed(lambda: ParsePool(workers).start())
+                submit = pool.submit
+            else:
+                submit = emit_syslog_lines
+            start = time.perf_counter()
+            for batch in batches:
+                submit(batch)
+            done.wait(600)
+            seconds = time.perf_counter() - start
+            if workers:
+                pool.close()
+        finally:
+            unregister_record_sink(sink)
+        rate = _rate(count[0], seconds)
+        baseline = baseline or rate
+        result[str(workers)] = {"seconds": round(seconds, 3), "lines_per_s": rate,
+                                "speedup": round(rate / baseline, 2) if baseline else None,
+                                "startup_s": round(startup, 3), "ordered": seen == expected}
+    return result
+
+
+def bench_report(log_path, tmp):
+    """Лог, разложенный по PIPELINE_NODES нодам в SegmentStore, → build_report и экспорт колонок."""
+    from utils.reports import build_report
+    from utils.segments import SegmentStore
+    from utils.sinks import emit_syslog_lines, register_record_sink, unregister_record_sink
+
+    per_node, batches = _pipeline_batches(log_path)
+    store = SegmentStore(os.path.join(tmp, "report-store"))
+    register_record_sink(store.add_records)
+    try:
+        for batch in batches:
+            emit_syslog_lines(batch)
+    finally:
+        unregister_record_sink(store.add_records)
+        store.close()
+    export = os.path.join(tmp, "report.npz")
+    report = build_report(store.root, 0, time.time(), export=export)
+    again = build_report(source=export)
+    return {"records": report["records"], "nodes": len(per_node), "users": report["users"],
+            "load_s": report["timings"]["load"], "aggregate_s": report["timings"]["aggregate"],
+            "export_s": report["timings"]["export"],
+            "records_per_s": _rate(report["records"], report["timings"]["load"]),
+            "export_mb": round(os.path.getsize(export) / 1e6, 2), "reload_s": again["timings"]["load"],
+            "same_after_reload": again["top_users"] == report["top_users"]}
+
+
+@contextlib.contextmanager
+def _scripted_input(answers):
+    """Подставить ответы на input()/getpass() для интерактивного add_node."""
+    answers = iter(answers)
+    saved = builtins.input, getpass.getpass
+    builtins.input = lambda prompt="": next(answers)
+    getpass.getpass = lambda prompt="": "bench"
+    try:
+        yield
+    finally:
+        builtins.input, getpass.getpass = saved
+
+
+def _timed(func):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        value = func()
+    return value, time.perf_counter() - start
+
+
+def bench_fleet(server, size, workers, add_sample):
+    from rich.console import Console
+    from utils.fleet import bring_up_nodes, run_on_nodes
+    from utils.nodes import Node, add_node, remove_remote_node
+
+    quiet = Console(file=io.StringIO())
+    prefix = f"n{size}-{int(time.time() * 1000) % 100000}-"
+    nodes = []
+    for i in range(size):
+        node = Node(f"{prefix}{i}", host=server.host, port=server.port, user=f"{prefix}{i}",
+                    auth_method="password")
+        node.password = "bench"
+        nodes.append(node)
+
+    result = {"nodes": size, "workers": workers}
+    connections, commands = server.connections, server.commands
+    summary, seconds = _timed(lambda: bring_up_nodes(nodes, CENTRAL_IP, workers=workers, console=quiet))
+    ok = sum(1 for status in summary.values() if status == "готово")
+    result["bring_up_cold"] = {"seconds": round(seconds, 3), "ok": ok, "nodes_per_s": _rate(size, seconds)}
+    summary, seconds = _timed(lambda: bring_up_nodes(nodes, CENTRAL_IP, workers=workers, console=quiet))
+    ok = sum(1 for status in summary.values() if status == "готово")
+    result["bring_up_cached"] = {"seconds": round(seconds, 3), "ok": ok, "nodes_per_s": _rate(size, seconds)}
+
+    sample = min(size, add_sample)
+    added = []
+    timings = []
+    for i in range(sample):
+        name = f"{prefix}add{i}"
+        answers = ["2", name, server.host, name, str(server.port), "2"]
+        with _scripted_input(answers):
+            _, seconds = _timed(lambda: add_node(added, CENTRAL_IP))
+        timings.append(seconds * 1000)
+    timings.sort()
+    result["add_node"] = {
+        "sampled": sample, "ok": len(added),
+        "mean_ms": round(sum(timings) / len(timings), 1) if timings else None,
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 1) if timings else None,
+    }
+
+    _, seconds = _timed(lambda: run_on_nodes(nodes, lambda node: remove_remote_node(node, CENTRAL_IP),
+                                              workers=workers, console=quiet))
+    result["remove_remote_node"] = {"seconds": round(seconds, 3), "nodes_per_s": _rate(size, seconds)}
+    result["ssh_connections"] = server.connections - connections
+    result["ssh_commands"] = server.commands - commands
+    for node in nodes + added:
+        if node.conn:
+            node.conn.close()
+    return result
+
+
+def _git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _flatten(data, prefix=""):
+    flat = {}
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(base, new):
+    """Отношение new/base для общих числовых метрик → {метрика: (base, new, ratio)}."""
+    old_flat, new_flat = _flatten(base["results"]), _flatten(new["results"])
+    rows = {}
+    for key in sorted(old_flat.keys() & new_flat.keys()):
+        old, cur = old_flat[key], new_flat[key]
+        rows[key] = (old, cur, round(cur / old, 3) if old else None)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", help=f"какие замеры запускать через запятую ({','.join(BENCHMARKS)})")
+    parser.add_argument("--lines", type=int, default=200000, help="строк в сгенерированном логе")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--ips", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--fleet-sizes", default="1,10,50", help="размеры флота через запятую")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--pipeline-workers", default=f"0,1,2,4,{os.cpu_count() or 1}",
+                        help="числа процессов разбора через запятую (0 — в потоке)")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="задержка каждой SSH команды")
+    parser.add_argument("--add-sample", type=int, default=10, help="сколько нод добавлять через add_node")
+    parser.add_argument("--out", help="записать JSON в файл (иначе stdout)")
+    parser.add_argument("--compare", metavar="BASE_JSON", help="сравнить с прошлым результатом")
+    args = parser.parse_args(argv)
+    selected = args.only.split(",") if args.only else list(BENCHMARKS)
+
+    report = {
+        "meta": {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git": _git_rev(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "params": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        },
+        "results": {},
+    }
+    results = report["results"]
+    with tempfile.TemporaryDirectory(prefix="ddlog-bench-") as tmp:
+        utils.STATE_DIR = os.path.join(tmp, "state")
+        log_path = os.path.join(tmp, "xray.out.log")
+        XrayLogGenerator(args.seed, args.users, args.ips).write(log_path, args.lines)
+
+        if "parse" in selected:
+            results["parse"] = bench_parse(log_path, args.lines)
+        if "convert" in selected:
+            results["convert"] = bench_convert(log_path, tmp)
+        if "ingest" in selected:
+            results["ingest"] = bench_ingest(log_path, args.lines, tmp)
+        if "syslog" in selected:
+            results["syslog"] = bench_syslog(tmp, args.lines)
+        if "pipeline" in selected:
+            results["pipeline"] = bench_pipeline(log_path, [int(w) for w in args.pipeline_workers.split(",")])
+        if "report" in selected:
+            results["report"] = bench_report(log_path, tmp)
+
+        if "tail" in selected or "fleet" in selected:
+            from bench.fake_ssh import FakeSSHServer
+            from utils.nodes import Node
+
+            with FakeSSHServer(latency=args.latency_ms / 1000, root=os.path.join(tmp, "ssh")) as server:
+                if "tail" in selected:
+                    node = Node("bench-ssh", host=server.host, port=server.port, user="bench-ssh",
+                                auth_method="password")
+                    node.password = "bench"
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        node.connect_ssh()
+                    results["tail"] = bench_tail(log_path, args.lines, server, node)
+                    node.conn.close()
+                if "fleet" in selected:
+                    results["fleet"] = {
+                        str(size): bench_fleet(server, size, args.workers, args.add_sample)
+                        for size in (int(s) for s in args.fleet_sizes.split(","))
+                    }
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            base = json.load(f)
+        for key, (old, cur, ratio) in compare(base, report).items():
+            print(f"{key:60} {old:>14} → {cur:>14}  ×{ratio}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Замер пропускной способности приёма syslog (строк/с).
+
+  python -m bench.syslog_throughput                      # встроенный asyncio приёмник
+  python -m bench.syslog_throughput --target 127.0.0.1:514 --lf  # тот же генератор против rsyslog
+
+Для rsyslog считается только скорость отправки: сколько он успел записать,
+видно по росту /var/log/xray.log.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.syslog_server import benchmark_syslog_server, generate_load
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=500000)
+    parser.add_argument("--connections", type=int, default=200)
+    parser.add_argument("--nodes", type=int, default=50)
+    parser.add_argument("--target", help="host:port внешнего приёмника (например rsyslog)")
+    parser.add_argument("--lf", action="store_true", help="LF framing вместо octet-counting")
+    args = parser.parse_args(argv)
+
+    if args.target:
+        host, port = args.target.rsplit(":", 1)
+        rate = asyncio.run(generate_load(host, int(port), args.nodes, args.connections, args.lines,
+                                         octet_counting=not args.lf))
+        result = {"target": args.target, "send_lines_per_s": round(rate)}
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            result = benchmark_syslog_server(tmp, args.nodes, args.connections, args.lines)
+        result["target"] = "builtin"
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -29,7 +29,14 @@ a = Analysis(
         'paramiko.sftp_server',
         'paramiko.sftp_handle',
         'paramiko.sftp_file',
+        # импортируются лениво внутри функций (быстрый старт)
+        'rich',
+        'rich.console',
+        'rich.table',
+        'rich.live',
+        'requests',
     ],
+    excludes=['tkinter', 'unittest', 'pydoc', 'test'],
     noarchive=True,
     cipher=block_cipher,
 )
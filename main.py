@@ -1,43 +1,894 @@
+import os
 import sys
+import time
+import signal
+import argparse
+import multiprocessing
+import json
+import threading
 from utils.nodes import (
+    Node,
     load_nodes,
-    save_nodes,
+    store_node,
+    delete_node,
+    save_node_state,
     add_node,
+    prompt_node,
+    node_to_dict,
     remove_remote_node,
+    REMOTE_BIN_PATH,
 )
-from utils.rsyslog_setup import setup_central_rsyslog 
-from rich.console import Console
-from rich.table import Table
+from utils.rsyslog_setup import setup_central_rsyslog, remove_central_rsyslog
+from utils.inventory import get_inventory
+from utils.syslog_server import SyslogServer, DEFAULT_SYSLOG_PORT, DEFAULT_OUTPUT_DIR
 from utils.utils import get_public_ip
+from utils.fleet import bring_up_nodes, DEFAULT_WORKERS, DEFAULT_NODE_TIMEOUT
+from utils.follower import LogFollower
+from utils.ip_index import UserIPIndex, DEFAULT_WINDOWS
+from utils.local_api import LocalAPI, api_get, DEFAULT_API_PORT
+from utils.sinks import register_record_sink, register_record_enricher, emit_records, emit_syslog_lines
+from utils.geoip import GeoIP, DEFAULT_CACHE_SIZE as GEOIP_CACHE_SIZE
+from utils.segments import SegmentStore
+from utils.field_index import FieldIndex, parse_terms, FIELDS
+from utils.reports import build_report, DEFAULT_TOP as REPORT_TOP
+from utils.viewer import follow_nodes, DEFAULT_TAIL_LINES
+from utils.utils import state_file, parse_duration, parse_size, parse_time_arg
+from utils.agent import AgentReceiver, run_agent, agent_token, DEFAULT_SPOOL_DIR, DEFAULT_AGENT_PORT, DEFAULT_AGENT_BIND
+from utils.rollout import (
+    OPERATIONS as BULK_OPERATIONS, DEFAULT_WAVE_SIZE, DEFAULT_CANARY, bulk_operation, parse_budget, rollout,
+    setup_central_ufw, show_rollout, save_rollout,
+)
+from utils import metrics
+from utils.daemon import (
+    PidFile, AlreadyRunning, Supervisor, Worker, ControlServer, control_request, daemon_running,
+    REMOTE_CHECK_INTERVAL,
+)
+
+CENTRAL_LOG_PATH = "/var/log/xray.log"
+NODE_STATE_INTERVAL = 30
+
+class _LazyConsole:
+    """rich импортируется при первом выводе, а не при старте процесса."""
+
+    def __init__(self):
+        self._console = None
+
+    def get(self):
+        if self._console is None:
+            from rich.console import Console
+            self._console = Console()
+        return self._console
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
 
-console = Console()
+console = _LazyConsole()
 
 def show_nodes(nodes):
+    from rich.table import Table
     table = Table(title="Список нод")
     table.add_column("№", style="cyan", justify="right")
     table.add_column("Имя", style="green")
     table.add_column("Хост", style="yellow")
     table.add_column("Тип", style="magenta")
+    table.add_column("SSH connect, мс", justify="right")
+    table.add_column("Команда avg/max, мс", justify="right")
+    table.add_column("Данные, с назад", justify="right")
+    table.add_column("Ошибок", justify="right")
+    table.add_column("Последняя ошибка", style="red")
+    states = get_inventory().states()
+    now = time.time()
     for i, node in enumerate(nodes, 1):
-        table.add_row(str(i), node.name, node.host or "-", "локальная" if node.local else "удалённая")
+        state = states.get(node.name, {})
+        stats = node.ssh_stats() or {}
+        connect = f"{stats['connect_ms']:.0f}" if stats.get("connect_ms") is not None else "-"
+        command = "-"
+        if stats.get("command_avg_ms") is not None:
+            command = f"{stats['command_avg_ms']:.0f}/{stats['command_max_ms']:.0f}"
+        table.add_row(str(i), node.name, node.host or "-", "локальная" if node.local else "удалённая",
+                      connect, command, _ago(state.get("last_seen"), now), str(state.get("errors") or 0),
+                      state.get("last_error") or "")
     console.print(table)
 
-def main():
+def _ago(ts, now):
+    return f"{now - ts:.0f}" if ts else "-"
+
+def show_ip_limits(rows, limit, window):
+    from rich.table import Table
+    table = Table(title=f"Пользователи с > {limit} IP за {window}")
+    table.add_column("Email", style="green")
+    table.add_column("IP", style="red", justify="right")
+    geo = any("asns" in row for row in rows)
+    if geo:
+        table.add_column("ASN", justify="right")
+        table.add_column("Страны")
+    for row in rows:
+        cells = [row["email"], str(row["ips"])]
+        if geo:
+            cells += [str(row.get("asns", "-")), ",".join(row.get("countries") or []) or "-"]
+        table.add_row(*cells)
+    console.print(table)
+
+def ip_limit_query(index, limit, window):
+    return index.limit_report(limit, window)
+
+def start_api(args):
+    """Локальный API: метрики всегда, остальные маршруты добавляются позже."""
+    api = LocalAPI(port=args.api_port)
+    metrics.register_api(api)
+    try:
+        api.start()
+    except OSError as e:
+        console.print(f"[red]Локальный API не запущен:[/red] {e}")
+        return None
+    return api
+
+def start_geoip(args):
+    """Страна и ASN источника в каждой записи — по локальным базам из --geoip."""
+    paths = [path for value in args.geoip for path in value.split(",") if path]
+    start = time.perf_counter()
     try:
-        
+        geo = GeoIP(paths, cache_size=args.geoip_cache)
+    except (OSError, RuntimeError) as e:
+        console.print(f"[red]GeoIP не загружен:[/red] {e}")
+        return None
+    register_record_enricher(geo.enrich)
+    console.print(f"[green]✅ GeoIP: {geo.stats()['ranges']} диапазонов из {len(paths)} баз "
+                  f"за {time.perf_counter() - start:.1f} с[/green]")
+    return geo
+
+def start_ip_index(args, api, geo=None):
+    """Индекс IP по пользователям (кормится из всех сборщиков через sinks)."""
+    index = UserIPIndex(args.ip_windows.split(","), hll=args.ip_hll, geo=geo)
+    register_record_sink(index.add_records)
+    if api:
+        index.register_api(api)
+    return index
+
+def start_central_follower(pipeline=None):
+    """В режиме rsyslog разбираем /var/log/xray.log, чтобы кормить индексы и хранилище."""
+    if pipeline:
+        # строки уходят в пул разбора сырыми, шардами по тегу ноды
+        options = {"sinks": [pipeline.submit_lines], "parse": False}
+    else:
+        options = {"sinks": [emit_records]}
+    central = LogFollower(CENTRAL_LOG_PATH, state_path=state_file("central_xray_log.offset"),
+                          start_at_end=True, source="rsyslog", **options)
+    central.start()
+    return central
+
+def start_services(args):
+    """Хранилище, индекс IP, локальный API и настройка rsyslog центра — общее для меню и демона."""
+    services = {"store": None, "store_maintenance": None, "field_index": None, "index": None, "api": None,
+                "pipeline": None, "geoip": None}
+    if args.geoip:
+        # до хранилища и индексов: в них записи попадают уже с country/asn
+        services["geoip"] = start_geoip(args)
+    if args.storage_dir:
+        services["store"] = open_storage(args)
+        if not args.no_field_index:
+            services["field_index"] = FieldIndex(services["store"]).start()
+        register_record_sink(services["store"].add_records)
+        services["store_maintenance"] = services["store"].start_maintenance()
+    services["api"] = start_api(args)
+    if not args.no_ip_index:
+        services["index"] = start_ip_index(args, services["api"], services["geoip"])
+    if args.parse_workers:
+        from utils.pipeline import ParsePool
+        services["pipeline"] = ParsePool(args.parse_workers if args.parse_workers > 0 else None).start()
+    if args.ingest == "builtin":
+        remove_central_rsyslog()
+    else:
         console.print("[bold cyan]Запускаем setup_central_rsyslog()...[/bold cyan]")
         setup_central_rsyslog()
+    return services
+
+def stop_services(services):
+    # приёмники уже остановлены: дожидаемся разбора отправленных пачек, потом закрываем sinks
+    if services.get("pipeline"):
+        services["pipeline"].close()
+    if services.get("api"):
+        services["api"].stop()
+    if services.get("store"):
+        services["store_maintenance"].set()
+        if services.get("field_index"):
+            services["field_index"].close()
+        services["store"].close()
+
+def _start_server(server):
+    server.start_in_thread()
+    return server
+
+def ingest_components(args, services):
+    """
+    Приёмники логов на центре: [(имя, start, alive, stop)]. Меню запускает
+    их напрямую, демон — как наблюдаемые воркеры. С пулом разбора
+    (--parse-workers) строки разбираются в нём, а не в потоке приёмника.
+    """
+    pipeline = services.get("pipeline")
+    lines_sink = pipeline.submit if pipeline else emit_syslog_lines
+    components = []
+    if args.ingest == "rsyslog" and (not args.no_ip_index or args.storage_dir):
+        components.append(("central-follower", lambda: start_central_follower(pipeline),
+                           lambda f: f.is_alive(), lambda f: f.stop()))
+    if args.ingest == "builtin":
+        components.append(("syslog", lambda: _start_server(SyslogServer(
+            port=args.syslog_port, output_dir=args.syslog_dir, sinks=[lines_sink])),
+            lambda s: s.is_alive(), lambda s: s.shutdown()))
+    if args.agent_port:
+        components.append(("agent-receiver", lambda: _start_server(AgentReceiver(
+            host=args.agent_bind, port=args.agent_port, output_dir=args.syslog_dir,
+            state_path=state_file("agent_seq.json"), sinks=[lines_sink], token=agent_token())),
+            lambda s: s.is_alive(), lambda s: s.shutdown()))
+    return components
+
+def open_storage(args):
+    return SegmentStore(
+        args.storage_dir,
+        codec=args.storage_codec,
+        max_age=parse_duration(args.storage_retention) if args.storage_retention else None,
+        max_bytes=parse_size(args.storage_max_size) if args.storage_max_size else None,
+    )
+
+def print_range(args):
+    """Вывести записи хранилища за интервал (--read-range FROM TO)."""
+    store = open_storage(args)
+    start, end = (parse_time_arg(v) for v in args.read_range)
+    nodes = args.node.split(",") if args.node else None
+    for record in store.read_range(start, end, nodes):
+        console.print(record.get("message", ""), markup=False, highlight=False)
+
+def print_query(storage_dir, terms, since, until=None, nodes=None):
+    """Найти записи по индексу полей и выводить их по мере чтения из сегментов."""
+    store = SegmentStore(storage_dir)
+    started = time.monotonic()
+    found = 0
+    try:
+        for record in FieldIndex(store).query(terms, since, until, nodes):
+            console.print(record.get("message", ""), markup=False, highlight=False)
+            found += 1
+    except KeyboardInterrupt:
+        pass
+    console.print(f"[cyan]Найдено строк: {found} за {time.monotonic() - started:.3f} с[/cyan]")
+
+def ask_query(storage_dir):
+    """Спросить условия поиска по индексу и вывести совпадения."""
+    if not storage_dir:
+        console.print("[red]Поиск работает по хранилищу — запустите с --storage-dir.[/red]")
+        return
+    raw = input(f"Условия через пробел ({', '.join(f + '=...' for f in FIELDS)}): ").strip()
+    try:
+        terms = parse_terms(raw.split())
+        since = parse_time_arg(input("С какого момента (6h / 2024-01-02T15:00, по умолчанию 24h): ").strip() or "24h")
+    except ValueError as e:
+        console.print(f"[red]{e}[/red]")
+        return
+    if not terms:
+        console.print("[red]Нужно хотя бы одно условие.[/red]")
+        return
+    print_query(storage_dir, terms, since)
+
+def _hour(ts):
+    return time.strftime("%Y-%m-%d %H:00", time.localtime(ts))
+
+def print_report(report):
+    """Сводка build_report(): часы, пользователи, назначения, текучесть IP."""
+    from rich.table import Table
+    if not report["records"]:
+        console.print("[yellow]За интервал нет записей.[/yellow]")
+        return
+    churn = f"{report['churn']:.1%}" if report["churn"] is not None else "-"
+    console.print(f"[bold]Записей:[/bold] {report['records']}  [bold]пользователей:[/bold] {report['users']}  "
+                  f"[bold]IP:[/bold] {report['ips']}  [bold]назначений:[/bold] {report['dests']}  "
+                  f"[bold]текучесть IP:[/bold] {churn}  ({_hour(report['start'])} — {_hour(report['end'])})")
+
+    table = Table(title="Подключения по часам")
+    table.add_column("Час", style="cyan")
+    table.add_column("Подключений", justify="right")
+    for ts, count in report["hours"]:
+        table.add_row(_hour(ts), str(count))
+    console.print(table)
+
+    table = Table(title=f"Топ {len(report['top_users'])} пользователей")
+    table.add_column("Email", style="green")
+    table.add_column("Подключений", justify="right")
+    table.add_column("IP", style="red", justify="right")
+    asns = any("asns" in row for row in report["top_users"])
+    if asns:
+        table.add_column("ASN", justify="right")
+    table.add_column("Часов", justify="right")
+    table.add_column("Пик/час", justify="right")
+    table.add_column("Текучесть", justify="right")
+    for row in report["top_users"]:
+        cells = [row["email"], str(row["connections"]), str(row["ips"])]
+        if asns:
+            cells.append(str(row.get("asns", "-")))
+        cells += [str(row["active_hours"]), str(row["peak_hour"]),
+                  f"{row['churn']:.1%}" if row["churn"] is not None else "-"]
+        table.add_row(*cells)
+    console.print(table)
+
+    table = Table(title=f"Топ {len(report['top_dests'])} назначений")
+    table.add_column("Назначение", style="cyan")
+    table.add_column("Подключений", justify="right")
+    table.add_column("Пользователей", justify="right")
+    for row in report["top_dests"]:
+        table.add_row(row["dest"], str(row["connections"]), str(row["users"]))
+    console.print(table)
+    timings = ", ".join(f"{k} {v:.2f} с" for k, v in report["timings"].items())
+    console.print(f"[cyan]Время: {timings}[/cyan]")
+
+def run_report(storage_dir, since, until=None, nodes=None, source=None, export=None, top=REPORT_TOP,
+               workers=None, json_path=None):
+    try:
+        report = build_report(storage_dir, since, until, nodes, source=source, export=export, top=top,
+                              workers=workers)
+    except (OSError, RuntimeError, ValueError) as e:
+        console.print(f"[red]Отчёт не построен:[/red] {e}")
+        return
+    print_report(report)
+    if export:
+        console.print(f"[green]✅ Колонки сохранены в {export}[/green]")
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False)
+        console.print(f"[green]✅ Сводка (с подключениями по пользователям и часам) — {json_path}[/green]")
+
+def ask_report(storage_dir):
+    """Спросить интервал и построить отчёт по хранилищу."""
+    if not storage_dir:
+        console.print("[red]Отчёт строится по хранилищу — запустите с --storage-dir.[/red]")
+        return
+    try:
+        since = parse_time_arg(input("С какого момента (6h / 2024-01-02T15:00, по умолчанию 24h): ").strip() or "24h")
+    except ValueError as e:
+        console.print(f"[red]{e}[/red]")
+        return
+    export = input("Сохранить колонки в файл (.npz / .parquet, Enter — нет): ").strip() or None
+    run_report(storage_dir, since, export=export)
+
+def select_nodes(nodes, sel):
+    """'1,3' / 'all' → список нод или [] при некорректном вводе."""
+    if sel.lower() == "all":
+        return list(nodes)
+    picked = []
+    for part in sel.split(","):
+        part = part.strip()
+        if not part.isdigit() or not 1 <= int(part) <= len(nodes):
+            return []
+        picked.append(nodes[int(part) - 1])
+    return picked
+
+def ask_view_options():
+    """Спросить, откуда начинать и что фильтровать при живом просмотре."""
+    options = {}
+    start = input(f"С какого места: число строк (по умолчанию {DEFAULT_TAIL_LINES}) или время (6h / 2024-01-02T15:00): ").strip()
+    if start.isdigit():
+        options["lines"] = int(start)
+    elif start:
+        try:
+            options["since"] = parse_time_arg(start)
+        except ValueError:
+            console.print("[red]Не понял время, показываем последние строки.[/red]")
+    for key, prompt in (("email", "Фильтр по email"), ("ip", "Фильтр по IP"), ("regex", "Фильтр regex")):
+        value = input(f"{prompt} (Enter — без фильтра): ").strip()
+        if value:
+            options[key] = value
+    return options
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Сбор xray логов с нод")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="сколько нод поднимать параллельно")
+    parser.add_argument("--node-timeout", type=float, default=DEFAULT_NODE_TIMEOUT,
+                        help="таймаут запуска одной удалённой ноды, секунд")
+    parser.add_argument("--sequential", action="store_true",
+                        help="поднимать ноды по одной, как раньше")
+    parser.add_argument("--ingest", choices=["rsyslog", "builtin"], default="rsyslog",
+                        help="кто принимает логи удалённых нод на центральном сервере")
+    parser.add_argument("--syslog-port", type=int, default=DEFAULT_SYSLOG_PORT,
+                        help="порт встроенного приёмника (--ingest builtin)")
+    parser.add_argument("--syslog-dir", default=DEFAULT_OUTPUT_DIR,
+                        help="каталог для файлов <нода>.log встроенного приёмника")
+    parser.add_argument("--no-ip-index", action="store_true",
+                        help="не вести индекс IP по пользователям")
+    parser.add_argument("--ip-windows", default=",".join(DEFAULT_WINDOWS),
+                        help="скользящие окна индекса IP через запятую")
+    parser.add_argument("--ip-hll", action="store_true",
+                        help="HyperLogLog вместо точных множеств IP (для очень многих пользователей)")
+    parser.add_argument("--api-port", type=int, default=DEFAULT_API_PORT,
+                        help="порт локального API на 127.0.0.1 (/metrics, /ip-limit, ...)")
+    parser.add_argument("--ip-query", type=int, metavar="N",
+                        help="спросить у запущенного экземпляра пользователей с > N IP и выйти")
+    parser.add_argument("--window", help="окно для --ip-query (по умолчанию наименьшее)")
+    parser.add_argument("--storage-dir",
+                        help="писать логи в почасовые сжатые сегменты в этом каталоге")
+    parser.add_argument("--storage-codec", choices=["gzip", "zstd"], default="gzip")
+    parser.add_argument("--storage-retention", default="14d",
+                        help="сколько хранить сегменты (например 14d); пусто — бессрочно")
+    parser.add_argument("--storage-max-size",
+                        help="предельный объём сжатых сегментов (например 50G)")
+    parser.add_argument("--read-range", nargs=2, metavar=("FROM", "TO"),
+                        help="вывести записи из --storage-dir за интервал (ISO время или 6h назад) и выйти")
+    parser.add_argument("--node", help="ноды через запятую для --read-range, --query и --bulk")
+    parser.add_argument("--query", nargs="+", metavar="FIELD=VALUE",
+                        help="найти строки в хранилище по индексу: email=..., ip=..., dest=... (условия через И)")
+    parser.add_argument("--since", default="24h", help="начало интервала для --query (6h / ISO время)")
+    parser.add_argument("--until", help="конец интервала для --query (по умолчанию сейчас)")
+    parser.add_argument("--report", action="store_true",
+                        help="отчёт по хранилищу за --since/--until (--node): пользователи, назначения, текучесть IP")
+    parser.add_argument("--report-top", type=int, default=REPORT_TOP, metavar="N", help="строк в топах отчёта")
+    parser.add_argument("--report-export", metavar="PATH", help="сохранить колонки отчёта в .npz или .parquet")
+    parser.add_argument("--report-from", metavar="PATH", help="строить отчёт по ранее сохранённому .npz/.parquet")
+    parser.add_argument("--report-json", metavar="PATH", help="записать сводку отчёта в JSON")
+    parser.add_argument("--report-workers", type=int, default=1, metavar="N",
+                        help="процессов для чтения хранилища в отчёте (ноды делятся между ними)")
+    parser.add_argument("--parse-workers", type=int, default=0, metavar="N",
+                        help="разбирать строки в N процессах, шардами по нодам (-1 — по числу ядер; "
+                             "0 — в потоке приёмника)")
+    parser.add_argument("--geoip", action="append", default=[], metavar="PATH",
+                        help="локальная база GeoIP/ASN: .mmdb или CSV/TSV диапазонов (можно несколько)")
+    parser.add_argument("--geoip-cache", type=int, default=GEOIP_CACHE_SIZE, metavar="N",
+                        help="размер LRU кэша адресов для --geoip")
+    parser.add_argument("--no-field-index", action="store_true",
+                        help="не строить индекс email/IP/назначения по хранилищу")
+    parser.add_argument("--agent-port", type=int,
+                        help="принимать логи от агентов-форвардеров на этом порту и запускать агентов на удалённых нодах")
+    parser.add_argument("--agent-bind", default=DEFAULT_AGENT_BIND,
+                        help="адрес, на котором слушает приёмник агентов")
+    parser.add_argument("--agent-token",
+                        help="общий секрет агента и центра (для --agent; центр берёт DDLOG_AGENT_TOKEN или "
+                             "создаёт свой и передаёт его агентам при запуске)")
+    parser.add_argument("--agent", action="store_true",
+                        help="режим агента на ноде: читать xray лог и пересылать пачками на центр")
+    parser.add_argument("--central", metavar="HOST:PORT", help="центральный сервер для --agent")
+    parser.add_argument("--name", help="имя ноды для --agent (по умолчанию hostname)")
+    parser.add_argument("--spool-dir", default=DEFAULT_SPOOL_DIR,
+                        help="каталог дисковой очереди агента")
+    parser.add_argument("--public-ip",
+                        help="публичный IP центрального сервера (иначе определяется автоматически)")
+    parser.add_argument("--bulk", choices=BULK_OPERATIONS,
+                        help="массовая операция над удалёнными нодами (--node или все): конфиг rsyslog, правила UFW, "
+                             "загрузка --artifact, запуск агента, удаление")
+    parser.add_argument("--wave-size", type=int, default=DEFAULT_WAVE_SIZE, help="нод в одной волне --bulk")
+    parser.add_argument("--canary", type=int, default=DEFAULT_CANARY,
+                        help="сколько первых нод обработать отдельной волной до остальных (0 — без canary)")
+    parser.add_argument("--max-failures", default="0",
+                        help="бюджет ошибок --bulk: число нод или процент (10%%), сверх него волны останавливаются")
+    parser.add_argument("--artifact", help="локальный файл для --bulk upload/agent (по умолчанию — этот бинарник)")
+    parser.add_argument("--remote-path", default=REMOTE_BIN_PATH, help="куда класть --artifact на нодах")
+    parser.add_argument("--daemon", action="store_true",
+                        help="фоновый режим (systemd): без меню, управление через Unix сокет; "
+                             "повторный запуск без --daemon подключается к нему")
+    return parser.parse_args(argv)
+
+def daemon_socket():
+    return state_file("daemon.sock")
+
+def select_bulk_nodes(names):
+    """Удалённые ноды из базы: все или перечисленные (в указанном порядке — первые станут canary)."""
+    remote = {node.name: node for node in load_nodes() if not node.local}
+    if not names:
+        return list(remote.values())
+    names = list(dict.fromkeys(name.strip() for name in names.split(",") if name.strip()))
+    unknown = [name for name in names if name not in remote]
+    if unknown:
+        raise ValueError(f"нет удалённых нод: {', '.join(unknown)}")
+    return [remote[name] for name in names]
+
+def rsyslog_port(args):
+    """Порт, на который rsyslog нод шлёт логи: встроенному приёмнику — --syslog-port, иначе 514."""
+    return args.syslog_port if args.ingest == "builtin" else DEFAULT_SYSLOG_PORT
+
+def ingest_port(args):
+    """Порт, на который ноды шлют логи центру: агентам — --agent-port, rsyslog — rsyslog_port()."""
+    return args.agent_port or rsyslog_port(args)
+
+def run_bulk(args):
+    """--bulk: операция над нодами волнами, итог — таблица и JSON в каталоге состояния."""
+    try:
+        nodes = select_bulk_nodes(args.node)
+        if not nodes:
+            console.print("[red]Нет удалённых нод.[/red]")
+            return 1
+        artifact = args.artifact or (sys.executable if getattr(sys, "frozen", False) else None)
+        central_server_ip = None if args.bulk == "upload" else get_public_ip(args.public_ip)
+        remove_node = None
+        sock = daemon_socket()
+        if args.bulk == "remove" and daemon_running(sock):
+            # ноду ведёт демон — удаляем через него, иначе он продолжит её опрашивать
+            remove_node = lambda node: control_request(sock, "remove_node", timeout=300, name=node.name,
+                                                       bin_path=args.remote_path)
+        operation = bulk_operation(args.bulk, central_server_ip, args.agent_port or DEFAULT_AGENT_PORT, artifact,
+                                   args.remote_path, remove_node,
+                                   rsyslog_port(args) if args.bulk == "rsyslog" else ingest_port(args))
+        budget = parse_budget(args.max_failures, len(nodes))
+    except (OSError, ValueError) as e:
+        console.print(f"[red]{e}[/red]")
+        return 1
+    if args.bulk == "ufw":
+        setup_central_ufw(nodes, ingest_port(args))
+    report = rollout(nodes, operation, wave_size=args.wave_size, canary=args.canary, max_failures=budget,
+                     workers=args.workers, node_timeout=args.node_timeout, console=console.get(),
+                     title=f"--bulk {args.bulk}")
+    show_rollout(report, console.get())
+    console.print(f"[cyan]Отчёт: {save_rollout(report)}[/cyan]")
+    return 0 if not report["failures"] and not report["stopped"] else 1
+
+def node_worker(node, central_server_ip, args, gate):
+    """
+    Воркер сбора с одной ноды: follower для локальной, rsyslog/агент для удалённой.
+    Запуски, проверки и ошибки пишутся в состояние ноды в базе.
+    """
+    inventory = get_inventory()
+
+    def start():
+        try:
+            if node.local:
+                node.start_local_tail_in_background()
+            elif not node.start_background_log_collection(central_server_ip, args.agent_port, rsyslog_port(args)):
+                error = node.conn.last_error if node.conn else None
+                raise RuntimeError(error or "не удалось запустить сбор логов")
+        except Exception as e:
+            inventory.record_error(node.name, e)
+            raise
+        inventory.record_ok(node.name)
+        return node
+
+    def alive(n):
+        ok = n.collection_alive(args.agent_port)
+        if not ok:
+            inventory.record_error(node.name, "сбор остановился", status="упал")
+        elif not node.local:
+            inventory.record_ok(node.name)
+        return ok
+
+    return Worker(f"node:{node.name}", start, alive,
+                  stop=lambda n: n.stop_background_log_collection(),
+                  check_interval=1.0 if node.local else REMOTE_CHECK_INTERVAL,
+                  gate=None if node.local else gate)
+
+def record_bring_up(summary):
+    """Итоги параллельного запуска — в состояние нод."""
+    inventory = get_inventory()
+    for name, status in summary.items():
+        if status == "готово":
+            inventory.record_ok(name)
+        else:
+            inventory.record_error(name, f"запуск сбора: {status}")
+
+def _needs_password(node):
+    return not node.local and node.auth_method != "key" and node.password is None
+
+def daemon_handlers(args, services, supervisor, nodes, central_server_ip, gate):
+    """Команды Unix сокета демона."""
+    lock = threading.Lock()
+    started = time.time()
+
+    def find(name):
+        for node in nodes:
+            if node.name == name:
+                return node
+        raise ValueError(f"нет ноды '{name}'")
+
+    def launch(node):
+        if not _needs_password(node):
+            supervisor.add(node_worker(node, central_server_ip, args, gate))
+
+    def node_list():
+        workers = {w["name"]: w for w in supervisor.status()}
+        states = get_inventory().states()
+        result = []
+        for node in nodes:
+            state = states.get(node.name, {})
+            info = dict(node_to_dict(node), local=node.local, last_seen=state.get("last_seen"),
+                        errors=state.get("errors") or 0)
+            worker = workers.get(f"node:{node.name}")
+            if worker:
+                info.update(status=worker["status"], restarts=worker["restarts"], last_error=worker["last_error"])
+            else:
+                info.update(status="нужен пароль" if _needs_password(node) else "не запущен", restarts=0,
+                            last_error=None)
+            result.append(info)
+        return result
+
+    def add(password=None, **spec):
+        with lock:
+            if any(n.name == spec.get("name") for n in nodes):
+                raise ValueError(f"нода '{spec.get('name')}' уже есть")
+            node = Node(**spec)
+            node.password = password
+            store_node(node)
+            nodes.append(node)
+        if node.local:
+            node.convert_old_log_to_json()
+        launch(node)
+        return node.name
+
+    def remove(name, force=False, bin_path=REMOTE_BIN_PATH):
+        with lock:
+            node = find(name)
+            supervisor.remove(f"node:{name}")
+        # очистка на самой ноде — вне lock, чтобы массовое удаление шло параллельно;
+        # из списка нода уходит только после неё (или с force), иначе повторить было бы нечем
+        if not node.local and not remove_remote_node(node, central_server_ip, ingest_port(args), bin_path) \
+                and not force:
+            raise RuntimeError(f"очистка на ноде '{name}' с ошибками, сбор с неё остановлен, но нода "
+                               "оставлена в списке")
+        with lock:
+            delete_node(node)
+            if node in nodes:
+                nodes.remove(node)
+        return name
+
+    def set_password(name, password):
+        node = find(name)
+        node.password = password
+        launch(node)
+        return name
+
+    def ip_limit(limit, window=None):
+        if services.get("index") is None:
+            raise ValueError("индекс IP выключен (--no-ip-index)")
+        return ip_limit_query(services["index"], int(limit), window or args.ip_windows.split(",")[0])
+
+    return {
+        "ping": lambda: {"pid": os.getpid()},
+        "status": lambda: {"pid": os.getpid(), "uptime": round(time.time() - started),
+                           "central_server_ip": central_server_ip, "storage_dir": args.storage_dir,
+                           "workers": supervisor.status()},
+        "nodes": node_list,
+        "add_node": add,
+        "remove_node": remove,
+        "set_password": set_password,
+        "ip_limit": ip_limit,
+        "metrics": metrics.snapshot,
+    }
+
+def run_daemon(args):
+    """
+    Фоновый режим для systemd: один экземпляр (flock), все сборщики — воркеры
+    с перезапуском, по SIGTERM буферы сбрасываются и смещения сохраняются.
+    Меню подключается к нему через Unix сокет.
+    """
+    try:
+        pidfile = PidFile(state_file("daemon.pid")).acquire()
+    except AlreadyRunning as e:
+        print(f"❌ Демон {e}")
+        return 1
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    supervisor = Supervisor()
+    services = {}
+    nodes = []
+    control = None
+    try:
+        services = start_services(args)
+        for name, start, alive, stop_component in ingest_components(args, services):
+            supervisor.add(Worker(name, start, alive, stop_component))
+
+        nodes = load_nodes()
+        central_server_ip = get_public_ip(args.public_ip)
+        if central_server_ip is None and any(not n.local for n in nodes):
+            print("⚠️ Публичный IP не определён — удалённые ноды не запускаются, укажите --public-ip.")
+        gate = threading.Semaphore(max(1, args.workers))
+        handlers = daemon_handlers(args, services, supervisor, nodes, central_server_ip, gate)
+        for node in nodes:
+            if _needs_password(node):
+                print(f"⚠️ Нода {node.name}: нужен SSH пароль, задайте его из меню (подключение к демону).")
+            elif node.local or central_server_ip:
+                supervisor.add(node_worker(node, central_server_ip, args, gate))
+
+        control = ControlServer(daemon_socket(), handlers)
+        control.start()
+        print(f"✅ Демон запущен (pid {os.getpid()}), нод: {len(nodes)}")
+        last_state = time.monotonic()
+        while not stop.wait(1.0):
+            if time.monotonic() - last_state >= NODE_STATE_INTERVAL:
+                save_node_state(list(nodes))
+                last_state = time.monotonic()
+        print("Остановка демона...")
+    finally:
+        if control:
+            control.stop()
+        # сначала сборщики (follower'ы сбрасывают буферы и смещения), потом приёмники и хранилище
+        supervisor.stop_all()
+        if nodes:
+            save_node_state(nodes)
+        stop_services(services)
+        pidfile.release()
+    return 0
+
+def show_daemon_nodes(rows):
+    from rich.table import Table
+    table = Table(title="Ноды демона")
+    table.add_column("№", style="cyan", justify="right")
+    table.add_column("Имя", style="green")
+    table.add_column("Хост", style="yellow")
+    table.add_column("Тип", style="magenta")
+    table.add_column("Статус")
+    table.add_column("Перезапуски", justify="right")
+    table.add_column("Данные, с назад", justify="right")
+    table.add_column("Ошибок всего", justify="right")
+    table.add_column("Ошибка", style="red")
+    now = time.time()
+    for i, row in enumerate(rows, 1):
+        table.add_row(str(i), row["name"], row["host"] or "-", "локальная" if row["local"] else "удалённая",
+                      row["status"], str(row["restarts"]), _ago(row["last_seen"], now), str(row["errors"]),
+                      row["last_error"] or "")
+    console.print(table)
+
+def attached_menu(args):
+    """Меню поверх запущенного демона: все действия выполняет демон, здесь только ввод и вывод."""
+    sock = daemon_socket()
+    status = control_request(sock, "status")
+    console.print(f"[bold green]Подключено к демону[/bold green] (pid {status['pid']}, "
+                  f"воркеров: {len(status['workers'])})")
+    for row in control_request(sock, "nodes"):
+        if row["status"] == "нужен пароль":
+            node = Node(**{k: row[k] for k in ("name", "host", "user", "port", "auth_method", "key_path")})
+            node.ensure_password()
+            control_request(sock, "set_password", name=node.name, password=node.password)
+
+    while True:
+        console.print("\n[bold magenta]=== Главное меню (демон) ===[/bold magenta]")
+        console.print("1. Добавить ноду")
+        console.print("2. Посмотреть список нод")
+        console.print("3. Просмотр логов ноды в реальном времени")
+        console.print("4. Удалить ноду")
+        console.print("5. Пользователи с превышением лимита IP")
+        console.print("6. Поиск по логам (email / IP / назначение)")
+        console.print("7. Отчёт по логам (пользователи, назначения, текучесть IP)")
+        console.print("8. Метрики сбора (живая панель)")
+        console.print("9. Выход (демон продолжит работу)")
+        choice = input("Выбор: ").strip()
+        try:
+            if choice == "1":
+                node = prompt_node()
+                if node is None:
+                    continue
+                node.ensure_password()
+                name = control_request(sock, "add_node", password=node.password, **node_to_dict(node))
+                console.print(f"[green]✅ Нода '{name}' передана демону, статус — в списке нод.[/green]")
+            elif choice in ("2", "3", "4"):
+                rows = control_request(sock, "nodes")
+                if not rows:
+                    console.print("[red]Нет добавленных нод.[/red]")
+                    continue
+                show_daemon_nodes(rows)
+                if choice == "3":
+                    nodes = [Node(**{k: r[k] for k in ("name", "host", "user", "port", "auth_method", "key_path")})
+                             for r in rows]
+                    selected = select_nodes(nodes, input("Номера нод через запятую или 'all': ").strip())
+                    if selected:
+                        follow_nodes(selected, console=console.get(), **ask_view_options())
+                    else:
+                        console.print("[red]Некорректный выбор.[/red]")
+                elif choice == "4":
+                    sel = input("Выберите номер ноды для удаления: ").strip()
+                    if sel.isdigit() and 1 <= int(sel) <= len(rows):
+                        name = rows[int(sel) - 1]["name"]
+                        if input(f"Точно удалить {name}? (y/N): ").strip().lower() == "y":
+                            try:
+                                control_request(sock, "remove_node", timeout=300, name=name)
+                            except RuntimeError as e:
+                                console.print(f"[red]{e}[/red]")
+                                if input("Удалить из списка без очистки? (y/N): ").strip().lower() != "y":
+                                    continue
+                                control_request(sock, "remove_node", timeout=300, name=name, force=True)
+                            console.print(f"[green]✅ Нода '{name}' удалена.[/green]")
+                    else:
+                        console.print("[red]Некорректный выбор.[/red]")
+            elif choice == "5":
+                limit = input("Сколько IP допустимо на пользователя: ").strip()
+                window = input(f"Окно ({args.ip_windows}): ").strip() or args.ip_windows.split(",")[0]
+                if not limit.isdigit():
+                    console.print("[red]Некорректный лимит.[/red]")
+                    continue
+                show_ip_limits(control_request(sock, "ip_limit", limit=int(limit), window=window), limit, window)
+            elif choice == "6":
+                ask_query(control_request(sock, "status")["storage_dir"])
+            elif choice == "7":
+                ask_report(control_request(sock, "status")["storage_dir"])
+            elif choice == "8":
+                metrics.live_dashboard(console.get(), fetch=lambda: control_request(sock, "metrics"))
+            elif choice == "9":
+                console.print("[bold red]Выход...[/bold red]")
+                break
+            else:
+                console.print("[red]Некорректный выбор.[/red]")
+        except (RuntimeError, OSError) as e:
+            console.print(f"[red]Ошибка демона: {e}[/red]")
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.agent:
+        if not args.central:
+            print("❌ Для --agent нужен --central HOST:PORT")
+            return
+        run_agent(args.central, name=args.name, spool_dir=args.spool_dir, token=args.agent_token)
+        return
+    if args.ip_query is not None:
+        window = args.window or args.ip_windows.split(",")[0]
+        try:
+            rows = api_get(f"/ip-limit?limit={args.ip_query}&window={window}", port=args.api_port)
+        except Exception as e:
+            console.print(f"[bold red]Нет ответа от запущенного экземпляра:[/bold red] {e}")
+            return
+        show_ip_limits(rows, args.ip_query, window)
+        return
+    if args.read_range:
+        if not args.storage_dir:
+            console.print("[red]Для --read-range нужен --storage-dir.[/red]")
+            return
+        print_range(args)
+        return
+    if args.query:
+        if not args.storage_dir:
+            console.print("[red]Для --query нужен --storage-dir.[/red]")
+            return
+        try:
+            terms = parse_terms(args.query)
+            since = parse_time_arg(args.since)
+            until = parse_time_arg(args.until) if args.until else None
+        except ValueError as e:
+            console.print(f"[red]{e}[/red]")
+            return
+        print_query(args.storage_dir, terms, since, until, args.node.split(",") if args.node else None)
+        return
+    if args.report or args.report_from:
+        if not args.storage_dir and not args.report_from:
+            console.print("[red]Для --report нужен --storage-dir или --report-from.[/red]")
+            return
+        try:
+            since = parse_time_arg(args.since)
+            until = parse_time_arg(args.until) if args.until else None
+        except ValueError as e:
+            console.print(f"[red]{e}[/red]")
+            return
+        run_report(args.storage_dir, since, until, args.node.split(",") if args.node else None,
+                   source=args.report_from, export=args.report_export, top=args.report_top,
+                   workers=args.report_workers, json_path=args.report_json)
+        return
+    if args.bulk:
+        sys.exit(run_bulk(args))
+    if args.daemon:
+        sys.exit(run_daemon(args))
+    if daemon_running(daemon_socket()):
+        try:
+            attached_menu(args)
+        except KeyboardInterrupt:
+            console.print("\n[bold red]Выход по Ctrl+C[/bold red]")
+        return
+
+    nodes = []
+    services = {}
+    components = []
+    try:
+        services = start_services(args)
+        index = services["index"]
+        for name, start, alive, stop_component in ingest_components(args, services):
+            components.append((start(), stop_component))
 
         console.print("[bold cyan]Загружаем ноды...[/bold cyan]")
         nodes = load_nodes()
         console.print(f"[bold green]Загружено нод:[/bold green] {len(nodes)}")
 
-        central_server_ip = get_public_ip()
+        central_server_ip = get_public_ip(args.public_ip)
+        if central_server_ip is None:
+            central_server_ip = input("Не удалось определить публичный IP, введите его вручную: ").strip() or None
         console.print(f"Central server IP: '{central_server_ip}'")
 
-        for node in nodes:
-            console.print(f"[bold yellow]Запускаем фоновый сбор логов:[/bold yellow] {node.name}")
-            node.start_background_log_collection(central_server_ip)
+        if args.sequential:
+            for node in nodes:
+                console.print(f"[bold yellow]Запускаем фоновый сбор логов:[/bold yellow] {node.name}")
+                node.start_background_log_collection(central_server_ip, args.agent_port, rsyslog_port(args))
+        elif nodes:
+            summary = bring_up_nodes(nodes, central_server_ip, workers=args.workers,
+                                     node_timeout=args.node_timeout, console=console.get(),
+                                     agent_port=args.agent_port, syslog_port=rsyslog_port(args))
+            record_bring_up(summary)
 
         while True:
             console.print("\n[bold magenta]=== Главное меню ===[/bold magenta]")
@@ -45,12 +896,15 @@ def main():
             console.print("2. Посмотреть список нод")
             console.print("3. Просмотр логов ноды в реальном времени")
             console.print("4. Удалить ноду")
-            console.print("5. Выход")
+            console.print("5. Пользователи с превышением лимита IP")
+            console.print("6. Поиск по логам (email / IP / назначение)")
+            console.print("7. Отчёт по логам (пользователи, назначения, текучесть IP)")
+            console.print("8. Метрики сбора (живая панель)")
+            console.print("9. Выход")
             choice = input("Выбор: ").strip()
 
             if choice == "1":
-                add_node(nodes, central_server_ip)
-                save_nodes(nodes)
+                add_node(nodes, central_server_ip, args.agent_port, rsyslog_port(args))
             elif choice == "2":
                 if not nodes:
                     console.print("[red]Нет добавленных нод.[/red]")
@@ -61,9 +915,10 @@ def main():
                     console.print("[red]Нет нод для просмотра.[/red]")
                     continue
                 show_nodes(nodes)
-                sel = input("Выберите номер ноды: ").strip()
-                if sel.isdigit() and 1 <= int(sel) <= len(nodes):
-                    nodes[int(sel) - 1].tail_logs_realtime()
+                sel = input("Номера нод через запятую или 'all': ").strip()
+                selected = select_nodes(nodes, sel)
+                if selected:
+                    follow_nodes(selected, console=console.get(), **ask_view_options())
                 else:
                     console.print("[red]Некорректный выбор.[/red]")
             elif choice == "4":
@@ -76,13 +931,34 @@ def main():
                     node = nodes[int(sel) - 1]
                     confirm = input(f"Точно удалить {node.name}? (y/N): ").strip().lower()
                     if confirm == "y":
-                        remove_remote_node(node, central_server_ip)
+                        if not node.local and not remove_remote_node(node, central_server_ip, ingest_port(args)) and \
+                                input("Очистка на ноде с ошибками. Удалить из списка? (y/N): ").strip().lower() != "y":
+                            continue
+                        delete_node(node)
                         nodes.pop(int(sel) - 1)
-                        save_nodes(nodes)
                         console.print(f"[green]✅ Нода '{node.name}' удалена.[/green]")
                 else:
                     console.print("[red]Некорректный выбор.[/red]")
             elif choice == "5":
+                if index is None:
+                    console.print("[red]Индекс IP выключен (--no-ip-index).[/red]")
+                    continue
+                limit = input("Сколько IP допустимо на пользователя: ").strip()
+                window = input(f"Окно ({args.ip_windows}): ").strip() or args.ip_windows.split(",")[0]
+                if not limit.isdigit():
+                    console.print("[red]Некорректный лимит.[/red]")
+                    continue
+                try:
+                    show_ip_limits(ip_limit_query(index, int(limit), window), limit, window)
+                except ValueError as e:
+                    console.print(f"[red]{e}[/red]")
+            elif choice == "6":
+                ask_query(args.storage_dir)
+            elif choice == "7":
+                ask_report(args.storage_dir)
+            elif choice == "8":
+                metrics.live_dashboard(console.get())
+            elif choice == "9":
                 console.print("[bold red]Выход...[/bold red]")
                 break
             else:
@@ -91,6 +967,17 @@ def main():
         console.print("\n[bold red]Выход по Ctrl+C[/bold red]")
     except Exception as e:
         console.print(f"[bold red]Ошибка в main():[/bold red] {e}")
+    finally:
+        # сбрасываем буферы локальных follower'ов и сохраняем смещения
+        for node in nodes:
+            node.stop_background_log_collection()
+        save_node_state(nodes)
+        for handle, stop_component in reversed(components):
+            stop_component(handle)
+        stop_services(services)
 
 if __name__ == "__main__":
+    # в собранном PyInstaller бинарнике spawn-процессы (ParsePool, --report-workers)
+    # запускают этот же файл: freeze_support() превращает их в рабочих, а не в новый main()
+    multiprocessing.freeze_support()
     main()
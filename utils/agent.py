@@ -0,0 +1,427 @@
+import asyncio
+import hmac
+import json
+import os
+import secrets
+import signal
+import socket
+import struct
+import threading
+import zlib
+from utils.follower import LogFollower, SinkRejected, XRAY_LOG_PATH
+from utils.syslog_server import NodeWriters, ThreadedServerMixin, DEFAULT_OUTPUT_DIR
+from utils.utils import read_json, write_json_atomic, state_file
+from utils import metrics
+from utils.daemon import PidFile, AlreadyRunning
+
+DEFAULT_AGENT_PORT = 5140
+DEFAULT_AGENT_BIND = "0.0.0.0"
+AGENT_TOKEN_ENV = "DDLOG_AGENT_TOKEN"
+AGENT_TOKEN_FILE = "agent_token"
+DEFAULT_SPOOL_DIR = "/var/lib/ddlog-xray-forwarding/spool"
+DEFAULT_BATCH_BYTES = 256 * 1024
+DEFAULT_SPOOL_BYTES = 512 * 1024 * 1024
+DEFAULT_WINDOW = 8
+ACK_TIMEOUT = 30
+RECONNECT_MAX = 60
+
+# Кадр: magic, тип, seq, длина полезной нагрузки
+_HEADER = struct.Struct("!4sBQI")
+MAGIC = b"DDLA"
+HELLO, BATCH, ACK = 1, 2, 3
+# распакованная пачка агента: batch_bytes с запасом на последнюю строку
+MAX_BATCH = 16 * 1024 * 1024
+MAX_PAYLOAD = MAX_BATCH
+
+
+def agent_token():
+    """
+    Общий секрет агентов и центра: из DDLOG_AGENT_TOKEN или файла в каталоге
+    состояния центра (создаётся при первом запуске). run_remote_binary
+    передаёт его агентам в том же DDLOG_AGENT_TOKEN.
+    """
+    token = os.environ.get(AGENT_TOKEN_ENV)
+    if token:
+        return token
+    path = state_file(AGENT_TOKEN_FILE)
+    token = (read_json(path) or {}).get("token")
+    if not token:
+        token = secrets.token_hex(16)
+        write_json_atomic(path, {"token": token})
+        os.chmod(path, 0o600)
+    return token
+
+
+def decompress_batch(payload):
+    """zlib пачки не больше MAX_BATCH после распаковки, иначе ValueError."""
+    d = zlib.decompressobj()
+    try:
+        data = d.decompress(payload, MAX_BATCH)
+    except zlib.error as e:
+        raise ValueError(f"битая пачка: {e}") from None
+    if d.unconsumed_tail or not d.eof:
+        raise ValueError(f"пачка больше {MAX_BATCH} байт после распаковки")
+    return data
+
+
+def pack_frame(kind, seq, payload=b""):
+    return _HEADER.pack(MAGIC, kind, seq, len(payload)) + payload
+
+
+def _recv_exact(sock, size):
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            raise ConnectionError("соединение закрыто")
+        buf += chunk
+    return bytes(buf)
+
+
+def _recv_frame(sock):
+    magic, kind, seq, length = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    if magic != MAGIC or length > MAX_PAYLOAD:
+        raise ConnectionError("повреждённый кадр")
+    return kind, seq, _recv_exact(sock, length) if length else b""
+
+
+class DiskSpool:
+    """
+    Ограниченная очередь пачек на диске: <seq>.batch, запись через tmp+rename.
+    Пачка удаляется только после подтверждения центра. epoch — случайный
+    id этой очереди: после сброса каталога seq снова идут с 1, и центр по
+    новому epoch понимает, что это не дубли.
+    """
+
+    def __init__(self, directory=DEFAULT_SPOOL_DIR, max_bytes=DEFAULT_SPOOL_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._cond = threading.Condition()
+        self._seqs = sorted(int(n[:-6]) for n in os.listdir(directory) if n.endswith(".batch"))
+        self._bytes = sum(os.path.getsize(self._path(seq)) for seq in self._seqs)
+        state = read_json(os.path.join(directory, "next_seq.json")) or {}
+        self.next_seq = max([state.get("next_seq", 1)] + [seq + 1 for seq in self._seqs])
+        self.epoch = state.get("epoch")
+        if not self.epoch:
+            self.epoch = secrets.token_hex(8)
+            self._save_state()
+
+    def _save_state(self):
+        write_json_atomic(os.path.join(self.directory, "next_seq.json"),
+                          {"next_seq": self.next_seq, "epoch": self.epoch})
+
+    def _path(self, seq):
+        return os.path.join(self.directory, f"{seq:020d}.batch")
+
+    def put(self, payload, stop=None):
+        """Положить пачку; если очередь полна — ждать (backpressure на чтение лога)."""
+        with self._cond:
+            while self._bytes + len(payload) > self.max_bytes and self._seqs:
+                if stop is not None and stop.is_set():
+                    return None
+                self._cond.wait(1.0)
+            seq = self.next_seq
+            self.next_seq += 1
+            tmp_path = self._path(seq) + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(payload)
+            os.replace(tmp_path, self._path(seq))
+            self._save_state()
+            self._seqs.append(seq)
+            self._bytes += len(payload)
+            self._cond.notify_all()
+            return seq
+
+    def pending(self):
+        with self._cond:
+            return list(self._seqs)
+
+    def read(self, seq):
+        with open(self._path(seq), "rb") as f:
+            return f.read()
+
+    def ack(self, upto):
+        """Удалить все пачки с seq <= upto."""
+        with self._cond:
+            while self._seqs and self._seqs[0] <= upto:
+                seq = self._seqs.pop(0)
+                path = self._path(seq)
+                try:
+                    self._bytes -= os.path.getsize(path)
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self._cond.notify_all()
+
+    def wait_for_data(self, timeout):
+        with self._cond:
+            if not self._seqs:
+                self._cond.wait(timeout)
+            return bool(self._seqs)
+
+    @property
+    def size(self):
+        return self._bytes
+
+
+class ForwarderAgent:
+    """
+    Агент на ноде: follower читает xray.out.log, строки режутся на пачки
+    до batch_bytes, сжимаются zlib и кладутся в DiskSpool. Отправитель держит
+    одно TCP соединение с центром, шлёт до window неподтверждённых пачек
+    и удаляет их из spool по ACK. Пока центр недоступен, пачки копятся на диске.
+    """
+
+    def __init__(self, central_host, central_port=DEFAULT_AGENT_PORT, name=None,
+                 log_path=XRAY_LOG_PATH, spool_dir=DEFAULT_SPOOL_DIR, batch_bytes=DEFAULT_BATCH_BYTES,
+                 spool_bytes=DEFAULT_SPOOL_BYTES, window=DEFAULT_WINDOW, flush_interval=1.0, token=None):
+        self.central = (central_host, central_port)
+        self.name = name or socket.gethostname()
+        self.token = token
+        self.batch_bytes = batch_bytes
+        self.window = window
+        self.spool = DiskSpool(spool_dir, spool_bytes)
+        self._stop = threading.Event()
+        self.follower = LogFollower(
+            log_path, state_path=os.path.join(spool_dir, "follower.offset"),
+            flush_interval=flush_interval, sinks=[self._enqueue], node=self.name, parse=False,
+            source="agent-spool",
+        )
+        self._sock = None
+        self.sent_batches = 0
+        self.acked_batches = 0
+
+    def _enqueue(self, lines):
+        batch, size = [], 0
+        for line in lines:
+            batch.append(line)
+            size += len(line) + 1
+            if size >= self.batch_bytes:
+                self._put(batch)
+                batch, size = [], 0
+        if batch:
+            self._put(batch)
+
+    def _put(self, batch):
+        if self.spool.put(zlib.compress(b"\n".join(batch), 6), self._stop) is None:
+            # остановка при полном spool: follower не должен сохранять смещение
+            # за этими строками, при следующем запуске они будут прочитаны снова
+            raise SinkRejected("spool полон, агент останавливается")
+
+    def _session(self, sock):
+        hello = {"node": self.name, "version": 2, "epoch": self.spool.epoch, "token": self.token}
+        sock.sendall(pack_frame(HELLO, 0, json.dumps(hello).encode()))
+        kind, last, _ = _recv_frame(sock)
+        if kind != ACK:
+            raise ConnectionError("центр не подтвердил HELLO")
+        self.spool.ack(last)
+        inflight = []
+        while not self._stop.is_set():
+            for seq in self.spool.pending():
+                if len(inflight) >= self.window:
+                    break
+                if inflight and seq <= inflight[-1]:
+                    continue
+                sock.sendall(pack_frame(BATCH, seq, self.spool.read(seq)))
+                inflight.append(seq)
+                self.sent_batches += 1
+            if not inflight:
+                self.spool.wait_for_data(1.0)
+                continue
+            kind, seq, _ = _recv_frame(sock)
+            if kind == ACK:
+                self.spool.ack(seq)
+                self.acked_batches += 1
+                inflight = [s for s in inflight if s > seq]
+
+    def run(self):
+        self.follower.start()
+        delay = 1.0
+        print(f"✅ Агент '{self.name}' → {self.central[0]}:{self.central[1]}")
+        try:
+            while not self._stop.is_set():
+                try:
+                    with socket.create_connection(self.central, timeout=10) as sock:
+                        self._sock = sock
+                        sock.settimeout(ACK_TIMEOUT)
+                        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                        delay = 1.0
+                        self._session(sock)
+                except (OSError, ConnectionError, struct.error) as e:
+                    if self._stop.is_set():
+                        break
+                    print(f"⚠️ Центр недоступен ({e}), в spool {self.spool.size} байт; повтор через {delay:.0f} с")
+                    self._stop.wait(delay)
+                    delay = min(delay * 2, RECONNECT_MAX)
+        finally:
+            self.follower.stop()
+
+    def stop(self):
+        self._stop.set()
+        sock = self._sock
+        if sock is not None:
+            # прервать ожидание ACK, чтобы SIGTERM не ждал ACK_TIMEOUT
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class _AgentProtocol(asyncio.Protocol):
+    def __init__(self, receiver):
+        self.receiver = receiver
+        self.buf = bytearray()
+        self.node = None
+        self.epoch = None
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.buf += data
+        while len(self.buf) >= _HEADER.size:
+            magic, kind, seq, length = _HEADER.unpack_from(self.buf)
+            if magic != MAGIC or length > MAX_PAYLOAD:
+                self.receiver.errors += 1
+                metrics.DROPS.inc(source="agent", reason="bad_frame")
+                self.transport.close()
+                return
+            end = _HEADER.size + length
+            if len(self.buf) < end:
+                return
+            payload = bytes(self.buf[_HEADER.size:end])
+            del self.buf[:end]
+            self._handle(kind, seq, payload)
+
+    def _reject(self, reason):
+        self.receiver.errors += 1
+        metrics.DROPS.inc(source="agent", reason=reason)
+        self.transport.close()
+
+    def _handle(self, kind, seq, payload):
+        if kind == HELLO:
+            try:
+                hello = json.loads(payload)
+            except ValueError:
+                return self._reject("bad_frame")
+            if not self.receiver.authorized(hello.get("token")):
+                print(f"⚠️ Агент {self.transport.get_extra_info('peername')} отклонён: неверный токен")
+                return self._reject("bad_token")
+            self.node = hello.get("node") or "_unknown"
+            self.epoch = hello.get("epoch")
+            self.transport.write(pack_frame(ACK, self.receiver.hello(self.node, self.epoch)))
+        elif kind == BATCH and self.node:
+            try:
+                self.receiver.accept(self.node, seq, payload, self.epoch)
+            except ValueError as e:
+                print(f"⚠️ Пачка {seq} от {self.node} отброшена: {e}")
+                return self._reject("bad_frame")
+            self.transport.write(pack_frame(ACK, seq))
+
+
+class AgentReceiver(ThreadedServerMixin):
+    """
+    Приёмник агентов на центральном сервере. Пачки распаковываются и пишутся
+    через NodeWriters в <output_dir>/<нода>.log; ACK уходит после записи на диск.
+    Повторно присланные seq (после обрыва до ACK) отбрасываются как дубли.
+    Последний seq хранится на пару (нода, epoch spool'а агента): если spool
+    на ноде сброшен, агент приходит с новым epoch и счёт начинается заново.
+    token — общий секрет из HELLO (None — без проверки).
+    """
+
+    def __init__(self, host=DEFAULT_AGENT_BIND, port=DEFAULT_AGENT_PORT, output_dir=DEFAULT_OUTPUT_DIR,
+                 state_path=None, sinks=None, token=None):
+        self.host = host
+        self.port = port
+        self.token = token
+        self.writers = NodeWriters(output_dir, sinks=sinks, source="agent")
+        self.state_path = state_path
+        state = (read_json(state_path) or {}) if state_path else {}
+        # старый формат состояния: {нода: seq} — epoch неизвестен
+        self.last_seq = {node: v if isinstance(v, dict) else {"epoch": None, "seq": v} for node, v in state.items()}
+        self.batches = 0
+        self.duplicates = 0
+        self.errors = 0
+        self._dirty = False
+        self._server = None
+        self._persister = None
+
+    thread_name = "agent-receiver"
+
+    def describe(self):
+        return f"Приёмник агентов слушает {self.host}:{self.port} → {self.writers.output_dir}"
+
+    def authorized(self, token):
+        return not self.token or (isinstance(token, str) and hmac.compare_digest(token, self.token))
+
+    def hello(self, node, epoch):
+        """Последний принятый seq для ACK на HELLO; новый epoch — новый счёт с нуля."""
+        state = self.last_seq.get(node)
+        if state is None or state["epoch"] != epoch:
+            if state is not None and state["seq"]:
+                print(f"⚠️ Нода {node}: spool агента сброшен (новый epoch), нумерация пачек с начала")
+            state = self.last_seq[node] = {"epoch": epoch, "seq": 0}
+            self._dirty = True
+        return state["seq"]
+
+    def accept(self, node, seq, payload, epoch=None):
+        state = self.last_seq.setdefault(node, {"epoch": epoch, "seq": 0})
+        if seq <= state["seq"]:
+            self.duplicates += 1
+            metrics.DUPLICATES.inc(node=node)
+            return
+        for line in decompress_batch(payload).split(b"\n"):
+            self.writers.add(node, line)
+        self.writers.flush_node(node)
+        state["seq"] = seq
+        self.batches += 1
+        self._dirty = True
+
+    async def _persist_loop(self):
+        while True:
+            await asyncio.sleep(1.0)
+            self._save_state()
+
+    def _save_state(self):
+        if self._dirty and self.state_path:
+            self._dirty = False
+            write_json_atomic(self.state_path, self.last_seq)
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self._server = await loop.create_server(lambda: _AgentProtocol(self), self.host, self.port,
+                                                backlog=1024, reuse_address=True)
+        self._persister = asyncio.create_task(self._persist_loop())
+        return self._server
+
+    async def stop(self):
+        self._persister.cancel()
+        self._server.close()
+        await self._server.wait_closed()
+        self.writers.close()
+        self._save_state()
+
+
+def run_agent(central, name=None, spool_dir=DEFAULT_SPOOL_DIR, log_path=XRAY_LOG_PATH, token=None):
+    """Точка входа режима агента: central = 'host:port'."""
+    host, _, port = central.rpartition(":")
+    if not host:
+        host, port = central, DEFAULT_AGENT_PORT
+    os.makedirs(spool_dir, exist_ok=True)
+    try:
+        pidfile = PidFile(os.path.join(spool_dir, "agent.pid")).acquire()
+    except AlreadyRunning as e:
+        print(f"❌ Агент {e}")
+        return None
+    agent = ForwarderAgent(host, int(port), name=name, spool_dir=spool_dir, log_path=log_path,
+                           token=token or os.environ.get(AGENT_TOKEN_ENV))
+    signal.signal(signal.SIGTERM, lambda *_: agent.stop())
+    try:
+        agent.run()
+    except KeyboardInterrupt:
+        agent.stop()
+    finally:
+        pidfile.release()
+    return agent
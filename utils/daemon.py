@@ -0,0 +1,266 @@
+"""
+Режим демона: единственный экземпляр (flock на pid-файле), сборщики как
+наблюдаемые воркеры с перезапуском и backoff, управление через Unix сокет.
+
+Пример юнита systemd:
+
+  [Unit]
+  Description=ddlog xray forwarding
+  After=network-online.target
+
+  [Service]
+  WorkingDirectory=/opt/ddlog-xray-forwarding
+  ExecStart=/opt/ddlog-xray-forwarding/ddlog-xray-forwarding.bin --daemon
+  KillSignal=SIGTERM
+  TimeoutStopSec=30
+  Restart=on-failure
+
+  [Install]
+  WantedBy=multi-user.target
+"""
+import contextlib
+import fcntl
+import json
+import os
+import socket
+import threading
+import time
+
+RESTART_BACKOFF_MIN = 1.0
+RESTART_BACKOFF_MAX = 60.0
+STABLE_AFTER = 60.0
+REMOTE_CHECK_INTERVAL = 300
+CONTROL_TIMEOUT = 30
+MAX_REQUEST_SIZE = 1024 * 1024
+
+
+class AlreadyRunning(RuntimeError):
+    def __init__(self, pid):
+        super().__init__(f"уже запущен (pid {pid})")
+        self.pid = pid
+
+
+class PidFile:
+    """pid-файл под flock: пока процесс жив, второй экземпляр не стартует."""
+
+    def __init__(self, path):
+        self.path = path
+        self._f = None
+
+    def acquire(self):
+        f = open(self.path, "a+")
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.seek(0)
+            pid = f.read().strip() or "?"
+            f.close()
+            raise AlreadyRunning(pid)
+        f.seek(0)
+        f.truncate()
+        f.write(f"{os.getpid()}\n")
+        f.flush()
+        self._f = f
+        return self
+
+    def release(self):
+        if self._f is None:
+            return
+        # файл не удаляем: иначе новый экземпляр мог взять flock на старом inode,
+        # а следующий — создать новый файл и тоже стартовать
+        with contextlib.suppress(OSError):
+            self._f.truncate(0)
+        fcntl.flock(self._f.fileno(), fcntl.LOCK_UN)
+        self._f.close()
+        self._f = None
+
+
+class Worker:
+    """
+    Наблюдаемый сборщик. start() → handle (исключение — неудачный запуск),
+    alive(handle) раз в check_interval, stop(handle) при остановке.
+    gate — общий семафор для тяжёлых операций (SSH), чтобы не ломиться во все ноды разом.
+    """
+
+    def __init__(self, name, start, alive, stop=None, check_interval=1.0, gate=None):
+        self.name = name
+        self.start = start
+        self.alive = alive
+        self.stop = stop
+        self.check_interval = check_interval
+        self.gate = gate
+        self.handle = None
+        self.status = "ожидание"
+        self.restarts = 0
+        self.last_error = None
+        self.started_at = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _guarded(self, func, *args):
+        with self.gate if self.gate is not None else contextlib.nullcontext():
+            return func(*args)
+
+    def _run(self):
+        backoff = RESTART_BACKOFF_MIN
+        while not self._stop.is_set():
+            began = time.monotonic()
+            try:
+                self.handle = self._guarded(self.start)
+                self.status = "работает"
+                self.started_at = time.time()
+                while not self._stop.wait(self.check_interval):
+                    if not self._guarded(self.alive, self.handle):
+                        self.status = "упал"
+                        break
+            except Exception as e:
+                self.status = "ошибка"
+                self.last_error = str(e)
+            if self._stop.is_set():
+                break
+            self._stop_handle()
+            if time.monotonic() - began >= STABLE_AFTER:
+                backoff = RESTART_BACKOFF_MIN
+            self.restarts += 1
+            print(f"⚠️ Воркер {self.name}: {self.status}, перезапуск через {backoff:.0f} с")
+            self._stop.wait(backoff)
+            backoff = min(backoff * 2, RESTART_BACKOFF_MAX)
+        self._stop_handle()
+        self.status = "остановлен"
+
+    def _stop_handle(self):
+        handle, self.handle = self.handle, None
+        if handle is not None and self.stop:
+            try:
+                self.stop(handle)
+            except Exception as e:
+                print(f"Ошибка остановки воркера {self.name}: {e}")
+
+    def launch(self):
+        self._thread = threading.Thread(target=self._run, name=f"worker:{self.name}", daemon=True)
+        self._thread.start()
+
+    def shutdown(self, timeout=10):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def info(self):
+        return {"name": self.name, "status": self.status, "restarts": self.restarts,
+                "last_error": self.last_error, "started_at": self.started_at}
+
+
+class Supervisor:
+    """Набор воркеров по имени; одно имя — один воркер, дубли не запускаются."""
+
+    def __init__(self):
+        self.workers = {}
+        self._lock = threading.Lock()
+
+    def add(self, worker):
+        with self._lock:
+            if worker.name in self.workers:
+                return self.workers[worker.name]
+            self.workers[worker.name] = worker
+        worker.launch()
+        return worker
+
+    def remove(self, name):
+        with self._lock:
+            worker = self.workers.pop(name, None)
+        if worker:
+            worker.shutdown()
+        return worker is not None
+
+    def status(self):
+        with self._lock:
+            return [w.info() for w in self.workers.values()]
+
+    def stop_all(self):
+        """Остановить в обратном порядке запуска (сначала сборщики, потом приёмники)."""
+        with self._lock:
+            workers = list(self.workers.values())[::-1]
+            self.workers.clear()
+        for worker in workers:
+            worker._stop.set()
+        for worker in workers:
+            worker.shutdown()
+
+
+class ControlServer:
+    """
+    Unix сокет управления: запрос и ответ — по одной JSON строке.
+    {"cmd": "...", ...параметры} → {"ok": true, "result": ...} или {"ok": false, "error": "..."}.
+    """
+
+    def __init__(self, path, handlers):
+        self.path = path
+        self.handlers = handlers
+        self._sock = None
+        self._thread = None
+
+    def start(self):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o077)
+        try:
+            sock.bind(self.path)
+        finally:
+            os.umask(old_umask)
+        sock.listen(16)
+        self._sock = sock
+        self._thread = threading.Thread(target=self._accept_loop, name="daemon-control", daemon=True)
+        self._thread.start()
+        print(f"✅ Управление демоном: {self.path}")
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        with conn, conn.makefile("rwb") as f:
+            line = f.readline(MAX_REQUEST_SIZE)
+            try:
+                request = json.loads(line)
+                handler = self.handlers.get(request.pop("cmd", None))
+                if handler is None:
+                    raise ValueError(f"неизвестная команда, есть: {', '.join(sorted(self.handlers))}")
+                response = {"ok": True, "result": handler(**request)}
+            except Exception as e:
+                response = {"ok": False, "error": str(e)}
+            f.write(json.dumps(response, ensure_ascii=False).encode("utf-8") + b"\n")
+            f.flush()
+
+    def stop(self):
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.path)
+
+
+def control_request(path, cmd, timeout=CONTROL_TIMEOUT, **params):
+    """Команда запущенному демону; ошибка демона → RuntimeError, нет демона → OSError."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        with sock.makefile("rwb") as f:
+            f.write(json.dumps(dict(params, cmd=cmd), ensure_ascii=False).encode("utf-8") + b"\n")
+            f.flush()
+            response = json.loads(f.readline() or b"{}")
+    if not response.get("ok"):
+        raise RuntimeError(response.get("error", "нет ответа"))
+    return response["result"]
+
+
+def daemon_running(path):
+    try:
+        control_request(path, "ping", timeout=2)
+        return True
+    except (OSError, RuntimeError, ValueError):
+        return False
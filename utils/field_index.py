@@ -0,0 +1,303 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from utils.segments import hour_key
+from utils.xray_parser import record_epoch
+from utils.utils import node_from_file_name
+
+INDEX_FILE = "index.sqlite"
+# поле запроса → (код в таблице terms, поле записи)
+FIELDS = {"email": (1, "email"), "ip": (2, "src_ip"), "dest": (3, "dest")}
+QUEUE_SIZE = 256
+COMMIT_INTERVAL = 1.0
+CATCH_UP_BATCH = 10000
+TERM_CACHE_SIZE = 100_000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    node TEXT NOT NULL,
+    hour TEXT NOT NULL,
+    indexed_to INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS segments_hour ON segments (hour, node);
+CREATE TABLE IF NOT EXISTS terms (
+    id INTEGER PRIMARY KEY,
+    field INTEGER NOT NULL,
+    value TEXT NOT NULL,
+    UNIQUE (field, value)
+);
+CREATE TABLE IF NOT EXISTS postings (
+    segment INTEGER NOT NULL,
+    term INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    PRIMARY KEY (segment, term, offset)
+) WITHOUT ROWID;
+"""
+
+
+def _normalize(field, value):
+    value = str(value).strip()
+    return value if field == "ip" else value.lower()
+
+
+def parse_terms(items):
+    """['email=a@b', 'ip=1.2.3.4'] → {'email': 'a@b', 'ip': '1.2.3.4'}."""
+    terms = {}
+    for item in items:
+        field, sep, value = item.partition("=")
+        field = field.strip().lower()
+        if not sep or not value.strip():
+            raise ValueError(f"ожидается поле=значение, получено '{item}'")
+        if field not in FIELDS:
+            raise ValueError(f"нет поля '{field}', доступны: {', '.join(FIELDS)}")
+        terms[field] = value.strip()
+    return terms
+
+
+class FieldIndex:
+    """
+    Инвертированный индекс по сегментам хранилища: email, IP источника и
+    адрес назначения → (сегмент, несжатое смещение строки). Лежит в SQLite
+    (WAL) рядом с сегментами. Постинги — таблица WITHOUT ROWID с ключом
+    (сегмент, терм, смещение), то есть отсортированный массив на диске:
+    запрос — по одному поиску в B-дереве на сегмент нужных часов, а удаление
+    сегмента по retention — удаление диапазона.
+
+    Пишет один фоновый поток: слушатель хранилища только кладёт пачки в
+    ограниченную очередь (при отставании индекса тормозит запись, а не
+    теряет строки), коммит раз в COMMIT_INTERVAL. При старте догоняет
+    сегменты, записанные без индекса или до падения (indexed_to).
+    """
+
+    def __init__(self, store, path=None):
+        self.store = store
+        self.path = path or os.path.join(store.root, INDEX_FILE)
+        self._queue = queue.Queue(QUEUE_SIZE)
+        self._terms = {}
+        self._segment_ids = {}
+        self._thread = None
+        db = self._connect()
+        with db:
+            db.executescript(_SCHEMA)
+        db.close()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    # --- слушатель SegmentStore ---
+
+    def segment_written(self, segment, entries):
+        self._queue.put(("written", segment, entries))
+
+    def segment_sealed(self, old, new):
+        self._queue.put(("sealed", old, new))
+
+    def segment_removed(self, segment):
+        self._queue.put(("removed", segment))
+
+    # --- запись ---
+
+    def start(self):
+        self.store.add_listener(self)
+        self._thread = threading.Thread(target=self._writer, name="field-index", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        """Дописать очередь и закрыть базу."""
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _writer(self):
+        db = self._connect()
+        try:
+            self._catch_up(db)
+        except Exception as e:
+            print(f"Ошибка догоняющей индексации {self.path}: {e}")
+        db.commit()
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            deadline = time.monotonic() + COMMIT_INTERVAL
+            while item is not None:
+                try:
+                    self._apply(db, item)
+                except Exception as e:
+                    print(f"Ошибка индекса {self.path}: {e}")
+                if time.monotonic() >= deadline:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            stop = item is None
+            db.commit()
+        db.close()
+
+    def _apply(self, db, item):
+        event = item[0]
+        if event == "written":
+            _, segment, entries = item
+            self._index(db, self._segment_id(db, segment), entries)
+        elif event == "sealed":
+            _, old, new = item
+            self._segment_ids.pop(old, None)
+            try:
+                db.execute("UPDATE segments SET path = ? WHERE path = ?", (new, old))
+            except sqlite3.IntegrityError:
+                # сжатый сегмент уже проиндексирован заново при догоняющем проходе
+                self._drop(db, old)
+                return
+            row = db.execute("SELECT indexed_to FROM segments WHERE path = ?", (new,)).fetchone()
+            try:
+                # сегмент сжали посреди догонки — доиндексируем хвост сразу
+                if row and self._behind(new, row[0]):
+                    self._index_from(db, new, row[0])
+            except FileNotFoundError:
+                pass  # уже удалён по retention, следом придёт removed
+        elif event == "removed":
+            self._drop(db, item[1])
+
+    def _drop(self, db, segment):
+        self._segment_ids.pop(segment, None)
+        row = db.execute("SELECT id FROM segments WHERE path = ?", (segment,)).fetchone()
+        if row:
+            db.execute("DELETE FROM postings WHERE segment = ?", row)
+            db.execute("DELETE FROM segments WHERE id = ?", row)
+
+    def _segment_id(self, db, segment):
+        seg_id = self._segment_ids.get(segment)
+        if seg_id is None:
+            row = db.execute("SELECT id FROM segments WHERE path = ?", (segment,)).fetchone()
+            if row:
+                seg_id = row[0]
+            else:
+                node, _, name = segment.rpartition("/")
+                seg_id = db.execute("INSERT INTO segments (path, node, hour) VALUES (?, ?, ?)",
+                                    (segment, node_from_file_name(node), name[:10])).lastrowid
+            self._segment_ids[segment] = seg_id
+        return seg_id
+
+    def _term_id(self, db, field, value):
+        key = (FIELDS[field][0], _normalize(field, value))
+        term = self._terms.get(key)
+        if term is None:
+            row = db.execute("SELECT id FROM terms WHERE field = ? AND value = ?", key).fetchone()
+            term = row[0] if row else db.execute("INSERT INTO terms (field, value) VALUES (?, ?)", key).lastrowid
+            if len(self._terms) >= TERM_CACHE_SIZE:
+                self._terms.clear()
+            self._terms[key] = term
+        return term
+
+    def _index(self, db, seg_id, entries):
+        if not entries:
+            return
+        postings = []
+        for offset, record in entries:
+            for field, (_, key) in FIELDS.items():
+                value = record.get(key)
+                if value:
+                    postings.append((seg_id, self._term_id(db, field, value), offset))
+        db.executemany("INSERT OR IGNORE INTO postings VALUES (?, ?, ?)", postings)
+        # последняя строка при догонке читается заново — INSERT OR IGNORE её не задвоит
+        db.execute("UPDATE segments SET indexed_to = max(indexed_to, ?) WHERE id = ?", (entries[-1][0], seg_id))
+
+    def _catch_up(self, db):
+        on_disk = {segment: compressed for segment, _, _, compressed in self.store.segments()}
+        for (segment,) in db.execute("SELECT path FROM segments").fetchall():
+            if segment not in on_disk:
+                self._drop(db, segment)
+        for segment, compressed in on_disk.items():
+            row = db.execute("SELECT indexed_to FROM segments WHERE path = ?", (segment,)).fetchone()
+            try:
+                if row and compressed and not self._behind(segment, row[0]):
+                    continue
+                self._index_from(db, segment, row[0] if row else 0)
+            except FileNotFoundError:
+                # сжат или удалён во время догонки: хвост доиндексирует событие sealed
+                continue
+            db.commit()
+
+    def _behind(self, segment, indexed_to):
+        """Сжатый сегмент проиндексирован не до последней строки (.idx старого формата — считаем полным)."""
+        last = self.store.last_offset(segment)
+        return last is not None and indexed_to < last
+
+    def _index_from(self, db, segment, start):
+        seg_id = self._segment_id(db, segment)
+        batch = []
+        for offset, raw in self.store.iter_offsets(segment, start):
+            try:
+                batch.append((offset, json.loads(raw)))
+            except ValueError:
+                continue  # недописанная строка активного сегмента придёт через очередь
+            if len(batch) >= CATCH_UP_BATCH:
+                self._index(db, seg_id, batch)
+                batch = []
+        self._index(db, seg_id, batch)
+
+    # --- запросы ---
+
+    def query(self, terms, start=None, end=None, nodes=None):
+        """
+        Записи, у которых совпали все условия terms ({'email': .., 'ip': .., 'dest': ..})
+        в интервале [start, end]. Генератор: строки читаются из сегментов по мере перебора.
+        """
+        start = start or 0
+        end = end or time.time()
+        db = self._connect()
+        try:
+            term_ids = []
+            for field, value in terms.items():
+                row = db.execute("SELECT id FROM terms WHERE field = ? AND value = ?",
+                                 (FIELDS[field][0], _normalize(field, value))).fetchone()
+                if row is None:
+                    return
+                term_ids.append(row[0])
+            sql = "SELECT id, path FROM segments WHERE hour BETWEEN ? AND ?"
+            params = [hour_key(start), hour_key(end)]
+            if nodes:
+                sql += f" AND node IN ({', '.join('?' * len(nodes))})"
+                params += list(nodes)
+            for seg_id, segment in db.execute(sql + " ORDER BY hour, node, id", params).fetchall():
+                offsets = None
+                for term in term_ids:
+                    found = [off for (off,) in db.execute(
+                        "SELECT offset FROM postings WHERE segment = ? AND term = ?", (seg_id, term))]
+                    offsets = found if offsets is None else sorted(set(offsets).intersection(found))
+                    if not offsets:
+                        break
+                if not offsets:
+                    continue
+                for record in self._read(db, seg_id, segment, offsets):
+                    if start <= record_epoch(record, default=start) <= end:
+                        yield record
+        finally:
+            db.close()
+
+    def _read(self, db, seg_id, segment, offsets):
+        try:
+            yield from self.store.read_offsets(segment, offsets)
+        except FileNotFoundError:
+            # сегмент сжали между запросом к индексу и чтением — берём новый путь
+            row = db.execute("SELECT path FROM segments WHERE id = ?", (seg_id,)).fetchone()
+            if row and row[0] != segment:
+                yield from self.store.read_offsets(row[0], offsets)
+
+    def stats(self):
+        db = self._connect()
+        try:
+            return {table: db.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+                    for table in ("segments", "terms", "postings")}
+        finally:
+            db.close()
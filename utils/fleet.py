@@ -0,0 +1,125 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from utils.syslog_server import DEFAULT_SYSLOG_PORT
+
+DEFAULT_WORKERS = 8
+DEFAULT_NODE_TIMEOUT = 180
+
+STATUS_STYLES = {
+    "ожидание": "dim",
+    "в работе": "yellow",
+    "готово": "green",
+    "ошибка": "red",
+    "неизвестно": "magenta",
+}
+
+
+def collect_credentials(nodes):
+    """Спросить все SSH пароли до старта пула — getpass из потоков перемешивается."""
+    for node in nodes:
+        node.ensure_password()
+
+
+def node_labels(nodes):
+    """Уникальные подписи нод для итогов: повторное имя получает « (2)», « (3)»…"""
+    seen = {}
+    labels = []
+    for node in nodes:
+        seen[node.name] = seen.get(node.name, 0) + 1
+        labels.append(node.name if seen[node.name] == 1 else f"{node.name} ({seen[node.name]})")
+    return labels
+
+
+def _build_table(nodes, states, title="Запуск сбора логов"):
+    from rich.table import Table
+
+    table = Table(title=title)
+    table.add_column("Имя", style="green")
+    table.add_column("Хост", style="yellow")
+    table.add_column("Статус")
+    table.add_column("Время, с", justify="right")
+    now = time.monotonic()
+    for node, st in zip(nodes, states):
+        elapsed = ""
+        if st["started"] is not None:
+            elapsed = f"{(st['finished'] or now) - st['started']:.1f}"
+        style = STATUS_STYLES.get(st["status"], "")
+        table.add_row(node.name, node.host or "-", f"[{style}]{st['status']}[/{style}]", elapsed)
+    return table
+
+
+def run_on_nodes(nodes, func, workers=DEFAULT_WORKERS, node_timeout=DEFAULT_NODE_TIMEOUT, console=None,
+                 title="Запуск сбора логов"):
+    """
+    Выполнить func(node) для всех нод в пуле потоков с живой таблицей прогресса.
+    func возвращает True/False. Зависшая удалённая нода по таймауту получает
+    статус «неизвестно» (поток может ещё завершиться — это не то же, что
+    ошибка) и у неё закрывается SSH, чтобы освободить поток; остальные не ждут.
+    Возвращает {подпись ноды: статус}, подписи — node_labels(nodes).
+    """
+    from rich.console import Console
+    from rich.live import Live
+
+    console = console or Console()
+    collect_credentials(nodes)
+    states = [{"status": "ожидание", "started": None, "finished": None} for _ in nodes]
+
+    def task(node, st):
+        st["status"] = "в работе"
+        st["started"] = time.monotonic()
+        return func(node)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="fleet")
+    futures = {executor.submit(task, node, st): (node, st) for node, st in zip(nodes, states)}
+    pending = set(futures)
+    try:
+        with Live(_build_table(nodes, states, title), console=console, refresh_per_second=4) as live:
+            while pending:
+                done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                now = time.monotonic()
+                for fut in done:
+                    node, st = futures[fut]
+                    try:
+                        ok = fut.result()
+                    except Exception as e:
+                        print(f"❌ {node.name}: {e}")
+                        ok = False
+                    st["status"] = "готово" if ok is not False else "ошибка"
+                    st["finished"] = now
+                for fut in list(pending):
+                    node, st = futures[fut]
+                    if node.local or st["started"] is None or now - st["started"] < node_timeout:
+                        continue
+                    st["status"] = "неизвестно"
+                    st["finished"] = now
+                    pending.discard(fut)
+                    if node.ssh:
+                        try:
+                            node.ssh.close()
+                        except Exception:
+                            pass
+                        node.ssh = None
+                live.update(_build_table(nodes, states, title))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    summary = {label: st["status"] for label, st in zip(node_labels(nodes), states)}
+    ok = sum(1 for s in summary.values() if s == "готово")
+    console.print(f"[bold]Готово:[/bold] {ok}/{len(nodes)}")
+    return summary
+
+
+def bring_up_nodes(nodes, central_server_ip, workers=DEFAULT_WORKERS,
+                   node_timeout=DEFAULT_NODE_TIMEOUT, console=None, agent_port=None,
+                   syslog_port=DEFAULT_SYSLOG_PORT):
+    """
+    Параллельный запуск фонового сбора логов на всех нодах (agent_port — через
+    агентов, иначе rsyslog шлёт на syslog_port центра).
+    """
+    return run_on_nodes(
+        nodes,
+        lambda node: node.start_background_log_collection(central_server_ip, agent_port, syslog_port),
+        workers=workers,
+        node_timeout=node_timeout,
+        console=console,
+    )
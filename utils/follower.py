@@ -0,0 +1,291 @@
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import threading
+import time
+from utils.utils import load_offset_state, save_offset_state, offset_state_path
+from utils.xray_parser import parse_xray_line
+from utils.sinks import enrich_records
+from utils import metrics
+
+XRAY_LOG_PATH = "/var/log/remnanode/xray.out.log"
+
+READ_CHUNK_SIZE = 256 * 1024
+DEFAULT_FLUSH_INTERVAL = 1.0
+DEFAULT_POLL_INTERVAL = 0.5
+
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+
+
+class _Inotify:
+    """Минимальная обёртка над inotify через ctypes (без внешних зависимостей)."""
+
+    def __init__(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, f"inotify_add_watch {directory}")
+
+    def wait(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if ready:
+            try:
+                while os.read(self.fd, 64 * 1024):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _Poller:
+    def __init__(self, interval):
+        self.interval = interval
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.interval))
+
+    def close(self):
+        pass
+
+
+class SinkRejected(Exception):
+    """Sink не принял пачку (например, останавливается): смещение за ней не сохраняется."""
+
+
+class LogFollower:
+    """
+    Замена `tail -F`: читает лог с сохранённого смещения, переживает ротацию
+    и усечение файла, пишет разобранные JSON строки пачкой раз в flush_interval.
+    Чекпоинт (inode, смещение в логе и в JSON) лежит в <out_path>.offset —
+    том же файле, что ведёт convert_old_xray_log_to_json.
+    sinks — функции, которые получают каждую сброшенную пачку записей.
+    Без out_path follower только кормит sinks, чекпоинт тогда в state_path.
+    start_at_end — без чекпоинта начинать с конца файла, а не с начала.
+    node — имя ноды, которым помечаются записи без тега xray-node-<name>.
+    parse=False — в sinks идут сырые строки (bytes) без разбора.
+    source — метка в метриках (по умолчанию local при node, иначе file).
+    """
+
+    def __init__(self, path, out_path=None, state_path=None, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 poll_interval=DEFAULT_POLL_INTERVAL, sinks=None, start_at_end=False,
+                 node=None, parse=True, source=None):
+        self.path = path
+        self.out_path = out_path
+        self.state_path = state_path or offset_state_path(out_path)
+        self.flush_interval = flush_interval
+        self.poll_interval = poll_interval
+        self.sinks = list(sinks or [])
+        self.start_at_end = start_at_end
+        self.node = node
+        self.parse = parse
+        self.source = source or ("local" if node else "file")
+        self._stop = threading.Event()
+        self._thread = None
+        self._src = None
+        self._inode = None
+        self._offset = 0
+        self._pending = b""
+        self._batch = []
+        self._batch_bytes = 0
+        self._out = None
+        self._opened = False
+        self._saved = None
+        self._rejected = False
+
+    # --- жизненный цикл ---
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return self._thread
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name=f"follow:{self.path}", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def is_alive(self):
+        return bool(self._thread and self._thread.is_alive())
+
+    @property
+    def offset(self):
+        """Сколько байт текущего файла лога уже прочитано."""
+        return self._offset
+
+    def run(self):
+        watcher = self._make_watcher()
+        self._open_output()
+        try:
+            last_flush = time.monotonic()
+            while not self._stop.is_set():
+                if self._src is None:
+                    self._open_source()
+                if self._src is not None:
+                    self._read_available()
+                    self._check_rotation()
+                now = time.monotonic()
+                if now - last_flush >= self.flush_interval:
+                    self.flush()
+                    last_flush = now
+                watcher.wait(max(0.0, self.flush_interval - (time.monotonic() - last_flush)))
+        finally:
+            self.flush()
+            watcher.close()
+            if self._src:
+                self._src.close()
+            if self._out:
+                self._out.close()
+
+    # --- внутренности ---
+
+    def _make_watcher(self):
+        try:
+            return _Inotify(os.path.dirname(os.path.abspath(self.path)))
+        except (OSError, AttributeError):
+            return _Poller(self.poll_interval)
+
+    def _open_output(self):
+        state = load_offset_state(self.state_path) or {}
+        self._opened = True
+        if self.out_path:
+            mode = "r+b" if os.path.exists(self.out_path) else "w+b"
+            self._out = open(self.out_path, mode)
+            json_offset = state.get("json_offset")
+            if json_offset is None:
+                self._out.seek(0, os.SEEK_END)
+            else:
+                # всё, что дописано после чекпоинта, будет прочитано заново
+                self._out.truncate(json_offset)
+                self._out.seek(json_offset)
+        self._inode = state.get("inode")
+        self._offset = state.get("offset", 0)
+        if not state and self.start_at_end:
+            try:
+                st = os.stat(self.path)
+                self._inode, self._offset = st.st_ino, st.st_size
+            except FileNotFoundError:
+                pass
+
+    def _open_source(self):
+        try:
+            src = open(self.path, "rb")
+        except FileNotFoundError:
+            return
+        st = os.fstat(src.fileno())
+        if st.st_ino != self._inode or st.st_size < self._offset:
+            # новый файл (ротация пока мы не работали) или усечение
+            self._offset = 0
+        self._inode = st.st_ino
+        src.seek(self._offset)
+        self._src = src
+        self._pending = b""
+
+    def _read_available(self):
+        while True:
+            chunk = self._src.read(READ_CHUNK_SIZE)
+            if not chunk:
+                return
+            lines = (self._pending + chunk).split(b"\n")
+            self._pending = lines.pop()
+            start = self._offset
+            if not self.parse:
+                self._offset += sum(len(raw) + 1 for raw in lines)
+                self._batch.extend(lines)
+            else:
+                for raw in lines:
+                    self._offset += len(raw) + 1
+                    record = parse_xray_line(raw.decode("utf-8", errors="replace"))
+                    if self.node:
+                        record.setdefault("node", self.node)
+                    self._batch.append(record)
+            self._batch_bytes += self._offset - start
+
+    def _check_rotation(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if st.st_ino != self._inode:
+            # старый файл дочитан до конца в _read_available — переключаемся на новый
+            self._src.close()
+            self._src = None
+            self._inode = st.st_ino
+            self._offset = 0
+            self._pending = b""
+            self._open_source()
+        elif st.st_size < self._offset + len(self._pending):
+            metrics.DROPS.inc(source=self.source, reason="truncated")
+            self._offset = 0
+            self._pending = b""
+            self._src.seek(0)
+        else:
+            metrics.BACKLOG.set(st.st_size - self._offset, path=self.path)
+
+    def _observe(self, batch):
+        size, self._batch_bytes = self._batch_bytes, 0
+        if not self.node and not self.parse:
+            return  # сырые строки общего лога: по нодам их учитывает sink (ParsePool.submit_lines)
+        if self.node or not self.parse:
+            last = {"last_record": batch[-1]} if self.parse else {"last_line": batch[-1]}
+            metrics.observe_batch(self.node or "_local", self.source, len(batch), size, **last)
+            return
+        # общий лог центра: записи разных нод вперемешку
+        per_node = {}
+        for record in batch:
+            node = record.get("node", "_unknown")
+            entry = per_node.get(node)
+            if entry is None:
+                per_node[node] = [1, record]
+            else:
+                entry[0] += 1
+                entry[1] = record
+        for node, (count, last) in per_node.items():
+            metrics.observe_batch(node, self.source, count, size * count // len(batch), last_record=last)
+
+    def flush(self):
+        if not self._opened:
+            return
+        batch, self._batch = self._batch, []
+        if batch:
+            if self._out and self.parse:
+                enrich_records(batch)
+                start = time.perf_counter()
+                self._out.write(("\n".join(json.dumps(r, ensure_ascii=False) for r in batch) + "\n").encode("utf-8"))
+                self._out.flush()
+                metrics.WRITE.observe(time.perf_counter() - start, target="json")
+            self._observe(batch)
+            for sink in self.sinks:
+                try:
+                    sink(batch)
+                except SinkRejected as e:
+                    # чекпоинт остаётся на последней принятой пачке: при перезапуске
+                    # строки прочитаются заново (возможны повторы, но не потери)
+                    self._rejected = True
+                    print(f"⚠️ {self.path}: пачка не принята ({e}), смещение не сохраняется")
+                except Exception as e:
+                    print(f"Ошибка обработчика логов {self.path}: {e}")
+        state = (self._inode, self._offset)
+        if self._inode is not None and not self._rejected and (batch or state != self._saved):
+            self._saved = state
+            save_offset_state(self.state_path, {
+                "inode": self._inode,
+                "offset": self._offset,
+                "json_offset": self._out.tell() if self._out else 0,
+            })
@@ -0,0 +1,196 @@
+import bisect
+import csv
+import gzip
+import socket
+from array import array
+from functools import lru_cache
+
+DEFAULT_CACHE_SIZE = 65536
+_U32 = "I" if array("I").itemsize == 4 else "L"
+
+
+def ip_key(ip):
+    """'1.2.3.4' → (4, int), IPv6 → (6, int), иначе None. inet_aton/inet_pton заметно быстрее ipaddress."""
+    try:
+        return 4, int.from_bytes(socket.inet_aton(ip), "big")
+    except OSError:
+        pass
+    try:
+        return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, ip.strip("[]")), "big")
+    except (OSError, ValueError):
+        return None
+
+
+class RangeTable:
+    """
+    Диапазоны адресов из CSV: отсортированные массивы начал и концов и
+    номер значения (country, asn, org) на диапазон; поиск — bisect.
+    IPv4 лежит в array по 4 байта на число, одинаковые значения хранятся
+    один раз.
+    """
+
+    def __init__(self, rows):
+        self.values = []
+        interned = {}
+        v4, v6 = [], []
+        for start, end, value in rows:
+            idx = interned.get(value)
+            if idx is None:
+                idx = interned[value] = len(self.values)
+                self.values.append(value)
+            (v4 if start[0] == 4 else v6).append((start[1], end[1], idx))
+        v4.sort()
+        v6.sort()
+        self.v4 = (array(_U32, (r[0] for r in v4)), array(_U32, (r[1] for r in v4)), array(_U32, (r[2] for r in v4)))
+        self.v6 = ([r[0] for r in v6], [r[1] for r in v6], array(_U32, (r[2] for r in v6)))
+
+    def __len__(self):
+        return len(self.v4[0]) + len(self.v6[0])
+
+    def get(self, ip, key):
+        starts, ends, ids = self.v4 if key[0] == 4 else self.v6
+        i = bisect.bisect_right(starts, key[1]) - 1
+        if i >= 0 and key[1] <= ends[i]:
+            return self.values[ids[i]]
+        return None
+
+
+def _address(value):
+    value = value.strip()
+    if value.isdigit():
+        number = int(value)
+        return (4 if number < 1 << 32 else 6), number
+    return ip_key(value)
+
+
+def parse_range_row(row):
+    """
+    Строка CSV/TSV диапазона → (начало, конец, (country, asn, org)) или None.
+    Понимает «start,end,CC» (db-ip country), «start,end,ASN,org» (db-ip asn),
+    «start end ASN CC описание» (iptoasn) и целочисленные границы (ip2location).
+    """
+    if len(row) < 3 or row[0].startswith("#"):
+        return None
+    start, end = _address(row[0]), _address(row[1])
+    if start is None or end is None or start[0] != end[0]:
+        return None
+    third = row[2].strip().upper().removeprefix("AS")
+    if third.isdigit():
+        asn = int(third)
+        if not asn:
+            return None  # iptoasn: «Not routed»
+        if len(row) >= 5:
+            country, org = row[3].strip() or None, row[4].strip() or None
+        else:
+            country, org = None, ",".join(row[3:]).strip() or None
+        if country in ("None", "-", "ZZ"):
+            country = None
+        return start, end, (country, asn, org)
+    country = row[2].strip().upper()
+    if len(country) != 2 or country in ("ZZ", "-"):
+        return None
+    return start, end, (country, None, None)
+
+
+def load_csv(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    delimiter = "\t" if ".tsv" in path else ","
+    with opener(path, "rt", encoding="utf-8", newline="") as f:
+        rows = (parse_range_row(row) for row in csv.reader(f, delimiter=delimiter))
+        return RangeTable(row for row in rows if row is not None)
+
+
+class MMDBTable:
+    """GeoLite2/GeoIP2 Country/City/ASN через maxminddb (необязательная зависимость)."""
+
+    def __init__(self, path):
+        try:
+            import maxminddb
+        except ImportError:
+            raise RuntimeError(f"для {path} нужен модуль maxminddb (pip install maxminddb)") from None
+        self.reader = maxminddb.open_database(path)
+
+    def __len__(self):
+        return self.reader.metadata().node_count
+
+    def get(self, ip, key):
+        try:
+            data = self.reader.get(ip)
+        except ValueError:
+            return None
+        if not data:
+            return None
+        country = (data.get("country") or data.get("registered_country") or {}).get("iso_code")
+        return country, data.get("autonomous_system_number"), data.get("autonomous_system_organization")
+
+
+def open_table(path):
+    if path.endswith(".mmdb"):
+        return MMDBTable(path)
+    return load_csv(path)
+
+
+class GeoIP:
+    """
+    Страна и ASN адреса по локальным базам (CSV диапазонов и/или MMDB;
+    страны и ASN могут лежать в разных файлах — поля сливаются). Перед
+    базами LRU кэш на cache_size адресов: одни и те же IP повторяются
+    постоянно, поэтому почти все поиски — попадание в кэш.
+    """
+
+    def __init__(self, paths, cache_size=DEFAULT_CACHE_SIZE):
+        self.paths = list(paths)
+        self.tables = [open_table(path) for path in self.paths]
+        self.lookup = lru_cache(maxsize=cache_size)(self._lookup)
+
+    def _lookup(self, ip):
+        """(country, asn, org) или None."""
+        key = ip_key(ip)
+        if key is None:
+            return None
+        country = asn = org = None
+        for table in self.tables:
+            found = table.get(ip, key)
+            if found:
+                country = country or found[0]
+                asn = asn or found[1]
+                org = org or found[2]
+        if country is None and asn is None:
+            return None
+        return country, asn, org
+
+    def enrich(self, records):
+        """Обогатитель записей: country, asn, as_org по src_ip."""
+        lookup = self.lookup
+        for record in records:
+            ip = record.get("src_ip")
+            if not ip or "asn" in record or "country" in record:
+                continue
+            geo = lookup(ip)
+            if geo is None:
+                continue
+            country, asn, org = geo
+            if country:
+                record["country"] = country
+            if asn:
+                record["asn"] = asn
+                if org:
+                    record["as_org"] = org
+
+    def summary(self, ips):
+        """Сколько разных ASN и какие страны у набора адресов — для оценки «одно устройство или разные»."""
+        asns = set()
+        countries = set()
+        for ip in ips:
+            geo = self.lookup(ip)
+            if geo:
+                if geo[0]:
+                    countries.add(geo[0])
+                if geo[1]:
+                    asns.add(geo[1])
+        return {"asns": len(asns), "countries": sorted(countries)}
+
+    def stats(self):
+        info = self.lookup.cache_info()
+        return {"ranges": sum(len(t) for t in self.tables), "cache_hits": info.hits,
+                "cache_misses": info.misses, "cache_size": info.currsize}
@@ -0,0 +1,184 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from utils.utils import state_file
+
+INVENTORY_FILE = "inventory.sqlite"
+LEGACY_NODES_FILE = "nodes.json"
+LEGACY_FINGERPRINTS_FILE = "rsyslog_fingerprints.json"
+NODE_FIELDS = ("name", "host", "user", "port", "auth_method", "key_path")
+STATE_FIELDS = ("status", "last_ok", "last_seen", "offset", "errors", "last_error", "last_error_at",
+                "fingerprint", "fingerprint_target", "fingerprint_checked")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    host TEXT,
+    user TEXT,
+    port INTEGER NOT NULL DEFAULT 22,
+    auth_method TEXT,
+    key_path TEXT,
+    added REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS nodes_host ON nodes (host);
+CREATE TABLE IF NOT EXISTS node_state (
+    name TEXT PRIMARY KEY,
+    status TEXT,
+    last_ok REAL,
+    last_seen REAL,
+    offset INTEGER,
+    errors INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    last_error_at REAL,
+    fingerprint TEXT,
+    fingerprint_target TEXT,
+    fingerprint_checked REAL,
+    updated REAL
+);
+"""
+
+_inventories = {}
+_inventories_lock = threading.Lock()
+
+
+class Inventory:
+    """
+    Список нод и их рабочее состояние в SQLite (WAL): добавление и удаление
+    ноды — одна транзакция, а не перезапись всего файла; состояние (смещение,
+    отпечаток конфига, когда были данные, ошибки) обновляется построчно, так
+    что параллельные воркеры не затирают записи друг друга. У каждого потока
+    своё соединение, читатели не ждут писателя.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._db() as db:
+            db.executescript(_SCHEMA)
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    # --- ноды ---
+
+    def nodes(self):
+        """Описания нод в порядке добавления."""
+        rows = self._db().execute(f"SELECT {', '.join(NODE_FIELDS)} FROM nodes ORDER BY id").fetchall()
+        return [dict(row) for row in rows]
+
+    def get(self, name):
+        row = self._db().execute(f"SELECT {', '.join(NODE_FIELDS)} FROM nodes WHERE name = ?", (name,)).fetchone()
+        return dict(row) if row else None
+
+    def find_host(self, host):
+        rows = self._db().execute(f"SELECT {', '.join(NODE_FIELDS)} FROM nodes WHERE host = ? ORDER BY id",
+                                  (host,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def add(self, spec):
+        values = [spec.get(field) for field in NODE_FIELDS]
+        values[3] = values[3] or 22
+        try:
+            with self._db() as db:
+                db.execute(f"INSERT INTO nodes ({', '.join(NODE_FIELDS)}, added) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           (*values, time.time()))
+        except sqlite3.IntegrityError:
+            raise ValueError(f"нода '{spec.get('name')}' уже есть") from None
+
+    def remove(self, name):
+        with self._db() as db:
+            removed = db.execute("DELETE FROM nodes WHERE name = ?", (name,)).rowcount
+            db.execute("DELETE FROM node_state WHERE name = ?", (name,))
+        return bool(removed)
+
+    # --- состояние ---
+
+    def state(self, name):
+        row = self._db().execute("SELECT * FROM node_state WHERE name = ?", (name,)).fetchone()
+        return dict(row) if row else {}
+
+    def states(self):
+        return {row["name"]: dict(row) for row in self._db().execute("SELECT * FROM node_state")}
+
+    def update_state(self, name, **fields):
+        self.update_states({name: fields})
+
+    def update_states(self, updates):
+        """{нода: {поле: значение}} одной транзакцией; незатронутые поля не меняются."""
+        now = time.time()
+        with self._db() as db:
+            for name, fields in updates.items():
+                unknown = set(fields) - set(STATE_FIELDS)
+                if unknown:
+                    raise ValueError(f"нет полей состояния: {', '.join(sorted(unknown))}")
+                columns = ["name", "updated", *fields]
+                assignments = ", ".join(f"{c} = excluded.{c}" for c in columns[1:])
+                db.execute(f"INSERT INTO node_state ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+                           f"ON CONFLICT (name) DO UPDATE SET {assignments}",
+                           (name, now, *fields.values()))
+
+    def record_ok(self, name, status="работает"):
+        self.update_state(name, status=status, last_ok=time.time())
+
+    def record_error(self, name, error, status="ошибка"):
+        """Счётчик ошибок увеличивается в самой базе — без гонки чтение-запись между воркерами."""
+        now = time.time()
+        with self._db() as db:
+            db.execute("INSERT INTO node_state (name, status, errors, last_error, last_error_at, updated) "
+                       "VALUES (?, ?, 1, ?, ?, ?) ON CONFLICT (name) DO UPDATE SET "
+                       "status = excluded.status, errors = errors + 1, last_error = excluded.last_error, "
+                       "last_error_at = excluded.last_error_at, updated = excluded.updated",
+                       (name, status, str(error), now, now))
+
+    # --- переход со старых файлов ---
+
+    def migrate(self, nodes_path=LEGACY_NODES_FILE, fingerprints_path=None):
+        """
+        Однократный перенос nodes.json (и отпечатков rsyslog) в базу. Файлы
+        переименовываются в *.migrated, чтобы перенос не повторялся.
+        """
+        if os.path.exists(nodes_path) and not self._db().execute("SELECT 1 FROM nodes LIMIT 1").fetchone():
+            with open(nodes_path, "r", encoding="utf-8") as f:
+                specs = json.load(f)
+            now = time.time()
+            with self._db() as db:
+                db.executemany(f"INSERT OR IGNORE INTO nodes ({', '.join(NODE_FIELDS)}, added) "
+                               f"VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               [(*(spec.get(field) for field in NODE_FIELDS[:3]), spec.get("port") or 22,
+                                 spec.get("auth_method"), spec.get("key_path"), now) for spec in specs])
+            os.replace(nodes_path, nodes_path + ".migrated")
+            print(f"✅ Ноды из {nodes_path} перенесены в {self.path} ({len(specs)} шт.)")
+        if fingerprints_path and os.path.exists(fingerprints_path):
+            try:
+                with open(fingerprints_path, "r", encoding="utf-8") as f:
+                    fingerprints = json.load(f)
+            except ValueError:
+                fingerprints = {}
+            # ключ старого файла — user@host:port/name
+            self.update_states({
+                target.rpartition("/")[2]: {"fingerprint": entry["hash"], "fingerprint_target": target,
+                                            "fingerprint_checked": entry["checked"]}
+                for target, entry in fingerprints.items()
+            })
+            os.replace(fingerprints_path, fingerprints_path + ".migrated")
+
+
+def get_inventory():
+    """Общая база нод в каталоге состояния; при первом открытии — перенос nodes.json."""
+    path = state_file(INVENTORY_FILE)
+    with _inventories_lock:
+        inventory = _inventories.get(path)
+        if inventory is None:
+            inventory = _inventories[path] = Inventory(path)
+            inventory.migrate(LEGACY_NODES_FILE, state_file(LEGACY_FINGERPRINTS_FILE))
+        return inventory
@@ -0,0 +1,215 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from utils.utils import parse_duration
+from utils.xray_parser import record_epoch
+
+DEFAULT_WINDOWS = ("1m", "10m", "1h")
+HLL_PRECISION = 8
+HLL_BUCKETS = 4
+
+
+class _HyperLogLog:
+    """HyperLogLog с 2^p регистрами в bytearray."""
+
+    __slots__ = ("p", "m", "registers")
+
+    def __init__(self, p=HLL_PRECISION):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(self.m)
+
+    def add(self, value):
+        h = hash(value) & 0xFFFFFFFFFFFFFFFF
+        idx = h >> (64 - self.p)
+        rest = (h << self.p) & 0xFFFFFFFFFFFFFFFF
+        rank = 64 - rest.bit_length() + 1 if rest else 64 - self.p + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def merge_into(self, registers):
+        for i, r in enumerate(self.registers):
+            if r > registers[i]:
+                registers[i] = r
+
+    @staticmethod
+    def estimate(registers):
+        m = len(registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / sum(2.0 ** -r for r in registers)
+        zeros = registers.count(0)
+        if raw <= 2.5 * m and zeros:
+            return round(m * math.log(m / zeros))
+        return round(raw)
+
+
+class _HLLWindow:
+    """Окно из HLL_BUCKETS под-интервалов: старые под-интервалы просто выбрасываются."""
+
+    __slots__ = ("span", "buckets")
+
+    def __init__(self, span):
+        self.span = span / HLL_BUCKETS
+        self.buckets = OrderedDict()
+
+    def add(self, ip, ts, p):
+        key = int(ts // self.span)
+        sketch = self.buckets.get(key)
+        if sketch is None:
+            sketch = self.buckets[key] = _HyperLogLog(p)
+        sketch.add(ip)
+
+    def expire(self, now):
+        # запись с опозданием создаёт под-интервал старше уже имеющихся — проверяем все ключи
+        oldest = int(now // self.span) - HLL_BUCKETS + 1
+        for key in [key for key in self.buckets if key < oldest]:
+            del self.buckets[key]
+
+    def count(self, p):
+        if not self.buckets:
+            return 0
+        registers = bytearray(1 << p)
+        for sketch in self.buckets.values():
+            sketch.merge_into(registers)
+        return _HyperLogLog.estimate(registers)
+
+
+class UserIPIndex:
+    """
+    Инкрементальный индекс «email → источники IP» со скользящими окнами.
+    Для каждого окна и пользователя хранится OrderedDict ip → last_seen
+    по возрастанию last_seen, поэтому истечение — это выталкивание с головы,
+    а число IP за окно — len(), и запрос по всем пользователям стоит O(users).
+    Запись с опозданием (ts меньше последнего) ломает порядок — такой
+    пользователь помечается и пересортировывается при ближайшем истечении.
+    В режиме hll вместо точных множеств — HyperLogLog (оценка, без списка IP).
+    С geo (utils.geoip.GeoIP) отчёт по лимиту показывает ещё число ASN и
+    страны адресов: десяток IP одного мобильного оператора — скорее одно
+    устройство, чем десять.
+    """
+
+    def __init__(self, windows=DEFAULT_WINDOWS, hll=False, hll_precision=HLL_PRECISION, clock=time.time,
+                 geo=None):
+        self.window_names = {parse_duration(w): str(w) for w in windows}
+        self.windows = sorted(self.window_names)
+        self.hll = hll
+        self.hll_precision = hll_precision
+        self.clock = clock
+        self.geo = geo
+        self._lock = threading.Lock()
+        self._data = {w: {} for w in self.windows}
+        self._last_expire = 0.0
+        self._unsorted = {w: set() for w in self.windows}
+
+    def window_seconds(self, window=None):
+        if window is None:
+            return self.windows[0]
+        seconds = parse_duration(window)
+        if seconds not in self._data:
+            raise ValueError(f"нет окна {window}, доступны: {', '.join(self.window_names.values())}")
+        return seconds
+
+    def add(self, email, ip, ts=None):
+        now = self.clock()
+        ts = now if ts is None else ts
+        with self._lock:
+            self._add(email, ip, ts, now)
+
+    def _add(self, email, ip, ts, now):
+        for window, users in self._data.items():
+            if ts < now - window:
+                continue
+            if self.hll:
+                entry = users.get(email)
+                if entry is None:
+                    entry = users[email] = _HLLWindow(window)
+                entry.add(ip, ts, self.hll_precision)
+                continue
+            ips = users.get(email)
+            if ips is None:
+                ips = users[email] = OrderedDict()
+            last = ips.get(ip)
+            if last is None or ts >= last:
+                if ips and ts < next(reversed(ips.values())):
+                    self._unsorted[window].add(email)
+                ips[ip] = ts
+                ips.move_to_end(ip)
+
+    def add_records(self, records):
+        """Sink для follower/приёмника: берёт записи с email и src_ip."""
+        now = self.clock()
+        with self._lock:
+            for record in records:
+                email = record.get("email")
+                ip = record.get("src_ip")
+                if email and ip:
+                    self._add(email, ip, record_epoch(record, now), now)
+            if now - self._last_expire >= 1.0:
+                self._expire(now)
+
+    def _expire(self, now):
+        self._last_expire = now
+        for window, users in self._data.items():
+            cutoff = now - window
+            unsorted = self._unsorted[window]
+            for email in unsorted:
+                ips = users.get(email)
+                if ips:
+                    users[email] = OrderedDict(sorted(ips.items(), key=lambda item: item[1]))
+            unsorted.clear()
+            for email in list(users):
+                entry = users[email]
+                if self.hll:
+                    entry.expire(now)
+                    empty = not entry.buckets
+                else:
+                    while entry and next(iter(entry.values())) < cutoff:
+                        entry.popitem(last=False)
+                    empty = not entry
+                if empty:
+                    del users[email]
+
+    def counts(self, window=None):
+        """{email: число IP за окно}."""
+        window = self.window_seconds(window)
+        now = self.clock()
+        with self._lock:
+            self._expire(now)
+            users = self._data[window]
+            if self.hll:
+                return {email: entry.count(self.hll_precision) for email, entry in users.items()}
+            return {email: len(ips) for email, ips in users.items()}
+
+    def over_limit(self, limit, window=None):
+        """Пользователи, у которых больше limit IP за окно, по убыванию."""
+        result = [(email, n) for email, n in self.counts(window).items() if n > limit]
+        result.sort(key=lambda item: (-item[1], item[0]))
+        return result
+
+    def user_ips(self, email, window=None):
+        """[(ip, last_seen)] пользователя за окно; в режиме hll — пусто."""
+        window = self.window_seconds(window)
+        with self._lock:
+            self._expire(self.clock())
+            if self.hll:
+                return []
+            ips = self._data[window].get(email) or {}
+            return sorted(ips.items(), key=lambda item: -item[1])
+
+    def limit_report(self, limit, window=None):
+        """over_limit() строками для вывода; с geo — плюс asns и countries (в режиме hll их нет)."""
+        rows = []
+        for email, n in self.over_limit(limit, window):
+            row = {"email": email, "ips": n}
+            if self.geo and not self.hll:
+                row.update(self.geo.summary(ip for ip, _ in self.user_ips(email, window)))
+            rows.append(row)
+        return rows
+
+    def register_api(self, api):
+        """/ip-limit?limit=N&window=10m и /user-ips?email=X&window=10m."""
+        api.route("/ip-limit", lambda q: self.limit_report(int(q.get("limit", 0)), q.get("window")))
+        api.route("/user-ips", lambda q: [
+            {"ip": ip, "last_seen": ts} for ip, ts in self.user_ips(q["email"], q.get("window"))
+        ])
@@ -0,0 +1,77 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from urllib.request import urlopen
+
+DEFAULT_API_HOST = "127.0.0.1"
+DEFAULT_API_PORT = 8765
+
+
+class LocalAPI:
+    """
+    Маленький HTTP API только на localhost. Обработчик получает словарь
+    query-параметров и возвращает объект для JSON либо (content_type, текст).
+    """
+
+    def __init__(self, host=DEFAULT_API_HOST, port=DEFAULT_API_PORT):
+        self.host = host
+        self.port = port
+        self.routes = {}
+        self._httpd = None
+
+    def route(self, path, handler):
+        self.routes[path] = handler
+
+    def _make_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                handler = api.routes.get(url.path)
+                if handler is None:
+                    return self._send(404, {"error": "not found", "routes": sorted(api.routes)})
+                params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                try:
+                    self._send(200, handler(params))
+                except (KeyError, ValueError) as e:
+                    self._send(400, {"error": str(e)})
+                except Exception as e:
+                    self._send(500, {"error": str(e)})
+
+            def _send(self, status, result):
+                if isinstance(result, tuple):
+                    content_type, body = result
+                    body = body.encode("utf-8")
+                else:
+                    content_type = "application/json"
+                    body = json.dumps(result, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._httpd = ThreadingHTTPServer((self.host, self.port), self._make_handler())
+        self._httpd.daemon_threads = True
+        threading.Thread(target=self._httpd.serve_forever, name="local-api", daemon=True).start()
+        print(f"✅ Локальный API: http://{self.host}:{self.port}")
+
+    def stop(self):
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+
+def api_get(path, port=DEFAULT_API_PORT, host=DEFAULT_API_HOST, timeout=5):
+    """Запрос к локальному API уже запущенного экземпляра."""
+    with urlopen(f"http://{host}:{port}{path}", timeout=timeout) as resp:
+        return json.loads(resp.read().decode("utf-8"))
@@ -0,0 +1,298 @@
+import bisect
+import threading
+import time
+from utils.xray_parser import parse_xray_line, record_epoch
+
+# Метрики обновляются на уровне пачек (сброс буфера, SSH команда), а не
+# каждой строки, поэтому их можно держать включёнными всегда.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LAG_BUCKETS = (0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+DASHBOARD_INTERVAL = 1.0
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def items(self):
+        with self._lock:
+            return [(dict(zip(self.labels, key)), self._copy(value)) for key, value in self._values.items()]
+
+    def _copy(self, value):
+        return value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels))
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными корзинами: [счётчики корзин..., +Inf], сумма, количество."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][idx] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _copy(self, value):
+        return [list(value[0]), value[1], value[2]]
+
+    def quantile(self, q, counts):
+        """Оценка квантиля по корзинам (верхняя граница корзины)."""
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for i, n in enumerate(counts):
+            seen += n
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+
+def _register(cls, name, *args, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, *args, **kwargs)
+        return metric
+
+
+def counter(name, help, labels=()):
+    return _register(Counter, name, help, labels)
+
+
+def gauge(name, help, labels=()):
+    return _register(Gauge, name, help, labels)
+
+
+def histogram(name, help, labels=(), buckets=LATENCY_BUCKETS):
+    return _register(Histogram, name, help, labels, buckets)
+
+
+LINES = counter("ddlog_lines_total", "Принято строк лога", ("node", "source"))
+BYTES = counter("ddlog_bytes_total", "Принято байт лога", ("node", "source"))
+LAST_SEEN = gauge("ddlog_last_receive_timestamp_seconds", "Когда от ноды последний раз пришли строки", ("node",))
+LAG = histogram("ddlog_ingest_lag_seconds", "Задержка: время получения минус время строки в логе",
+                ("node",), LAG_BUCKETS)
+WRITE = histogram("ddlog_write_seconds", "Время записи пачки на диск", ("target",))
+DROPS = counter("ddlog_drops_total", "Потери: отброшенные кадры, усечённые файлы и т.п.", ("source", "reason"))
+DUPLICATES = counter("ddlog_duplicate_batches_total", "Повторно присланные агентом пачки", ("node",))
+BACKLOG = gauge("ddlog_follower_backlog_bytes", "Сколько байт лога ещё не прочитано", ("path",))
+SSH_LATENCY = histogram("ddlog_ssh_seconds", "Длительность SSH операций", ("host", "op"))
+SSH_FAILURES = counter("ddlog_ssh_failures_total", "Неудачные SSH подключения", ("host",))
+PIPELINE_INFLIGHT = gauge("ddlog_pipeline_inflight_batches", "Пачки в разборе у воркера пула", ("shard",))
+PIPELINE_STALLS = counter("ddlog_pipeline_stalls_total", "Сколько раз приёмник ждал отстающий воркер разбора",
+                          ("shard",))
+
+
+def observe_batch(node, source, lines, size, last_line=None, last_record=None):
+    """Учесть пачку строк ноды: счётчики, время получения и (по последней строке) задержку."""
+    now = time.time()
+    LINES.inc(lines, node=node, source=source)
+    BYTES.inc(size, node=node, source=source)
+    LAST_SEEN.set(now, node=node)
+    if last_record is None and last_line is not None:
+        last_record = parse_xray_line(last_line.decode("utf-8", errors="replace")
+                                      if isinstance(last_line, bytes) else last_line)
+    if last_record is not None:
+        epoch = record_epoch(last_record, default=0)
+        if epoch:
+            LAG.observe(max(0.0, now - epoch), node=node)
+
+
+def snapshot():
+    """Все метрики в виде JSON-совместимого словаря."""
+    result = {}
+    for metric in list(_registry.values()):
+        values = []
+        for labels, value in metric.items():
+            if metric.kind == "histogram":
+                counts, total, count = value
+                values.append({"labels": labels, "count": count, "sum": round(total, 6),
+                               "buckets": dict(zip([*map(str, metric.buckets), "+Inf"], counts)),
+                               "p50": _json_bound(metric.quantile(0.5, counts)),
+                               "p95": _json_bound(metric.quantile(0.95, counts))})
+            else:
+                values.append({"labels": labels, "value": value})
+        result[metric.name] = {"type": metric.kind, "help": metric.help, "values": values}
+    return result
+
+
+def _json_bound(value):
+    return "+Inf" if value == float("inf") else value
+
+
+def _label_text(labels, extra=None):
+    pairs = list(labels.items()) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def render_prometheus():
+    """Текстовый формат Prometheus (exposition format 0.0.4)."""
+    out = []
+    for metric in list(_registry.values()):
+        out.append(f"# HELP {metric.name} {metric.help}")
+        out.append(f"# TYPE {metric.name} {metric.kind}")
+        for labels, value in metric.items():
+            if metric.kind == "histogram":
+                counts, total, count = value
+                cumulative = 0
+                for bound, n in zip([*map(str, metric.buckets), "+Inf"], counts):
+                    cumulative += n
+                    out.append(f"{metric.name}_bucket{_label_text(labels, {'le': bound})} {cumulative}")
+                out.append(f"{metric.name}_sum{_label_text(labels)} {total}")
+                out.append(f"{metric.name}_count{_label_text(labels)} {count}")
+            else:
+                out.append(f"{metric.name}{_label_text(labels)} {value}")
+    return "\n".join(out) + "\n"
+
+
+def register_api(api):
+    """/metrics (Prometheus) и /metrics.json на локальном API."""
+    api.route("/metrics", lambda q: ("text/plain; version=0.0.4; charset=utf-8", render_prometheus()))
+    api.route("/metrics.json", lambda q: snapshot())
+
+
+def _values(snap, name):
+    return snap.get(name, {}).get("values", [])
+
+
+def _node_rows(snap, previous, elapsed):
+    """Строки панели по нодам из снимка: скорость по разнице с прошлым снимком."""
+    lines = {}
+    size = {}
+    for item in _values(snap, LINES.name):
+        node = item["labels"]["node"]
+        lines[node] = lines.get(node, 0) + item["value"]
+    for item in _values(snap, BYTES.name):
+        node = item["labels"]["node"]
+        size[node] = size.get(node, 0) + item["value"]
+    lag = {item["labels"]["node"]: item for item in _values(snap, LAG.name)}
+    seen = {item["labels"]["node"]: item["value"] for item in _values(snap, LAST_SEEN.name)}
+    now = time.time()
+    rows = []
+    for node in sorted(lines):
+        prev_lines, prev_bytes = previous.get(node, (lines[node], size.get(node, 0)))
+        rows.append({
+            "node": node,
+            "lines_per_s": (lines[node] - prev_lines) / elapsed if elapsed else 0.0,
+            "bytes_per_s": (size.get(node, 0) - prev_bytes) / elapsed if elapsed else 0.0,
+            "lines": lines[node],
+            "idle": now - seen[node] if node in seen else None,
+            "lag_p50": lag[node]["p50"] if node in lag else None,
+            "lag_p95": lag[node]["p95"] if node in lag else None,
+        })
+        previous[node] = (lines[node], size.get(node, 0))
+    return rows
+
+
+def _fmt(value, fmt="{:.0f}"):
+    if value is None:
+        return "-"
+    if isinstance(value, str):
+        return value
+    return fmt.format(value)
+
+
+def _dashboard(snap, previous, elapsed):
+    from rich.console import Group
+    from rich.table import Table
+
+    nodes = Table(title="Ноды")
+    for col in ("Нода", "строк/с", "КБ/с", "всего строк", "тишина, с", "lag p50, с", "lag p95, с"):
+        nodes.add_column(col, justify="left" if col == "Нода" else "right")
+    for row in _node_rows(snap, previous, elapsed):
+        idle = row["idle"]
+        style = "red" if idle is not None and idle > 60 else ""
+        nodes.add_row(row["node"], f"{row['lines_per_s']:.0f}", f"{row['bytes_per_s'] / 1024:.1f}",
+                      str(row["lines"]), f"[{style}]{_fmt(idle)}[/{style}]" if style else _fmt(idle),
+                      _fmt(row["lag_p50"], "{:g}"), _fmt(row["lag_p95"], "{:g}"))
+
+    other = Table(title="Запись, SSH и потери")
+    other.add_column("Метрика")
+    other.add_column("Метки")
+    other.add_column("Значение", justify="right")
+    for metric in (WRITE, SSH_LATENCY):
+        for item in _values(snap, metric.name):
+            count = item["count"]
+            other.add_row(metric.name, ",".join(f"{k}={v}" for k, v in item["labels"].items()),
+                          f"n={count} avg={item['sum'] / count * 1000:.1f}мс "
+                          f"p95≤{_fmt(item['p95'], '{:g}')}с")
+    for metric in (DROPS, DUPLICATES, SSH_FAILURES, BACKLOG, PIPELINE_INFLIGHT, PIPELINE_STALLS):
+        for item in _values(snap, metric.name):
+            other.add_row(metric.name, ",".join(f"{k}={v}" for k, v in item["labels"].items()),
+                          str(item["value"]))
+    return Group(nodes, other)
+
+
+def live_dashboard(console=None, interval=DASHBOARD_INTERVAL, fetch=snapshot):
+    """Живая панель метрик в терминале до Ctrl+C; fetch — откуда брать снимок (свой процесс или демон)."""
+    from rich.console import Console
+    from rich.live import Live
+
+    console = console or Console()
+    previous = {}
+    snap = fetch()
+    _node_rows(snap, previous, 0)
+    last = time.monotonic()
+    console.print("--- Метрики (Ctrl+C для выхода) ---")
+    try:
+        with Live(_dashboard(snap, dict(previous), 0), console=console, refresh_per_second=4) as live:
+            while True:
+                time.sleep(interval)
+                snap = fetch()
+                now = time.monotonic()
+                live.update(_dashboard(snap, previous, now - last))
+                last = now
+    except KeyboardInterrupt:
+        console.print("\nВыход.")
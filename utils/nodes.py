@@ -1,15 +1,33 @@
 import subprocess
-import threading
 import getpass
-import paramiko
-import os
-import json
+import re
 import shlex
-from datetime import datetime
-from utils.utils import get_public_ip, convert_old_xray_log_to_json
-from utils.rsyslog_setup import remove_rsyslog_config, remove_ufw_rules, setup_remote_rsyslog
+from utils.utils import convert_old_xray_log_to_json
+from utils.rsyslog_setup import remove_rsyslog_config, remove_ufw_rules, setup_remote_rsyslog, forget_fingerprint
+from utils.follower import LogFollower, XRAY_LOG_PATH
+from utils.sinks import emit_records
+from utils.viewer import follow_nodes
+from utils.ssh_manager import SSHConnection, CommandResult, DEFAULT_COMMAND_TIMEOUT
+from utils.agent import AGENT_TOKEN_ENV, DEFAULT_AGENT_PORT, agent_token
+from utils.syslog_server import DEFAULT_SYSLOG_PORT
+from utils.inventory import get_inventory
+from utils import metrics
+
+REMOTE_BIN_PATH = "/usr/local/bin/ddlog-xray-forwarding.bin"
+
+
+def _ere_escape(text):
+    """Экранировать текст для расширенного регулярного выражения pgrep/pkill."""
+    return re.sub(r"([][\\.^$*+?(){}|])", r"\\\1", text)
+
+
+def _agent_pattern(bin_path):
+    """
+    Шаблон для pgrep/pkill -f, который не совпадает с командной строкой самого sh -c:
+    она содержит тот же путь с --agent (в nohup), поэтому шаблон привязан к началу.
+    """
+    return f"^{_ere_escape(bin_path)} --agent"
 
-central_server_ip = get_public_ip()
 
 class Node:
     def __init__(self, name, host=None, user=None, port=22, auth_method=None, key_path=None):
@@ -21,70 +39,135 @@ class Node:
         self.key_path = key_path
         self.password = None
         self.ssh = None
+        self.conn = None
+        self.follower = None
         self.local = host is None
 
+    def ensure_password(self):
+        """Запросить пароль заранее (до запуска потоков), чтобы промпты не перемешивались."""
+        if self.local or self.auth_method == "key" or self.password is not None:
+            return
+        self.password = getpass.getpass(f"Введите SSH пароль для {self.user}@{self.host}: ")
+
     def connect_ssh(self):
+        """Проверить/поднять SSH соединение (keepalive, переподключение с backoff)."""
         if self.local:
             return True
-        if self.ssh:
-            return True
+        if self.conn is None:
+            self.ensure_password()
+            self.conn = SSHConnection(self.host, port=self.port, user=self.user,
+                                      auth_method=self.auth_method, key_path=self.key_path,
+                                      password=self.password)
+        ok = self.conn.ensure()
+        self.ssh = self.conn.client if ok else None
+        return ok
 
-        self.ssh = paramiko.SSHClient()
-        self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        try:
-            if self.auth_method == "key":
-                self.ssh.connect(self.host, port=self.port, username=self.user, key_filename=self.key_path, timeout=10)
-            else:
-                if self.password is None:
-                    self.password = getpass.getpass(f"Введите SSH пароль для {self.user}@{self.host}: ")
-                self.ssh.connect(self.host, port=self.port, username=self.user, password=self.password, timeout=10)
-            return True
-        except Exception as e:
-            print(f"❌ Ошибка подключения к {self.host}: {e}")
-            self.ssh = None
-            return False
+    def run(self, command, timeout=DEFAULT_COMMAND_TIMEOUT):
+        """Выполнить команду на удалённой ноде и дождаться результата (CommandResult)."""
+        if not self.connect_ssh() or self.conn is None:
+            # у локальной ноды connect_ssh() — True, но SSH соединения нет
+            return CommandResult(command, -1, "", "нет SSH соединения", 0.0)
+        return self.conn.run(command, timeout=timeout)
+
+    def run_many(self, commands, timeout=DEFAULT_COMMAND_TIMEOUT):
+        """Несколько команд за один round-trip."""
+        if not self.connect_ssh() or self.conn is None:
+            return [CommandResult(cmd, -1, "", "нет SSH соединения", 0.0) for cmd in commands]
+        return self.conn.run_many(commands, timeout=timeout)
+
+    def ssh_stats(self):
+        return self.conn.stats() if self.conn else None
 
     def start_local_tail_in_background(self):
-        """Для локальной ноды запускаем tail -F в фоне, который пишет логи в json."""
+        """Для локальной ноды запускаем встроенный follower, который пишет логи в json."""
         filename = f"/var/log/xray_{self.name}.json"
+        if self.follower and self.follower.is_alive():
+            print(f"Сбор логов для '{self.name}' уже запущен.")
+            return
         self.convert_old_log_to_json()
+        # tail из старых версий дописывал в тот же файл сырые строки и копил дубли
+        subprocess.run(["pkill", "-f", f"tail -n \\+1 -F {XRAY_LOG_PATH} >> {filename}"],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.follower = LogFollower(XRAY_LOG_PATH, filename, sinks=[emit_records], node=self.name)
+        self.follower.start()
+        print(f"✅ Локальный сбор логов запущен в фоне для '{self.name}' → {filename}")
 
-        # Проверяем, не запущен ли уже tail (по файлу pid, или по процессам — можно добавить)
-        # Для простоты — просто запускаем nohup tail
-        cmd = f"nohup tail -n +1 -F /var/log/remnanode/xray.out.log >> {filename} 2>&1 &"
-        subprocess.Popen(shlex.split(cmd))
-        print(f"✅ Локальный tail запущен в фоне для '{self.name}' → {filename}")
+    def stop_background_log_collection(self):
+        if self.follower:
+            self.follower.stop()
+            self.follower = None
 
-    def start_remote_log_forwarding(self, central_server_ip):
-        """Для удалённой ноды настраиваем rsyslog + запускаем форвардер."""
+    def start_remote_log_forwarding(self, central_server_ip, agent_port=None, syslog_port=DEFAULT_SYSLOG_PORT):
+        """
+        Для удалённой ноды настраиваем rsyslog (шлёт на syslog_port центра),
+        либо (agent_port) запускаем агент-форвардер.
+        """
         if not self.connect_ssh():
-            return
+            return False
+        if agent_port:
+            print(f"Запуск агента-форвардера на {self.name} ({self.host})...")
+            return self.run_remote_binary(central_server_ip, agent_port)
         print(f"Настройка rsyslog для удалённой ноды {self.name} ({self.host})...")
         # ЯВНО передаём central_server_ip дальше
-        setup_remote_rsyslog(self, central_server_ip)
-        print(f"Запуск бинарника форвардера...")
-        self.run_remote_binary()
+        return setup_remote_rsyslog(self, central_server_ip, port=syslog_port)
 
-    def start_background_log_collection(self, central_server_ip=None):
+    def start_background_log_collection(self, central_server_ip=None, agent_port=None,
+                                        syslog_port=DEFAULT_SYSLOG_PORT):
         if self.local:
             self.start_local_tail_in_background()
+            return True
         else:
             # при загрузке/добавлении ноды обязательно передавайте central_server_ip
             if central_server_ip is None:
                 # на случай, если вызвали без параметра — предупредим, но не ломаем
                 print(f"[WARN] central_server_ip не передан для ноды {self.name}, пропускаем настройку rsyslog.")
-                return
-            self.start_remote_log_forwarding(central_server_ip)
+                return False
+            return self.start_remote_log_forwarding(central_server_ip, agent_port, syslog_port)
 
-    def run_remote_binary(self, bin_path="/usr/local/bin/ddlog-xray-forwarding.bin"):
+    def run_remote_binary(self, central_server_ip, agent_port=DEFAULT_AGENT_PORT, bin_path=REMOTE_BIN_PATH):
+        """
+        Запустить на ноде бинарник в режиме агента. Конфиг rsyslog этой ноды
+        убирается, чтобы логи не уходили в центр дважды.
+        """
         if not self.connect_ssh():
-            return
-        cmd = f"nohup {bin_path} > /var/log/ddlog-forwarder.log 2>&1 &"
-        try:
-            self.ssh.exec_command(cmd)
-            print(f"✅ Запущен бинарник на {self.host} в фоне.")
-        except Exception as e:
-            print(f"Ошибка запуска бинарника на {self.host}: {e}")
+            return False
+        conf_path = f"/etc/rsyslog.d/30-xray-{self.name}.conf"
+        q = shlex.quote
+        # pgrep -xf сравнивает с argv через пробел, а sh получает то же самое в кавычках
+        argv = [bin_path, "--agent", "--central", f"{central_server_ip}:{agent_port}", "--name", self.name]
+        args = " ".join(q(a) for a in argv)
+        # агент с теми же параметрами уже работает — второй не запускаем,
+        # агенты со старыми параметрами (другой центр/порт) гасим
+        cmd = (
+            f"test -x {q(bin_path)} || exit 127; "
+            f"if [ -f {q(conf_path)} ]; then rm -f {q(conf_path)}; systemctl restart rsyslog; fi; "
+            f"pgrep -xf {q(_ere_escape(' '.join(argv)))} >/dev/null && exit 3; "
+            f"pkill -f {q(_agent_pattern(bin_path))}; "
+            # токен — через окружение: argv агента виден всем в ps и /proc
+            f"{AGENT_TOKEN_ENV}={q(agent_token())} nohup {args} > /var/log/ddlog-forwarder.log 2>&1 &"
+        )
+        result = self.run(cmd)
+        if result.status == 127:
+            print(f"❌ На {self.host} нет {bin_path} — сначала загрузите бинарник.")
+            return False
+        forget_fingerprint(self)
+        if result.status == 3:
+            print(f"✅ Агент на {self.host} уже запущен.")
+            return True
+        if not result.ok:
+            print(f"Ошибка запуска бинарника на {self.host}: {result.stderr.strip()}")
+            return False
+        print(f"✅ Запущен агент на {self.host} в фоне.")
+        return True
+
+    def collection_alive(self, agent_port=None, bin_path=REMOTE_BIN_PATH):
+        """Проверка, что сбор логов с ноды идёт: follower, агент или rsyslog с нашим конфигом."""
+        if self.local:
+            return bool(self.follower and self.follower.is_alive())
+        if agent_port:
+            return self.run(f"pgrep -f {shlex.quote(_agent_pattern(bin_path))} >/dev/null").ok
+        conf_path = f"/etc/rsyslog.d/30-xray-{self.name}.conf"
+        return self.run(f"test -f {shlex.quote(conf_path)} && systemctl is-active --quiet rsyslog").ok
 
     def convert_old_log_to_json(self):
         if self.local:
@@ -95,30 +178,15 @@ class Node:
             print(f"Конвертация доступна только для локальной ноды '{self.name}'")
             return False
 
-    def tail_logs_realtime(self):
-        """Просмотр логов в реальном времени — локально или по SSH."""
-        if self.local:
-            cmd = ["tail", "-n", "+1", "-F", "/var/log/remnanode/xray.out.log"]
-            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            stream = proc.stdout
-        else:
-            if not self.connect_ssh():
-                return
-            _, stream, _ = self.ssh.exec_command("tail -n +1 -F /var/log/remnanode/xray.out.log")
-
-        print(f"--- Просмотр логов '{self.name}' (Ctrl+C для выхода) ---")
-        try:
-            for line in iter(stream.readline, ""):
-                print(line, end="")
-        except KeyboardInterrupt:
-            print("\nВыход.")
-        except Exception as e:
-            print(f"Ошибка при просмотре: {e}")
+    def tail_logs_realtime(self, **options):
+        """Просмотр логов в реальном времени — локально или по SSH (см. utils.viewer.follow_nodes)."""
+        follow_nodes([self], **options)
 
     def remove_rsyslog_config(self):
         if self.local:
             print(f"Локальную ноду '{self.name}' удалять вручную.")
             return
+        forget_fingerprint(self)
         if not self.connect_ssh():
             return
         conf_path = f"/etc/rsyslog.d/30-xray-{self.name}.conf"
@@ -128,54 +196,49 @@ class Node:
         except Exception as e:
             print(f"Ошибка при удалении конфига rsyslog на {self.host}: {e}")
 
-    def run_remote_binary(self, bin_path="/usr/local/bin/ddlog-xray-forwarding.bin"):
-        if not self.connect_ssh():
-            return
-        cmd = f"nohup {bin_path} > /var/log/ddlog-forwarder.log 2>&1 &"
-        try:
-            self.ssh.exec_command(cmd)
-            print(f"✅ Запущен бинарник на {self.host} в фоне.")
-        except Exception as e:
-            print(f"Ошибка запуска бинарника на {self.host}: {e}")
-
-    def convert_old_log_to_json(self):
-        if self.local:
-            log_path = "/var/log/remnanode/xray.out.log"
-            json_path = f"/var/log/xray_{self.name}.json"
-            return convert_old_xray_log_to_json(log_path, json_path)
-        else:
-            print(f"Конвертация доступна только для локальной ноды '{self.name}'")
-            return False
+def node_to_dict(n):
+    return {
+        "name": n.name,
+        "host": n.host,
+        "user": n.user,
+        "port": n.port,
+        "auth_method": n.auth_method,
+        "key_path": n.key_path
+    }
 
 def load_nodes():
-    if os.path.exists("nodes.json"):
-        with open("nodes.json", "r", encoding="utf-8") as f:
-            data = json.load(f)
-            return [Node(**n) for n in data]
-    return []
-
-def save_nodes(nodes):
-    with open("nodes.json", "w", encoding="utf-8") as f:
-        json.dump([{
-            "name": n.name,
-            "host": n.host,
-            "user": n.user,
-            "port": n.port,
-            "auth_method": n.auth_method,
-            "key_path": n.key_path
-        } for n in nodes], f, ensure_ascii=False, indent=2)
-
-def add_node(nodes, central_server_ip):
+    return [Node(**spec) for spec in get_inventory().nodes()]
+
+def store_node(node):
+    """Записать новую ноду в базу (ValueError, если имя занято)."""
+    get_inventory().add(node_to_dict(node))
+
+def delete_node(node):
+    get_inventory().remove(node.name)
+
+def save_node_state(nodes):
+    """Когда от нод были данные и смещение локального follower'а — в базу одной транзакцией."""
+    seen = {labels["node"]: value for labels, value in metrics.LAST_SEEN.items()}
+    updates = {}
+    for node in nodes:
+        fields = {}
+        if node.name in seen:
+            fields["last_seen"] = seen[node.name]
+        if node.follower:
+            fields["offset"] = node.follower.offset
+        if fields:
+            updates[node.name] = fields
+    if updates:
+        get_inventory().update_states(updates)
+
+def prompt_node():
+    """Спросить параметры новой ноды; возвращает Node (ещё не подключённую) или None."""
     print("Добавление ноды:")
     node_type = input("Выберите тип ноды:\n1) Локальная\n2) Удалённая\nВыбор (1/2): ").strip()
 
     if node_type == "1":
         name = input("Имя локальной ноды: ").strip()
-        node = Node(name=name)
-        node.convert_old_log_to_json() 
-        node.start_background_log_collection(central_server_ip) 
-        nodes.append(node)
-        print(f"✅ Локальная нода '{name}' добавлена и настроена.")
+        return Node(name=name)
     elif node_type == "2":
         # Добавляем удалённую ноду
         name = input("Имя ноды: ").strip()
@@ -192,21 +255,45 @@ def add_node(nodes, central_server_ip):
             auth_method = "password"
             key_path = None
 
-        node = Node(name=name, host=host, user=user, port=port, auth_method=auth_method, key_path=key_path)
-        if node.connect_ssh():
-            print("Настройка rsyslog на удалённой ноде...")
-            setup_remote_rsyslog(node, central_server_ip)
-            node.start_background_log_collection(central_server_ip) 
-            nodes.append(node)
-            print(f"✅ Удалённая нода '{name}' добавлена и настроена.")
-        else:
-            print("❌ Не удалось подключиться и настроить ноду.")
+        return Node(name=name, host=host, user=user, port=port, auth_method=auth_method, key_path=key_path)
+    print("❌ Некорректный выбор, нода не добавлена.")
+    return None
+
+def add_node(nodes, central_server_ip, agent_port=None, syslog_port=DEFAULT_SYSLOG_PORT):
+    node = prompt_node()
+    if node is None:
+        return
+    if any(n.name == node.name for n in nodes):
+        print(f"❌ Нода '{node.name}' уже есть.")
+        return
+    if node.local:
+        node.convert_old_log_to_json()
+        node.start_background_log_collection(central_server_ip)
+        store_node(node)
+        nodes.append(node)
+        print(f"✅ Локальная нода '{node.name}' добавлена и настроена.")
+    elif node.connect_ssh():
+        node.start_background_log_collection(central_server_ip, agent_port, syslog_port)
+        store_node(node)
+        nodes.append(node)
+        print(f"✅ Удалённая нода '{node.name}' добавлена и настроена.")
     else:
-        print("❌ Некорректный выбор, нода не добавлена.")
+        print("❌ Не удалось подключиться и настроить ноду.")
+
 
+def stop_remote_agent(node, bin_path=REMOTE_BIN_PATH):
+    """Остановить агент-форвардер на ноде; его отсутствие — не ошибка (pkill → 1)."""
+    result = node.run(f"pkill -f {shlex.quote(_agent_pattern(bin_path))}")
+    if result.status not in (0, 1):
+        print(f"Ошибка остановки агента на {node.host}: {result.stderr.strip() or result.status}")
+        return False
+    return True
 
-def remove_remote_node(node, central_server_ip):
-    print(f"Удаляем конфиг rsyslog и ufw правила на ноде {node.name}...")
-    remove_rsyslog_config(node)
-    remove_ufw_rules(node, central_server_ip)
-    print(f"Удалено.")
\ No newline at end of file
+def remove_remote_node(node, central_server_ip, port=DEFAULT_SYSLOG_PORT, bin_path=REMOTE_BIN_PATH):
+    """Убрать с ноды агент, конфиг rsyslog и правила ufw для порта port. True — всё удалось."""
+    print(f"Удаляем агент, конфиг rsyslog и ufw правила на ноде {node.name}...")
+    ok = remove_rsyslog_config(node)
+    ok = stop_remote_agent(node, bin_path) and ok
+    ok = remove_ufw_rules(node, central_server_ip, port) and ok
+    print("Удалено." if ok else "⚠️ Удалено не всё, см. ошибки выше.")
+    return ok
\ No newline at end of file
@@ -0,0 +1,203 @@
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import zlib
+from utils import metrics
+from utils.sinks import emit_records, has_record_sinks
+from utils.syslog_server import node_from_frame
+from utils.xray_parser import parse_xray_line
+
+DEFAULT_MAX_INFLIGHT = 8
+WORKER_POLL_INTERVAL = 1.0
+
+
+def default_workers():
+    """Все ядра, кроме одного — его оставляем приёмникам и sinks."""
+    return max(1, (os.cpu_count() or 1) - 1)
+
+
+def shard_of(node, shards):
+    """Стабильный номер шарда ноды: одна нода — всегда один воркер, порядок строк сохраняется."""
+    return zlib.crc32(node.encode("utf-8")) % shards
+
+
+def parse_items(items):
+    """[(нода или None, строки через \\n)] → записи в исходном порядке."""
+    records = []
+    for node, blob in items:
+        for raw in blob.split(b"\n"):
+            if not raw:
+                continue
+            record = parse_xray_line(raw.decode("utf-8", errors="replace"))
+            if node:
+                record.setdefault("node", node)
+            records.append(record)
+    return records
+
+
+def _worker(inbox, outbox, shard, generation):
+    # Ctrl+C и SIGTERM получает вся группа процессов; воркер завершает родитель,
+    # дочитав очередь, а не сигнал посреди пачки
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    parent = os.getppid()
+    while True:
+        try:
+            items = inbox.get(timeout=WORKER_POLL_INTERVAL)
+        except queue.Empty:
+            if os.getppid() != parent:
+                return  # родитель убит без close() — не остаёмся сиротой
+            continue
+        if items is None:
+            return
+        try:
+            outbox.put((shard, generation, parse_items(items), None))
+        except Exception as e:
+            outbox.put((shard, generation, None, str(e)))
+
+
+class ParsePool:
+    """
+    Разбор строк в пуле процессов, шардированный по ноде. Приёмники отдают
+    пачки {нода: [сырые строки]}; строки одной ноды склеиваются в один
+    bytes и уходят одним сообщением в очередь своего шарда, так что
+    сериализация идёт на пачку, а не на строку. У шарда один процесс и
+    FIFO очередь — порядок строк ноды сохраняется. Готовые записи отдаёт
+    в emit_records один поток-сборщик.
+
+    Не больше max_inflight пачек на шард в обработке: при отставании
+    воркера submit() ждёт, и приёмник перестаёт читать сокет/файл, вместо
+    того чтобы копить память. Упавший воркер перезапускается, его пачки
+    считаются потерянными (ddlog_drops_total{source="pipeline"}).
+    """
+
+    def __init__(self, workers=None, max_inflight=DEFAULT_MAX_INFLIGHT):
+        self.workers = workers or default_workers()
+        self.max_inflight = max_inflight
+        self._ctx = multiprocessing.get_context("spawn")
+        self._outbox = self._ctx.Queue()
+        self._processes = [None] * self.workers
+        self._inboxes = [None] * self.workers
+        self._generations = [0] * self.workers
+        self._slots = [threading.Semaphore(max_inflight) for _ in range(self.workers)]
+        self._inflight = [0] * self.workers
+        self._lock = threading.Lock()
+        self._send_locks = [threading.Lock() for _ in range(self.workers)]
+        self._collector = None
+        self._closing = False
+
+    def start(self):
+        for shard in range(self.workers):
+            self._spawn(shard)
+        self._collector = threading.Thread(target=self._collect, name="parse-pool", daemon=True)
+        self._collector.start()
+        print(f"✅ Разбор логов: {self.workers} процессов")
+        return self
+
+    def _spawn(self, shard):
+        inbox = self._ctx.Queue()
+        process = self._ctx.Process(target=_worker, args=(inbox, self._outbox, shard, self._generations[shard]),
+                                    name=f"ddlog-parse-{shard}", daemon=True)
+        process.start()
+        self._inboxes[shard] = inbox
+        self._processes[shard] = process
+
+    # --- приём ---
+
+    def submit(self, batch):
+        """Sink для NodeWriters вместо emit_syslog_lines: {нода: [сырые строки]}."""
+        if not has_record_sinks():
+            return
+        per_shard = {}
+        for node, lines in batch.items():
+            if lines:
+                per_shard.setdefault(shard_of(node, self.workers), []).append((node, b"\n".join(lines)))
+        for shard, items in per_shard.items():
+            self._send(shard, items)
+
+    def submit_lines(self, lines):
+        """Sink для follower'а с parse=False: общий лог центра, нода — по тегу xray-node-<name>."""
+        if not lines:
+            return
+        per_node = {}
+        for raw in lines:
+            per_node.setdefault(node_from_frame(raw), []).append(raw)
+        sinks = has_record_sinks()
+        per_shard = {}
+        for node, node_lines in per_node.items():
+            metrics.observe_batch(node, "rsyslog", len(node_lines), sum(len(r) + 1 for r in node_lines),
+                                  last_line=node_lines[-1])
+            if sinks:
+                # имя ноды парсер возьмёт из тега в самой строке
+                per_shard.setdefault(shard_of(node, self.workers), []).append((None, b"\n".join(node_lines)))
+        for shard, items in per_shard.items():
+            self._send(shard, items)
+
+    def _send(self, shard, items):
+        slots = self._slots[shard]
+        if not slots.acquire(blocking=False):
+            metrics.PIPELINE_STALLS.inc(shard=shard)
+            slots.acquire()
+        with self._lock:
+            self._inflight[shard] += 1
+            metrics.PIPELINE_INFLIGHT.set(self._inflight[shard], shard=shard)
+        # порядок пачек одной ноды: в очередь шарда кладёт один поток за раз
+        with self._send_locks[shard]:
+            self._inboxes[shard].put(items)
+
+    # --- сборщик ---
+
+    def _collect(self):
+        while True:
+            try:
+                item = self._outbox.get(timeout=WORKER_POLL_INTERVAL)
+            except queue.Empty:
+                self._check_workers()
+                continue
+            if item is None:
+                return
+            shard, generation, records, error = item
+            with self._lock:
+                current = generation == self._generations[shard]
+                if current:
+                    self._inflight[shard] -= 1
+                    metrics.PIPELINE_INFLIGHT.set(self._inflight[shard], shard=shard)
+            if current:
+                self._slots[shard].release()
+            if error:
+                print(f"Ошибка разбора в воркере {shard}: {error}")
+                metrics.DROPS.inc(source="pipeline", reason="parse_error")
+            elif records:
+                emit_records(records)
+
+    def _check_workers(self):
+        for shard, process in enumerate(self._processes):
+            if self._closing or process.is_alive():
+                continue
+            with self._lock:
+                lost, self._inflight[shard] = self._inflight[shard], 0
+                self._generations[shard] += 1
+                metrics.PIPELINE_INFLIGHT.set(0, shard=shard)
+            print(f"⚠️ Воркер разбора {shard} завершился (код {process.exitcode}), перезапуск; "
+                  f"потеряно пачек: {lost}")
+            if lost:
+                metrics.DROPS.inc(lost, source="pipeline", reason="worker_died")
+            with self._send_locks[shard]:
+                self._spawn(shard)
+            for _ in range(lost):
+                self._slots[shard].release()
+
+    def close(self, timeout=30):
+        """Дождаться разбора всех отправленных пачек и остановить процессы."""
+        self._closing = True
+        for inbox in self._inboxes:
+            inbox.put(None)
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self._outbox.put(None)
+        if self._collector:
+            self._collector.join(timeout)
@@ -0,0 +1,306 @@
+import multiprocessing
+import os
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from utils.segments import SegmentStore
+from utils.xray_parser import record_epoch
+
+STRING_FIELDS = ("node", "email", "src_ip", "dest")
+DEFAULT_TOP = 20
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise RuntimeError("для отчётов нужен numpy (pip install numpy)") from None
+    return numpy
+
+
+class Columns:
+    """
+    Записи колонками: ts (unix, float64), коды node/email/src_ip/dest (int32,
+    -1 — поля нет) и их словари values[поле], dest_port и asn (0 — нет).
+    Каждая строка хранится в словаре один раз, группировки идут по целым кодам.
+    """
+
+    def __init__(self, ts, codes, values, dest_port, asn):
+        self.ts = ts
+        self.codes = codes
+        self.values = values
+        self.dest_port = dest_port
+        self.asn = asn
+
+    def __len__(self):
+        return len(self.ts)
+
+
+class ColumnBuilder:
+    """Накопление записей в массивы stdlib array со словарным кодированием строк на лету."""
+
+    def __init__(self):
+        self.ts = array("d")
+        self.codes = {field: array("i") for field in STRING_FIELDS}
+        self.values = {field: [] for field in STRING_FIELDS}
+        self._maps = {field: {} for field in STRING_FIELDS}
+        self.dest_port = array("i")
+        self.asn = array("q")
+
+    def add(self, record, ts):
+        for field in STRING_FIELDS:
+            value = record.get(field)
+            if value is None:
+                code = -1
+            else:
+                mapping = self._maps[field]
+                code = mapping.get(value)
+                if code is None:
+                    code = mapping[value] = len(self.values[field])
+                    self.values[field].append(value)
+            self.codes[field].append(code)
+        self.ts.append(ts)
+        self.dest_port.append(record.get("dest_port") or 0)
+        self.asn.append(record.get("asn") or 0)
+
+    def parts(self):
+        """Пиклуемое содержимое — для передачи из процесса-загрузчика."""
+        return self.ts, self.codes, self.values, self.dest_port, self.asn
+
+
+def _load_nodes(root, nodes, start, end):
+    """Записи доступа (с src_ip) нод из хранилища за [start, end] → части ColumnBuilder."""
+    builder = ColumnBuilder()
+    for record in SegmentStore(root).read_range(start, end, nodes):
+        if "src_ip" in record:
+            builder.add(record, record_epoch(record))
+    return builder.parts()
+
+
+def _merge(parts):
+    """Склеить части разных загрузчиков: словари объединяются, коды перекодируются массивно."""
+    np = _numpy()
+    values = {field: [] for field in STRING_FIELDS}
+    maps = {field: {} for field in STRING_FIELDS}
+    codes = {field: [] for field in STRING_FIELDS}
+    for ts, part_codes, part_values, dest_port, asn in parts:
+        for field in STRING_FIELDS:
+            mapping = maps[field]
+            remap = np.empty(len(part_values[field]) + 1, dtype=np.int32)
+            for i, value in enumerate(part_values[field]):
+                code = mapping.get(value)
+                if code is None:
+                    code = mapping[value] = len(values[field])
+                    values[field].append(value)
+                remap[i] = code
+            remap[-1] = -1  # код -1 берёт последний элемент — «нет значения»
+            codes[field].append(remap[np.frombuffer(part_codes[field], dtype=np.int32)])
+    return Columns(np.concatenate([np.frombuffer(p[0], dtype=np.float64) for p in parts]),
+                   {field: np.concatenate(codes[field]) for field in STRING_FIELDS}, values,
+                   np.concatenate([np.frombuffer(p[3], dtype=np.int32) for p in parts]),
+                   np.concatenate([np.frombuffer(p[4], dtype=np.int64) for p in parts]))
+
+
+def load_columns(store, start, end, nodes=None, workers=None):
+    """
+    Записи хранилища за интервал колонками. Разбор JSON — самая дорогая
+    часть, поэтому при workers > 1 ноды делятся между процессами, каждый
+    строит свои словари, а родитель сливает их. Процессы — spawn: в собранном
+    бинарнике они стартуют через multiprocessing.freeze_support() в main.py.
+    """
+    _numpy()
+    nodes = list(nodes or sorted({node for _, node, _, _ in store.segments()}))
+    workers = min(workers or 1, len(nodes))
+    store.flush()
+    if workers <= 1:
+        return _merge([_load_nodes(store.root, nodes, start, end)])
+    groups = [nodes[i::workers] for i in range(workers)]
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        parts = list(pool.map(_load_nodes, [store.root] * workers, groups, [start] * workers, [end] * workers))
+    return _merge(parts)
+
+
+# --- группировки ---
+
+def _contains(sorted_keys, keys):
+    """Маска keys, которые есть в отсортированном массиве sorted_keys."""
+    np = _numpy()
+    pos = np.searchsorted(sorted_keys, keys)
+    found = pos < len(sorted_keys)
+    found[found] = sorted_keys[pos[found]] == keys[found]
+    return found
+
+
+def _top(counts, n):
+    np = _numpy()
+    n = min(n, len(counts))
+    if not n:
+        return np.empty(0, dtype=np.int64)
+    idx = np.argpartition(-counts, n - 1)[:n]
+    return idx[np.argsort(-counts[idx], kind="stable")]
+
+
+def aggregate(columns, top=DEFAULT_TOP):
+    """
+    Сводка по колонкам: подключения пользователей по часам, число разных
+    IP (и ASN) на пользователя, топ назначений и текучесть IP. Текучесть —
+    доля пар (пользователь, час, IP), где этого IP у пользователя не было
+    в предыдущий час; считаются только часы, когда пользователь был активен
+    и в предыдущий.
+    """
+    np = _numpy()
+    emails = columns.values["email"]
+    ips = columns.values["src_ip"]
+    dests = columns.values["dest"]
+    ne, ni, nd = len(emails), max(len(ips), 1), len(dests)
+    result = {"records": len(columns), "users": ne, "ips": len(ips), "dests": nd,
+              "start": float(columns.ts.min()) if len(columns) else None,
+              "end": float(columns.ts.max()) if len(columns) else None,
+              "hours": [], "user_hours": [], "top_users": [], "top_dests": [], "churn": None}
+    if not len(columns):
+        return result
+
+    hours = (columns.ts // 3600).astype(np.int64)
+    h0 = int(hours.min())
+    nh = int(hours.max()) - h0 + 1
+    mask = columns.codes["email"] >= 0
+    email = columns.codes["email"][mask].astype(np.int64)
+    ip = columns.codes["src_ip"][mask].astype(np.int64)
+    hour = hours[mask] - h0
+
+    per_hour = np.bincount(hour, minlength=nh)
+    result["hours"] = [((h0 + h) * 3600, int(n)) for h, n in enumerate(per_hour)]
+
+    # подключения пользователя по часам: ключ email * nh + час
+    uh_keys, uh_counts = np.unique(email * nh + hour, return_counts=True)
+    uh_user = uh_keys // nh
+    result["user_hours"] = [(emails[u], (h0 + h) * 3600, int(n))
+                            for u, h, n in zip(uh_user.tolist(), (uh_keys % nh).tolist(), uh_counts.tolist())]
+    connections = np.bincount(email, minlength=ne)
+    peak = np.zeros(ne, dtype=np.int64)
+    np.maximum.at(peak, uh_user, uh_counts)
+    active_hours = np.bincount(uh_user, minlength=ne)
+
+    # разные IP на пользователя
+    distinct_ips = np.bincount(np.unique(email * ni + ip) // ni, minlength=ne)
+    asn = columns.asn[mask]
+    with_asn = asn > 0
+    distinct_asns = None
+    if with_asn.any():
+        asn_codes, asn_index = np.unique(asn[with_asn], return_inverse=True)
+        na = len(asn_codes)
+        distinct_asns = np.bincount(np.unique(email[with_asn] * na + asn_index) // na, minlength=ne)
+
+    # текучесть: тройка (пользователь, час, IP) новая, если (пользователь, час-1, IP) нет
+    triples = np.unique((email * nh + hour) * ni + ip)
+    triple_uh = triples // ni
+    has_prev = (triple_uh % nh > 0) & _contains(uh_keys, triple_uh - 1)
+    new = has_prev & ~_contains(triples, triples - ni)
+    triple_user = triple_uh // nh
+    pairs = np.bincount(triple_user[has_prev], minlength=ne)
+    new_pairs = np.bincount(triple_user[new], minlength=ne)
+    churn = np.divide(new_pairs, pairs, out=np.full(ne, np.nan), where=pairs > 0)
+    if has_prev.any():
+        result["churn"] = float(new.sum() / has_prev.sum())
+
+    for u in _top(connections, top).tolist():
+        row = {"email": emails[u], "connections": int(connections[u]), "ips": int(distinct_ips[u]),
+               "active_hours": int(active_hours[u]), "peak_hour": int(peak[u]),
+               "churn": None if np.isnan(churn[u]) else round(float(churn[u]), 3)}
+        if distinct_asns is not None:
+            row["asns"] = int(distinct_asns[u])
+        result["top_users"].append(row)
+
+    dest = columns.codes["dest"]
+    dest_mask = dest >= 0
+    dest_counts = np.bincount(dest[dest_mask], minlength=nd)
+    both = dest_mask & (columns.codes["email"] >= 0)
+    du = np.unique(dest[both].astype(np.int64) * max(ne, 1) + columns.codes["email"][both])
+    dest_users = np.bincount(du // max(ne, 1), minlength=nd)
+    result["top_dests"] = [{"dest": dests[d], "connections": int(dest_counts[d]), "users": int(dest_users[d])}
+                           for d in _top(dest_counts, top).tolist()]
+    return result
+
+
+# --- колоночный файл ---
+
+def _pack_values(np, values):
+    # строки лога не содержат \n — словарь хранится одним блоком utf-8
+    return np.frombuffer("\n".join(values).encode("utf-8"), dtype=np.uint8)
+
+
+def _unpack_values(blob):
+    text = bytes(blob).decode("utf-8")
+    return text.split("\n") if text else []
+
+
+def save_columns(columns, path):
+    """.npz (numpy, сжатый) или .parquet (pyarrow, словарные колонки)."""
+    np = _numpy()
+    if path.endswith(".parquet"):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("для .parquet нужен pyarrow (pip install pyarrow)") from None
+        data = {"ts": pa.array(columns.ts)}
+        for field in STRING_FIELDS:
+            codes = columns.codes[field]
+            data[field] = pa.DictionaryArray.from_arrays(pa.array(codes, mask=codes < 0),
+                                                         pa.array(columns.values[field], type=pa.string()))
+        data["dest_port"] = pa.array(columns.dest_port)
+        data["asn"] = pa.array(columns.asn)
+        pq.write_table(pa.table(data), path, compression="zstd")
+        return
+    arrays = {"ts": columns.ts, "dest_port": columns.dest_port, "asn": columns.asn}
+    for field in STRING_FIELDS:
+        arrays[field] = columns.codes[field]
+        arrays[field + "_values"] = _pack_values(np, columns.values[field])
+    with open(path, "wb") as f:
+        np.savez_compressed(f, **arrays)
+
+
+def load_columns_file(path):
+    np = _numpy()
+    if path.endswith(".parquet"):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("для .parquet нужен pyarrow (pip install pyarrow)") from None
+        table = pq.read_table(path)
+        codes, values = {}, {}
+        for field in STRING_FIELDS:
+            column = table.column(field).combine_chunks()
+            codes[field] = column.indices.fill_null(-1).to_numpy().astype(np.int32)
+            values[field] = column.dictionary.to_pylist()
+        return Columns(table.column("ts").to_numpy(), codes, values,
+                       table.column("dest_port").to_numpy(), table.column("asn").to_numpy())
+    with np.load(path) as data:
+        return Columns(data["ts"], {field: data[field] for field in STRING_FIELDS},
+                       {field: _unpack_values(data[field + "_values"]) for field in STRING_FIELDS},
+                       data["dest_port"], data["asn"])
+
+
+def default_workers():
+    return max(1, (os.cpu_count() or 1) - 1)
+
+
+def build_report(storage_dir=None, start=None, end=None, nodes=None, source=None, export=None,
+                 top=DEFAULT_TOP, workers=None):
+    """Загрузить колонки (из хранилища или ранее сохранённого файла), при необходимости сохранить, посчитать сводку."""
+    timings = {}
+    started = time.perf_counter()
+    if source:
+        columns = load_columns_file(source)
+    else:
+        columns = load_columns(SegmentStore(storage_dir), start, end or time.time(), nodes, workers)
+    timings["load"] = time.perf_counter() - started
+    if export:
+        started = time.perf_counter()
+        save_columns(columns, export)
+        timings["export"] = time.perf_counter() - started
+    started = time.perf_counter()
+    result = aggregate(columns, top)
+    timings["aggregate"] = time.perf_counter() - started
+    result["timings"] = {k: round(v, 3) for k, v in timings.items()}
+    return result
@@ -0,0 +1,231 @@
+import hashlib
+import math
+import shlex
+import shutil
+import threading
+import time
+from utils.fleet import run_on_nodes, collect_credentials, DEFAULT_WORKERS, DEFAULT_NODE_TIMEOUT
+from utils.nodes import REMOTE_BIN_PATH, _agent_pattern, delete_node, remove_remote_node
+from utils.rsyslog_setup import setup_remote_rsyslog, setup_ufw_central, setup_ufw_remote
+from utils.syslog_server import DEFAULT_SYSLOG_PORT
+from utils.utils import state_file, write_json_atomic
+
+OPERATIONS = ("rsyslog", "ufw", "upload", "agent", "remove")
+DEFAULT_WAVE_SIZE = 10
+DEFAULT_CANARY = 1
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def parse_budget(value, total):
+    """Бюджет ошибок: '3' — нод, '10%' — доля выбранных нод (вниз)."""
+    value = str(value).strip()
+    if value.endswith("%"):
+        return math.floor(total * float(value[:-1]) / 100)
+    return int(value)
+
+
+def plan_waves(nodes, wave_size=DEFAULT_WAVE_SIZE, canary=DEFAULT_CANARY):
+    """Первые canary нод — отдельной волной, остальные — волнами по wave_size."""
+    wave_size = max(1, wave_size)
+    waves = [nodes[:canary]] if canary > 0 and nodes else []
+    rest = nodes[max(canary, 0):]
+    waves += [rest[i:i + wave_size] for i in range(0, len(rest), wave_size)]
+    return waves
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def upload_artifact(node, local_path, remote_path, digest):
+    """
+    Загрузить файл на ноду, только если там другой sha256. Пишем во
+    временный файл рядом, сверяем его sha256 на ноде и атомарно подменяем —
+    недокачанный или битый файл никогда не оказывается на месте рабочего.
+    Возвращает (ok, что сделано).
+    """
+    q = shlex.quote
+    current = node.run(f"sha256sum {q(remote_path)} 2>/dev/null | cut -d' ' -f1", timeout=60)
+    if current.status < 0:
+        return False, current.stderr.strip() or "нет SSH соединения"
+    if current.stdout.strip() == digest:
+        return True, "уже загружен"
+    tmp_path = remote_path + ".upload"
+    try:
+        sftp = node.ssh.open_sftp()
+        try:
+            sftp.put(local_path, tmp_path)
+        finally:
+            sftp.close()
+    except Exception as e:
+        return False, f"ошибка загрузки: {e}"
+    result = node.run(
+        f'test "$(sha256sum {q(tmp_path)} | cut -d" " -f1)" = {q(digest)} '
+        f"&& chmod 755 {q(tmp_path)} && mv -f {q(tmp_path)} {q(remote_path)} "
+        f"|| {{ rm -f {q(tmp_path)}; exit 5; }}", timeout=120)
+    if result.status == 5:
+        return False, "контрольная сумма не совпала"
+    if not result.ok:
+        return False, result.stderr.strip() or f"код {result.status}"
+    return True, "загружен"
+
+
+def bulk_operation(name, central_server_ip=None, agent_port=None, artifact=None, remote_path=REMOTE_BIN_PATH,
+                   remove_node=None, ingest_port=DEFAULT_SYSLOG_PORT):
+    """
+    Функция node → (ok, подробности) для массовой операции. remove_node(node)
+    заменяет удаление, например командой запущенному демону. ingest_port —
+    порт, на который ноды шлют логи центру (конфиг rsyslog, правила ufw).
+    """
+    if name in ("rsyslog", "ufw", "agent", "remove") and not central_server_ip:
+        raise ValueError(f"для '{name}' нужен IP центрального сервера (--public-ip)")
+    if name in ("upload", "agent"):
+        if not artifact:
+            raise ValueError(f"для '{name}' нужен файл --artifact")
+        digest = file_sha256(artifact)
+
+    if name == "rsyslog":
+        # отпечаток конфига в базе нод: неизменившиеся ноды пропускаются без SSH
+        return lambda node: (setup_remote_rsyslog(node, central_server_ip, port=ingest_port), "")
+    if name == "ufw":
+        return lambda node: (setup_ufw_remote(node, central_server_ip, ingest_port), "")
+    if name == "upload":
+        return lambda node: upload_artifact(node, artifact, remote_path, digest)
+    if name == "agent":
+        def agent(node):
+            ok, detail = upload_artifact(node, artifact, remote_path, digest)
+            if not ok:
+                return False, detail
+            if detail == "загружен":
+                # агент со старым бинарником иначе остался бы работать
+                node.run(f"pkill -f {shlex.quote(_agent_pattern(remote_path))}")
+            return node.run_remote_binary(central_server_ip, agent_port, remote_path), f"бинарник {detail}"
+        return agent
+    if name == "remove":
+        def remove(node):
+            if remove_node:
+                # демон сам удаляет ноду из списка только после очистки, иначе ошибка
+                remove_node(node)
+                return True, "удалена через демон"
+            if not remove_remote_node(node, central_server_ip, ingest_port, remote_path):
+                return False, "очистка на ноде с ошибками, нода оставлена в списке"
+            delete_node(node)
+            return True, "удалена"
+        return remove
+    raise ValueError(f"нет операции '{name}', доступны: {', '.join(OPERATIONS)}")
+
+
+def _mark_late(row):
+    """Нода с неизвестным итогом (таймаут) всё-таки завершилась — записать, чем."""
+    if row["status"] == "неизвестно" and row["ok"] is not None:
+        row["late"] = "готово" if row["ok"] else "ошибка"
+
+
+def rollout(nodes, operation, wave_size=DEFAULT_WAVE_SIZE, canary=DEFAULT_CANARY, max_failures=0,
+            workers=DEFAULT_WORKERS, node_timeout=DEFAULT_NODE_TIMEOUT, console=None, title="Массовая операция"):
+    """
+    Выполнить operation(node) → (ok, подробности) волнами через run_on_nodes.
+    Сначала canary-волна: если на ней есть ошибка, дальше не идём. Потом
+    волны по wave_size; как только ошибок больше max_failures, оставшиеся
+    ноды не трогаются («пропущено»). Нода, не уложившаяся в node_timeout,
+    получает «неизвестно» и считается ошибкой для бюджета; если её операция
+    завершится до конца раскатки, итог попадёт в отчёт полем late.
+    Возвращает отчёт для show_rollout().
+    """
+    from rich.console import Console
+
+    names = [node.name for node in nodes]
+    if len(set(names)) != len(names):
+        raise ValueError("одна и та же нода указана несколько раз")
+    console = console or Console()
+    collect_credentials(nodes)
+    waves = plan_waves(nodes, wave_size, canary)
+    results = {node.name: {"host": node.host, "status": "пропущено", "wave": None, "seconds": None, "detail": "",
+                           "ok": None, "late": None}
+               for node in nodes}
+    lock = threading.Lock()
+
+    def task(node):
+        started = time.monotonic()
+        try:
+            ok, detail = operation(node)
+        except Exception as e:
+            ok, detail = False, str(e)
+        with lock:
+            row = results[node.name]
+            row.update(seconds=round(time.monotonic() - started, 2), detail=detail, ok=bool(ok))
+            _mark_late(row)
+        return bool(ok)
+
+    report = {"title": title, "started": time.time(), "nodes": len(nodes), "waves": len(waves),
+              "max_failures": max_failures, "stopped": None, "results": results}
+    failures = 0
+    for number, wave in enumerate(waves, 1):
+        is_canary = number == 1 and canary > 0
+        console.print(f"[bold cyan]Волна {number}/{len(waves)}{' (canary)' if is_canary else ''}: "
+                      f"{len(wave)} нод[/bold cyan]")
+        summary = run_on_nodes(wave, task, workers=min(workers, len(wave)), node_timeout=node_timeout,
+                               console=console, title=f"{title}: волна {number}")
+        with lock:
+            for name, status in summary.items():
+                results[name].update(status=status, wave=number)
+                _mark_late(results[name])
+        failures += sum(1 for status in summary.values() if status != "готово")
+        if is_canary and failures:
+            report["stopped"] = "ошибка на canary-нодах"
+            break
+        if failures > max_failures:
+            report["stopped"] = f"превышен бюджет ошибок ({failures} > {max_failures})"
+            break
+    report["finished"] = time.time()
+    report["failures"] = failures
+    return report
+
+
+def setup_central_ufw(nodes, port=DEFAULT_SYSLOG_PORT):
+    """Правила UFW центра для выбранных нод — один раз перед волнами."""
+    if not shutil.which("ufw"):
+        print("⚠️ ufw на центральном сервере не найден, правила центра пропущены.")
+        return False
+    setup_ufw_central([node.host for node in nodes], port)
+    return True
+
+
+def show_rollout(report, console=None):
+    from rich.console import Console
+    from rich.table import Table
+
+    console = console or Console()
+    table = Table(title=f"{report['title']}: итог")
+    table.add_column("Нода", style="green")
+    table.add_column("Хост", style="yellow")
+    table.add_column("Волна", justify="right")
+    table.add_column("Статус")
+    table.add_column("Время, с", justify="right")
+    table.add_column("Подробности")
+    styles = {"готово": "green", "пропущено": "dim"}
+    for name, row in report["results"].items():
+        style = styles.get(row["status"], "red")
+        status = f"[{style}]{row['status']}[/{style}]"
+        if row.get("late"):
+            status += f" (после таймаута: {row['late']})"
+        table.add_row(name, row["host"] or "-", str(row["wave"] or "-"), status,
+                      "" if row["seconds"] is None else f"{row['seconds']:.1f}", row["detail"] or "")
+    console.print(table)
+    done = sum(1 for row in report["results"].values() if row["status"] == "готово")
+    skipped = sum(1 for row in report["results"].values() if row["status"] == "пропущено")
+    console.print(f"[bold]Готово:[/bold] {done}/{report['nodes']}, ошибок: {report['failures']}, "
+                  f"пропущено: {skipped}, за {report['finished'] - report['started']:.1f} с")
+    if report["stopped"]:
+        console.print(f"[bold red]Остановлено: {report['stopped']}[/bold red]")
+
+
+def save_rollout(report):
+    """Отчёт в каталог состояния: rollout-ГГГГММДД-ЧЧММСС.json."""
+    path = state_file(time.strftime("rollout-%Y%m%d-%H%M%S.json", time.localtime(report["started"])))
+    write_json_atomic(path, report)
+    return path
@@ -1,6 +1,10 @@
 import subprocess
 import os
-import paramiko
+import time
+import shlex
+import hashlib
+from utils.inventory import get_inventory
+from utils.syslog_server import DEFAULT_SYSLOG_PORT
 
 def run_cmd(cmd):
     """Запуск shell команды, вывод результата."""
@@ -39,26 +43,24 @@ ruleset(name="xray-logs") {
     except Exception as e:
         print(f"❌ Ошибка при настройке центрального rsyslog: {e}")
 
-def setup_remote_rsyslog(node, central_host):
-    """Настройка rsyslog на удалённой ноде для отправки логов на центральный сервер."""
-    if not node.connect_ssh():
-        print(f"❌ Нет SSH соединения с {node.host}")
+def remove_central_rsyslog():
+    """Убрать приём imtcp из rsyslog, чтобы порт 514 занял встроенный приёмник."""
+    conf_path = "/etc/rsyslog.d/10-remote-xray.conf"
+    if not os.path.exists(conf_path):
         return
-
-    # Установка rsyslog (non-interactive)
     try:
-        cmd = "DEBIAN_FRONTEND=noninteractive apt-get update && DEBIAN_FRONTEND=noninteractive apt-get install -y rsyslog"
-        stdin, stdout, stderr = node.ssh.exec_command(cmd)
-        exit_status = stdout.channel.recv_exit_status()
-        if exit_status != 0:
-            err = stderr.read().decode().strip()
-            print(f"❌ Не удалось установить rsyslog на {node.host}: {err}")
-            # можно продолжить, если rsyslog уже установлен
+        os.remove(conf_path)
+        subprocess.run(["systemctl", "restart", "rsyslog"], check=True)
+        print(f"✅ Конфиг {conf_path} удалён, rsyslog больше не слушает 514.")
     except Exception as e:
-        print(f"❌ Ошибка при установке rsyslog на {node.host}: {e}")
+        print(f"❌ Ошибка при отключении центрального rsyslog: {e}")
+
+FINGERPRINT_TTL = 6 * 3600
 
-    # подготовка конфигурации (вставляем central_host)
-    conf_template = f"""
+
+def remote_rsyslog_conf(node, central_host, port=DEFAULT_SYSLOG_PORT):
+    """Конфиг rsyslog удалённой ноды (вставляем central_host и порт приёма)."""
+    return f"""
 module(load="imfile")
 
 input(type="imfile"
@@ -69,103 +71,173 @@ input(type="imfile"
       PersistStateInterval="200"
       PollingInterval="1")
 
-*.* @@{central_host}:514
-"""
+*.* @@{central_host}:{port}
+""".lstrip()
+
+
+def _fingerprint_key(node):
+    return f"{node.user}@{node.host}:{node.port}/{node.name}"
+
+
+def remember_fingerprint(node, conf_hash):
+    get_inventory().update_state(node.name, fingerprint=conf_hash, fingerprint_target=_fingerprint_key(node),
+                                 fingerprint_checked=time.time())
+
+
+def forget_fingerprint(node):
+    get_inventory().update_state(node.name, fingerprint=None, fingerprint_target=None, fingerprint_checked=None)
+
+
+def cached_fingerprint(node):
+    """Отпечаток из базы нод, если он снят с той же ноды (user@host:port/name)."""
+    state = get_inventory().state(node.name)
+    if not state.get("fingerprint") or state.get("fingerprint_target") != _fingerprint_key(node):
+        return None
+    return {"hash": state["fingerprint"], "checked": state["fingerprint_checked"]}
+
+
+def probe_remote_rsyslog(node, remote_path):
+    """
+    Одним SSH запросом узнать: установлен ли rsyslog, активен ли он
+    и sha256 текущего конфига. Возвращает dict или None при ошибке.
+    """
+    cmd = (
+        "if command -v rsyslogd >/dev/null 2>&1; then echo installed=1; else echo installed=0; fi; "
+        "echo active=$(systemctl is-active rsyslog 2>/dev/null); "
+        f"echo hash=$(sha256sum {shlex.quote(remote_path)} 2>/dev/null | cut -d' ' -f1)"
+    )
+    result = node.run(cmd, timeout=30)
+    if result.status < 0:
+        print(f"❌ Ошибка проверки rsyslog на {node.host}: {result.stderr}")
+        return None
+    state = dict(line.split("=", 1) for line in result.stdout.splitlines() if "=" in line)
+    return {
+        "installed": state.get("installed") == "1",
+        "active": state.get("active") == "active",
+        "hash": state.get("hash") or None,
+    }
+
+
+def setup_remote_rsyslog(node, central_host, force=False, port=DEFAULT_SYSLOG_PORT):
+    """
+    Настройка rsyslog на удалённой ноде для отправки логов на центральный сервер.
+    Идемпотентно: установка, загрузка конфига и перезапуск выполняются
+    только если на ноде что-то отличается. Известный хороший отпечаток
+    кэшируется локально на FINGERPRINT_TTL, тогда нода даже не опрашивается.
+    Порт входит в конфиг, а значит и в отпечаток: смена порта — повторная выкладка.
+    """
+    conf = remote_rsyslog_conf(node, central_host, port)
+    conf_hash = hashlib.sha256(conf.encode("utf-8")).hexdigest()
+    cached = cached_fingerprint(node)
+    if (not force and cached and cached.get("hash") == conf_hash
+            and time.time() - cached.get("checked", 0) < FINGERPRINT_TTL):
+        print(f"✅ rsyslog на {node.name} уже настроен (кэш), пропускаем.")
+        return True
+
+    if not node.connect_ssh():
+        print(f"❌ Нет SSH соединения с {node.host}")
+        return False
 
     remote_path = f"/etc/rsyslog.d/30-xray-{node.name}.conf"
-    try:
-        sftp = node.ssh.open_sftp()
-        # удалить старый конфиг, если есть
+    state = probe_remote_rsyslog(node, remote_path) or {"installed": False, "active": False, "hash": None}
+    if not force and state["installed"] and state["active"] and state["hash"] == conf_hash:
+        remember_fingerprint(node, conf_hash)
+        print(f"✅ rsyslog на {node.name} без изменений, пропускаем.")
+        return True
+
+    # Установка rsyslog (non-interactive)
+    if force or not state["installed"]:
+        cmd = "DEBIAN_FRONTEND=noninteractive apt-get update && DEBIAN_FRONTEND=noninteractive apt-get install -y rsyslog"
+        result = node.run(cmd, timeout=600)
+        if not result.ok:
+            # можно продолжить, если rsyslog уже установлен
+            print(f"❌ Не удалось установить rsyslog на {node.host}: {result.stderr.strip()}")
+
+    if force or state["hash"] != conf_hash:
         try:
-            sftp.remove(remote_path)
-        except IOError:
-            pass
-        # записать новый
-        with sftp.open(remote_path, "w") as f:
-            f.write(conf_template.lstrip())
-        sftp.close()
-    except Exception as e:
-        print(f"❌ Ошибка записи конфига на {node.host}: {e}")
-        return
+            sftp = node.ssh.open_sftp()
+            # пишем во временный файл и атомарно подменяем конфиг
+            tmp_path = remote_path + ".tmp"
+            with sftp.open(tmp_path, "w") as f:
+                f.write(conf)
+            sftp.posix_rename(tmp_path, remote_path)
+            sftp.close()
+        except Exception as e:
+            print(f"❌ Ошибка записи конфига на {node.host}: {e}")
+            return False
 
     # перезапуск rsyslog на удалённой ноде и проверка
-    try:
-        stdin, stdout, stderr = node.ssh.exec_command("systemctl restart rsyslog")
-        exit_status = stdout.channel.recv_exit_status()
-        if exit_status == 0:
-            print(f"✅ rsyslog настроен на удалённой ноде {node.name}.")
-        else:
-            err = stderr.read().decode().strip()
-            print(f"❌ Ошибка перезапуска rsyslog на {node.name}: {err}")
-    except Exception as e:
-        print(f"❌ Ошибка при перезапуске rsyslog на {node.host}: {e}")
+    result = node.run("systemctl restart rsyslog")
+    if result.ok:
+        remember_fingerprint(node, conf_hash)
+        print(f"✅ rsyslog настроен на удалённой ноде {node.name}.")
+        return True
+    print(f"❌ Ошибка перезапуска rsyslog на {node.name}: {result.stderr.strip()}")
+    return False
 
 
-def setup_ufw_central(allowed_ips: list[str]):
+def setup_ufw_central(allowed_ips: list[str], port: int = DEFAULT_SYSLOG_PORT):
     """
-    На центральном сервере разрешить вход на порт 514 (tcp и udp) только с allowed_ips.
+    На центральном сервере разрешить вход на порт приёма port (tcp и udp) только с allowed_ips.
     """
     print("⚙️ Настройка UFW на центральном сервере...")
     for ip in allowed_ips:
-        cmd_tcp = f"ufw allow from {ip} to any port 514 proto tcp"
-        cmd_udp = f"ufw allow from {ip} to any port 514 proto udp"
+        cmd_tcp = f"ufw allow from {ip} to any port {port} proto tcp"
+        cmd_udp = f"ufw allow from {ip} to any port {port} proto udp"
         print(f"-> {cmd_tcp}")
         run_cmd(cmd_tcp)
         print(f"-> {cmd_udp}")
         run_cmd(cmd_udp)
     print("✅ UFW настроен на центральном сервере.")
 
-def setup_ufw_remote(node, central_server_ip: str):
+def setup_ufw_remote(node, central_server_ip: str, port: int = DEFAULT_SYSLOG_PORT):
     """
-    На удалённой ноде разрешить исходящие подключения на порт 514 (tcp и udp) к центральному серверу.
+    На удалённой ноде разрешить исходящие подключения на порт port (tcp и udp) к центральному серверу.
     """
     print(f"⚙️ Настройка UFW на удалённой ноде {node.name}...")
     if not node.connect_ssh():
         print(f"❌ Не удалось подключиться к {node.host} для настройки UFW.")
-        return
+        return False
 
     cmds = [
-        f"ufw allow out to {central_server_ip} port 514 proto tcp",
-        f"ufw allow out to {central_server_ip} port 514 proto udp",
+        f"ufw allow out to {central_server_ip} port {port} proto tcp",
+        f"ufw allow out to {central_server_ip} port {port} proto udp",
     ]
 
-    try:
-        for cmd in cmds:
-            print(f"-> {cmd}")
-            stdin, stdout, stderr = node.ssh.exec_command(cmd)
-            exit_status = stdout.channel.recv_exit_status()
-            if exit_status != 0:
-                err = stderr.read().decode().strip()
-                print(f"❌ Ошибка команды '{cmd}': {err}")
+    # обе команды одним round-trip
+    results = node.run_many(cmds)
+    for result in results:
+        print(f"-> {result.command}")
+        if not result.ok:
+            print(f"❌ Ошибка команды '{result.command}': {result.stderr.strip()}")
+    if all(r.ok for r in results):
         print(f"✅ UFW настроен на удалённой ноде {node.name}.")
-    except Exception as e:
-        print(f"❌ Ошибка настройки UFW на {node.name}: {e}")
+        return True
+    return False
 
 def remove_rsyslog_config(node):
+    forget_fingerprint(node)
     if not node.connect_ssh():
-        return
+        return False
     conf_path = f"/etc/rsyslog.d/30-xray-{node.name}.conf"
-    try:
-        node.ssh.exec_command(f"rm -f {conf_path} && systemctl restart rsyslog")
+    result = node.run(f"rm -f {shlex.quote(conf_path)} && systemctl restart rsyslog")
+    if result.ok:
         print(f"❌ Конфиг rsyslog удалён на {node.host}")
-    except Exception as e:
-        print(f"Ошибка при удалении конфига rsyslog на {node.host}: {e}")
+    else:
+        print(f"Ошибка при удалении конфига rsyslog на {node.host}: {result.stderr.strip()}")
+    return result.ok
 
-def remove_ufw_rules(node, central_server_ip):
+def remove_ufw_rules(node, central_server_ip, port=DEFAULT_SYSLOG_PORT):
     if not node.connect_ssh():
-        return
+        return False
     cmds = [
-        f"ufw delete allow out to {central_server_ip} port 514 proto tcp",
-        f"ufw delete allow out to {central_server_ip} port 514 proto udp",
+        f"ufw delete allow out to {central_server_ip} port {port} proto tcp",
+        f"ufw delete allow out to {central_server_ip} port {port} proto udp",
     ]
-    for cmd in cmds:
-        try:
-            stdin, stdout, stderr = node.ssh.exec_command(cmd)
-            exit_status = stdout.channel.recv_exit_status()
-            if exit_status == 0:
-                print(f"Удалено правило ufw: {cmd}")
-            else:
-                err = stderr.read().decode().strip()
-                print(f"Ошибка при удалении правила ufw '{cmd}': {err}")
-        except Exception as e:
-            print(f"Ошибка при выполнении команды '{cmd}': {e}")
+    results = node.run_many(cmds)
+    for result in results:
+        if result.ok:
+            print(f"Удалено правило ufw: {result.command}")
+        else:
+            print(f"Ошибка при удалении правила ufw '{result.command}': {result.stderr.strip()}")
+    return all(r.ok for r in results)
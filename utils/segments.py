@@ -0,0 +1,494 @@
+import bisect
+import calendar
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from utils.xray_parser import record_epoch
+from utils.utils import node_file_name, node_from_file_name
+
+try:
+    import zstandard
+except ImportError:  # zstd необязателен, по умолчанию gzip
+    zstandard = None
+
+DEFAULT_STORAGE_DIR = "/var/log/xray/segments"
+DEFAULT_INDEX_EVERY = 64 * 1024
+SEAL_GRACE_HOURS = 1
+READ_CHUNK_SIZE = 256 * 1024
+
+CODEC_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+_SEGMENT_RE = re.compile(r"^(\d{10})(?:-\d+)?\.log(\.gz|\.zst)?$")
+
+
+def hour_key(ts):
+    """Ключ часового сегмента в UTC: 2024010215."""
+    return time.strftime("%Y%m%d%H", time.gmtime(ts))
+
+
+def hour_start(key):
+    """Начало часа сегмента (unix-время) по ключу 2024010215."""
+    return calendar.timegm(time.strptime(key, "%Y%m%d%H"))
+
+
+def _compressor(codec):
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress
+    return _gzip_member
+
+
+def _gzip_member(data):
+    c = zlib.compressobj(6, zlib.DEFLATED, 31)
+    return c.compress(data) + c.flush()
+
+
+def _decompressor(codec):
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompressobj()
+    return zlib.decompressobj(31)
+
+
+def _iter_decompressed(f, codec):
+    """Распаковать подряд идущие независимые блоки (gzip members / zstd frames)."""
+    d = _decompressor(codec)
+    while True:
+        chunk = f.read(READ_CHUNK_SIZE)
+        if not chunk:
+            return
+        while chunk:
+            out = d.decompress(chunk)
+            if out:
+                yield out
+            if not d.eof:
+                break
+            chunk = d.unused_data
+            d = _decompressor(codec)
+
+
+def _read_block(f, offset, codec):
+    """Распаковать один блок (gzip member / zstd frame), начинающийся с offset."""
+    f.seek(offset)
+    d = _decompressor(codec)
+    out = []
+    while not d.eof:
+        chunk = f.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        out.append(d.decompress(chunk))
+    return b"".join(out)
+
+
+def _iter_lines(chunks):
+    pending = b""
+    for chunk in chunks:
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        yield from lines
+    if pending:
+        yield pending
+
+
+class _ActiveSegment:
+    __slots__ = ("path", "segment", "f", "idx", "since_index")
+
+    def __init__(self, path, segment):
+        self.path = path
+        self.segment = segment
+        self.f = open(path, "ab")
+        self.idx = open(path + ".idx", "a", encoding="utf-8")
+        self.since_index = None if self.f.tell() == 0 else 0
+
+
+class SegmentStore:
+    """
+    Хранилище логов: <root>/<нода>/<ЧЧ UTC>.log, по сегменту на ноду и час
+    (имя каталога ноды — node_file_name: необычные символы в %XX).
+    Рядом с каждым сегментом разреженный индекс .idx (строки «ts offset»)
+    примерно каждые index_every байт. Закрытые сегменты сжимаются блоками —
+    каждый блок между соседними точками индекса отдельный gzip member/zstd
+    frame, поэтому и в сжатом файле можно сразу прыгнуть к нужному месту.
+    Опоздавшие записи уже сжатого (или сжимаемого прямо сейчас) часа
+    попадают в новый сегмент того же часа; при сжатии он получает имя
+    <час>-N.log.gz.
+
+    Слушатели (add_listener) узнают о записанных строках и их смещениях,
+    о сжатии и удалении сегментов — так строится индекс по полям. Смещения
+    всегда в несжатых байтах сегмента: в .idx сжатого сегмента третьим
+    столбцом хранится несжатое смещение начала блока.
+    """
+
+    def __init__(self, root=DEFAULT_STORAGE_DIR, codec="gzip", index_every=DEFAULT_INDEX_EVERY,
+                 max_age=None, max_bytes=None):
+        if codec == "zstd" and zstandard is None:
+            print("⚠️ Модуль zstandard не установлен, сегменты будут сжиматься gzip.")
+            codec = "gzip"
+        self.root = root
+        self.codec = codec
+        self.index_every = index_every
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._active = {}
+        self._sealing = set()
+        self._listeners = []
+        os.makedirs(root, exist_ok=True)
+
+    def add_listener(self, listener):
+        """
+        listener.segment_written(segment, [(offset, record)]), segment_sealed(old, new)
+        и segment_removed(segment); segment — путь относительно root («нода/час.log»).
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, event, *args):
+        for listener in self._listeners:
+            try:
+                getattr(listener, event)(*args)
+            except Exception as e:
+                print(f"Ошибка слушателя сегментов ({event}): {e}")
+
+    # --- запись ---
+
+    def _segment(self, node, key):
+        seg = self._active.get((node, key))
+        if seg is None:
+            dirname = node_file_name(node)
+            directory = os.path.join(self.root, dirname)
+            os.makedirs(directory, exist_ok=True)
+            name, n = f"{key}.log", 0
+            while os.path.join(directory, name) in self._sealing:
+                # этот файл сейчас сжимается — опоздавшие записи пишем рядом
+                n += 1
+                name = f"{key}-{n}.log"
+            seg = self._active[(node, key)] = _ActiveSegment(os.path.join(directory, name), f"{dirname}/{name}")
+        return seg
+
+    def add_records(self, records):
+        """Sink: раскладывает записи по сегментам нод/часов."""
+        touched = set()
+        written = {}
+        now = time.time()
+        with self._lock:
+            for record in records:
+                node = record.get("node") or "_unknown"
+                ts = record_epoch(record, -1.0)
+                # запись без времени ложится в час прихода, но точкой индекса не становится:
+                # время прихода могло бы нарушить порядок ts в .idx
+                timed = ts >= 0
+                if not timed:
+                    ts = now
+                seg = self._segment(node, hour_key(ts))
+                data = json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+                if timed and (seg.since_index is None or seg.since_index >= self.index_every):
+                    seg.idx.write(f"{ts:.3f} {seg.f.tell()}\n")
+                    seg.since_index = 0
+                if self._listeners:
+                    written.setdefault(seg.segment, []).append((seg.f.tell(), record))
+                seg.f.write(data)
+                if seg.since_index is not None:
+                    seg.since_index += len(data)
+                touched.add(seg)
+            for seg in touched:
+                seg.f.flush()
+                seg.idx.flush()
+            # под тем же замком: слушатель видит запись раньше, чем сегмент успеют сжать
+            for segment, entries in written.items():
+                self._notify("segment_written", segment, entries)
+
+    def flush(self):
+        with self._lock:
+            for seg in self._active.values():
+                seg.f.flush()
+                seg.idx.flush()
+
+    # --- закрытие сегментов и retention ---
+
+    def seal_old(self, now=None):
+        """Сжать сегменты старше текущего часа и SEAL_GRACE_HOURS."""
+        oldest_open = hour_key((now or time.time()) - SEAL_GRACE_HOURS * 3600)
+        with self._lock:
+            for (node, key), seg in list(self._active.items()):
+                if key < oldest_open:
+                    seg.f.close()
+                    seg.idx.close()
+                    del self._active[(node, key)]
+            # помечаем под замком: пока файл сжимается и удаляется, add_records
+            # не откроет его снова, а запишет опоздавшие записи в <час>-N.log
+            paths = [path for node in self._nodes() for key, path, compressed in self._segments(node)
+                     if not compressed and key < oldest_open]
+            self._sealing.update(paths)
+        for path in paths:
+            try:
+                target = self._seal(path)
+                self._notify("segment_sealed", self._relative(path), self._relative(target))
+            finally:
+                # после уведомления: иначе запись в новый <час>.log слушатель
+                # успел бы принять за запись в сжатый сегмент
+                with self._lock:
+                    self._sealing.discard(path)
+
+    def _seal(self, path):
+        entries = _load_index(path + ".idx")
+        suffix = CODEC_SUFFIXES[self.codec]
+        compress = _compressor(self.codec)
+        directory, key = os.path.dirname(path), os.path.basename(path)[:10]
+        target, n = os.path.join(directory, f"{key}.log{suffix}"), 0
+        while os.path.exists(target):
+            n += 1
+            target = os.path.join(directory, f"{key}-{n}.log{suffix}")
+        tmp_path = target + ".tmp"
+        new_entries = []
+        with open(path, "rb") as src, open(tmp_path, "wb") as dst:
+            size = os.fstat(src.fileno()).st_size
+            if not entries or entries[0][1] > 0:
+                # начало без точки индекса (записи без времени) — отдельным блоком
+                entries = [(0.0, 0)] + entries
+            bounds = [off for _, off in entries] + [size]
+            for (ts, off), end in zip(entries, bounds[1:]):
+                src.seek(off)
+                new_entries.append((ts, dst.tell(), off))
+                dst.write(compress(src.read(end - off)))
+        with open(tmp_path + ".idx", "w", encoding="utf-8") as f:
+            f.writelines(f"{ts:.3f} {off} {raw}\n" for ts, off, raw in new_entries)
+        os.replace(tmp_path + ".idx", target + ".idx")
+        os.replace(tmp_path, target)
+        os.remove(path)
+        os.remove(path + ".idx")
+        return target
+
+    def apply_retention(self, now=None):
+        """Удалить сжатые сегменты старше max_age, затем самые старые сверх max_bytes."""
+        now = now or time.time()
+        sealed = []
+        for node in self._nodes():
+            for key, path, compressed in self._segments(node):
+                if compressed:
+                    sealed.append((key, path))
+        sealed.sort()
+        removed = 0
+        if self.max_age:
+            cutoff = hour_key(now - self.max_age)
+            while sealed and sealed[0][0] < cutoff:
+                self._remove(sealed.pop(0)[1])
+                removed += 1
+        if self.max_bytes:
+            total = sum(os.path.getsize(p) for _, p in sealed)
+            while sealed and total > self.max_bytes:
+                _, path = sealed.pop(0)
+                total -= os.path.getsize(path)
+                self._remove(path)
+                removed += 1
+        return removed
+
+    def _remove(self, path):
+        _remove_segment(path)
+        self._notify("segment_removed", self._relative(path))
+
+    def maintain(self):
+        self.seal_old()
+        return self.apply_retention()
+
+    def start_maintenance(self, interval=60):
+        """Фоновый поток: раз в interval секунд сжатие старых сегментов и retention."""
+        stop = threading.Event()
+
+        def loop():
+            while not stop.wait(interval):
+                try:
+                    self.maintain()
+                except Exception as e:
+                    print(f"Ошибка обслуживания сегментов {self.root}: {e}")
+
+        threading.Thread(target=loop, name="segments-maintenance", daemon=True).start()
+        return stop
+
+    def close(self):
+        with self._lock:
+            for seg in self._active.values():
+                seg.f.close()
+                seg.idx.close()
+            self._active.clear()
+
+    # --- чтение ---
+
+    def _relative(self, path):
+        return os.path.relpath(path, self.root).replace(os.sep, "/")
+
+    def _path(self, segment):
+        return os.path.join(self.root, *segment.split("/"))
+
+    def _nodes(self):
+        """Каталоги нод (имена в виде node_file_name)."""
+        try:
+            return sorted(d for d in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, d)))
+        except FileNotFoundError:
+            return []
+
+    def _segments(self, node):
+        directory = os.path.join(self.root, node)
+        result = []
+        for name in os.listdir(directory):
+            m = _SEGMENT_RE.match(name)
+            if m:
+                result.append((m.group(1), os.path.join(directory, name), bool(m.group(2))))
+        return sorted(result)
+
+    def read_range(self, start, end, nodes=None):
+        """
+        Записи (dict) с start <= ts <= end. Открываются только сегменты
+        нужных часов, а внутри — переход по индексу к ближайшей точке до start.
+        """
+        self.flush()
+        first, last = hour_key(start), hour_key(end)
+        for dirname in [node_file_name(node) for node in nodes] if nodes else self._nodes():
+            if not os.path.isdir(os.path.join(self.root, dirname)):
+                continue
+            for key, path, compressed in self._segments(dirname):
+                if first <= key <= last:
+                    yield from _read_segment(path, compressed, start, end, hour_start(key))
+
+    def segments(self):
+        """[(сегмент, нода, час, сжат ли)] всех сегментов на диске."""
+        result = []
+        for dirname in self._nodes():
+            node = node_from_file_name(dirname)
+            for key, path, compressed in self._segments(dirname):
+                result.append((self._relative(path), node, key, compressed))
+        return result
+
+    def iter_offsets(self, segment, start=0):
+        """
+        (смещение, сырая строка) сегмента начиная с несжатого смещения start.
+        Без flush(): вызывается из потока индекса, пока add_records может держать замок.
+        """
+        path = self._path(segment)
+        offset = 0
+        with open(path, "rb") as f:
+            if path.endswith((".gz", ".zst")):
+                blocks = _load_raw_index(path + ".idx") if start else None
+                if blocks:
+                    # сразу к блоку, в который попало start
+                    i = bisect.bisect_right([raw for raw, _ in blocks], start) - 1
+                    if i > 0:
+                        offset = blocks[i][0]
+                        f.seek(blocks[i][1])
+                chunks = _iter_decompressed(f, "zstd" if path.endswith(".zst") else "gzip")
+            else:
+                f.seek(start)
+                offset = start
+                chunks = iter(lambda: f.read(READ_CHUNK_SIZE), b"")
+            for raw in _iter_lines(chunks):
+                if offset >= start and raw:
+                    yield offset, raw
+                offset += len(raw) + 1
+
+    def last_offset(self, segment):
+        """
+        Несжатое смещение последней строки сжатого сегмента — распаковывается
+        только последний блок. None для .idx старого формата.
+        """
+        path = self._path(segment)
+        blocks = _load_raw_index(path + ".idx")
+        if not blocks:
+            return None
+        start, offset = blocks[-1]
+        with open(path, "rb") as f:
+            data = _read_block(f, offset, "zstd" if path.endswith(".zst") else "gzip")
+        return start + data.rstrip(b"\n").rfind(b"\n") + 1
+
+    def read_offsets(self, segment, offsets):
+        """
+        Записи сегмента по несжатым смещениям (по возрастанию). В сжатом
+        сегменте распаковывается только блок, в который попало смещение.
+        """
+        self.flush()
+        path = self._path(segment)
+        if not path.endswith((".gz", ".zst")):
+            with open(path, "rb") as f:
+                for offset in offsets:
+                    f.seek(offset)
+                    yield json.loads(f.readline())
+            return
+        codec = "zstd" if path.endswith(".zst") else "gzip"
+        blocks = _load_raw_index(path + ".idx")
+        if blocks is None:
+            # .idx старого формата без несжатых смещений — читаем подряд
+            wanted = set(offsets)
+            for offset, raw in self.iter_offsets(segment):
+                if offset in wanted:
+                    yield json.loads(raw)
+            return
+        starts = [raw for raw, _ in blocks]
+        current, data = None, b""
+        with open(path, "rb") as f:
+            for offset in offsets:
+                i = bisect.bisect_right(starts, offset) - 1
+                if i < 0:
+                    continue
+                if i != current:
+                    current, data = i, _read_block(f, blocks[i][1], codec)
+                pos = offset - starts[i]
+                end = data.find(b"\n", pos)
+                yield json.loads(data[pos:end if end >= 0 else len(data)])
+
+
+def _load_index(idx_path):
+    entries = []
+    try:
+        with open(idx_path, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2:
+                    entries.append((float(parts[0]), int(parts[1])))
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+def _load_raw_index(idx_path):
+    """[(несжатое смещение блока, сжатое смещение)] или None для .idx без третьего столбца."""
+    blocks = []
+    try:
+        with open(idx_path, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) < 3:
+                    return None
+                blocks.append((int(parts[2]), int(parts[1])))
+    except FileNotFoundError:
+        return None
+    return blocks
+
+
+def _read_segment(path, compressed, start, end, untimed_ts):
+    """untimed_ts — время для записей без timestamp (начало часа сегмента)."""
+    entries = _load_index(path + ".idx")
+    pos = bisect.bisect_right([ts for ts, _ in entries], start) - 1
+    offset = entries[pos][1] if pos >= 0 else 0
+    codec = "zstd" if path.endswith(".zst") else "gzip"
+    with open(path, "rb") as f:
+        f.seek(offset)
+        if compressed:
+            lines = _iter_lines(_iter_decompressed(f, codec))
+        else:
+            lines = _iter_lines(iter(lambda: f.read(READ_CHUNK_SIZE), b""))
+        for raw in lines:
+            if not raw:
+                continue
+            record = json.loads(raw)
+            ts = record_epoch(record, untimed_ts)
+            if ts > end + 1:
+                # записи внутри сегмента идут почти по порядку — дальше только позже
+                return
+            if start <= ts <= end:
+                yield record
+
+
+def _remove_segment(path):
+    for p in (path, path + ".idx"):
+        try:
+            os.remove(p)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,64 @@
+from utils.xray_parser import parse_xray_line
+
+# Общие обработчики разобранных записей: индексы, метрики и т.п. подписываются
+# сюда, а сборщики (follower, syslog приёмник) отдают им пачки записей.
+_record_sinks = []
+# Обогатители дописывают поля в записи до того, как их увидят sinks и JSON
+# (например, страна и ASN источника).
+_record_enrichers = []
+
+
+def register_record_sink(sink):
+    """sink(records) вызывается с каждой пачкой разобранных записей."""
+    if sink not in _record_sinks:
+        _record_sinks.append(sink)
+
+
+def unregister_record_sink(sink):
+    if sink in _record_sinks:
+        _record_sinks.remove(sink)
+
+
+def register_record_enricher(enricher):
+    """enricher(records) дописывает поля в записи на месте; повторный вызов не должен ничего менять."""
+    if enricher not in _record_enrichers:
+        _record_enrichers.append(enricher)
+
+
+def unregister_record_enricher(enricher):
+    if enricher in _record_enrichers:
+        _record_enrichers.remove(enricher)
+
+
+def enrich_records(records):
+    for enricher in list(_record_enrichers):
+        try:
+            enricher(records)
+        except Exception as e:
+            print(f"Ошибка обогащения записей {getattr(enricher, '__name__', enricher)}: {e}")
+
+
+def has_record_sinks():
+    return bool(_record_sinks)
+
+
+def emit_records(records):
+    enrich_records(records)
+    for sink in list(_record_sinks):
+        try:
+            sink(records)
+        except Exception as e:
+            print(f"Ошибка обработчика записей {getattr(sink, '__name__', sink)}: {e}")
+
+
+def emit_syslog_lines(batch):
+    """Обработчик для NodeWriters: {нода: [сырые строки]} → разобранные записи."""
+    if not _record_sinks:
+        return
+    records = []
+    for node, lines in batch.items():
+        for line in lines:
+            record = parse_xray_line(line.decode("utf-8", errors="replace"))
+            record.setdefault("node", node)
+            records.append(record)
+    emit_records(records)
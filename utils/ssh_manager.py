@@ -0,0 +1,205 @@
+import random
+import shlex
+import threading
+import time
+import uuid
+from utils import metrics
+
+DEFAULT_KEEPALIVE = 30
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_COMMAND_TIMEOUT = 120
+DEFAULT_RETRIES = 3
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+
+
+class CommandResult:
+    __slots__ = ("command", "status", "stdout", "stderr", "seconds")
+
+    def __init__(self, command, status, stdout, stderr, seconds):
+        self.command = command
+        self.status = status
+        self.stdout = stdout
+        self.stderr = stderr
+        self.seconds = seconds
+
+    @property
+    def ok(self):
+        return self.status == 0
+
+
+class SSHConnection:
+    """
+    Долгоживущее SSH соединение с нодой: keepalive на транспорте, проверка
+    живости перед использованием, переподключение с экспоненциальной
+    задержкой и счётчики задержек подключения и команд.
+    """
+
+    def __init__(self, host, port=22, user=None, auth_method=None, key_path=None, password=None,
+                 keepalive=DEFAULT_KEEPALIVE, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 retries=DEFAULT_RETRIES):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.auth_method = auth_method
+        self.key_path = key_path
+        self.password = password
+        self.keepalive = keepalive
+        self.connect_timeout = connect_timeout
+        self.retries = retries
+        self.client = None
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.reconnects = 0
+        self.failures = 0
+        self.last_connect_ms = None
+        self.commands = 0
+        self.command_ms_total = 0.0
+        self.command_ms_max = 0.0
+        self.last_error = None
+
+    def is_alive(self):
+        transport = self.client.get_transport() if self.client else None
+        if transport is None or not transport.is_active():
+            return False
+        try:
+            transport.send_ignore()
+        except Exception:
+            return False
+        return True
+
+    def _connect_once(self):
+        import paramiko  # тяжёлый импорт — только когда нужна удалённая нода
+
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        kwargs = {"port": self.port, "username": self.user, "timeout": self.connect_timeout,
+                  "banner_timeout": self.connect_timeout, "auth_timeout": self.connect_timeout}
+        if self.auth_method == "key":
+            kwargs["key_filename"] = self.key_path
+        else:
+            kwargs["password"] = self.password
+        start = time.perf_counter()
+        client.connect(self.host, **kwargs)
+        self.last_connect_ms = (time.perf_counter() - start) * 1000
+        metrics.SSH_LATENCY.observe(self.last_connect_ms / 1000, host=self.host, op="connect")
+        client.get_transport().set_keepalive(self.keepalive)
+        return client
+
+    def ensure(self):
+        """Вернуть True, если соединение живо, иначе переподключиться с backoff."""
+        with self._lock:
+            if self.is_alive():
+                return True
+            had_client = self.client is not None
+            self.close()
+            delay = BACKOFF_BASE
+            for attempt in range(self.retries):
+                try:
+                    self.client = self._connect_once()
+                    self.connects += 1
+                    if had_client:
+                        self.reconnects += 1
+                    self.last_error = None
+                    return True
+                except Exception as e:
+                    self.failures += 1
+                    self.last_error = str(e)
+                    metrics.SSH_FAILURES.inc(host=self.host)
+                    if _is_auth_error(e) or attempt == self.retries - 1:
+                        break
+                    time.sleep(delay + random.uniform(0, delay / 2))
+                    delay = min(delay * 2, BACKOFF_MAX)
+            print(f"❌ Ошибка подключения к {self.host}: {self.last_error}")
+            return False
+
+    def _record(self, seconds):
+        ms = seconds * 1000
+        self.commands += 1
+        self.command_ms_total += ms
+        if ms > self.command_ms_max:
+            self.command_ms_max = ms
+        metrics.SSH_LATENCY.observe(seconds, host=self.host, op="command")
+
+    def run(self, command, timeout=DEFAULT_COMMAND_TIMEOUT):
+        """Выполнить команду и дождаться её завершения."""
+        if not self.ensure():
+            return CommandResult(command, -1, "", self.last_error or "нет соединения", 0.0)
+        start = time.perf_counter()
+        try:
+            stdin, stdout, stderr = self.client.exec_command(command, timeout=timeout)
+            out = stdout.read().decode(errors="replace")
+            err = stderr.read().decode(errors="replace")
+            status = stdout.channel.recv_exit_status()
+        except Exception as e:
+            out, err, status = "", str(e), -1
+        seconds = time.perf_counter() - start
+        self._record(seconds)
+        return CommandResult(command, status, out, err, seconds)
+
+    def run_many(self, commands, timeout=DEFAULT_COMMAND_TIMEOUT):
+        """
+        Несколько команд за один канал/round-trip. Каждая команда выполняется
+        независимо (ошибка одной не останавливает остальные), её вывод и код
+        возврата отделяются маркерами.
+        """
+        if not commands:
+            return []
+        marker = f"__ddlog_{uuid.uuid4().hex}"
+        script = "; ".join(
+            f"( {cmd} ); rc=$?; printf '\\n{marker}:{i}:%s\\n' $rc; printf '\\n{marker}:{i}:%s\\n' $rc >&2"
+            for i, cmd in enumerate(commands)
+        )
+        batch = self.run(f"sh -c {shlex.quote(script)}", timeout=timeout)
+        outs = _split_marked(batch.stdout, marker, len(commands))
+        errs = _split_marked(batch.stderr, marker, len(commands))
+        results = []
+        for i, cmd in enumerate(commands):
+            out, status = outs[i]
+            err, _ = errs[i]
+            if status is None:
+                status, err = -1, err or batch.stderr
+            results.append(CommandResult(cmd, status, out, err, batch.seconds))
+        return results
+
+    def stats(self):
+        return {
+            "host": self.host,
+            "alive": self.client is not None and self.client.get_transport() is not None
+            and self.client.get_transport().is_active(),
+            "connects": self.connects,
+            "reconnects": self.reconnects,
+            "failures": self.failures,
+            "connect_ms": round(self.last_connect_ms, 1) if self.last_connect_ms is not None else None,
+            "commands": self.commands,
+            "command_avg_ms": round(self.command_ms_total / self.commands, 1) if self.commands else None,
+            "command_max_ms": round(self.command_ms_max, 1),
+            "last_error": self.last_error,
+        }
+
+    def close(self):
+        if self.client:
+            try:
+                self.client.close()
+            except Exception:
+                pass
+            self.client = None
+
+
+def _split_marked(text, marker, count):
+    """Разрезать вывод run_many по маркерам → [(вывод, код или None)]."""
+    result = [("", None)] * count
+    chunk = []
+    for line in text.splitlines(keepends=True):
+        if line.startswith(marker + ":"):
+            _, idx, rc = line.strip().split(":")
+            result[int(idx)] = ("".join(chunk).strip(), int(rc))
+            chunk = []
+        else:
+            chunk.append(line)
+    return result
+
+
+def _is_auth_error(exc):
+    return type(exc).__name__ in ("AuthenticationException", "BadAuthenticationType",
+                                  "PasswordRequiredException")
@@ -0,0 +1,322 @@
+import asyncio
+import os
+import re
+import threading
+import time
+from utils import metrics
+from utils.utils import node_file_name
+
+DEFAULT_SYSLOG_PORT = 514
+DEFAULT_OUTPUT_DIR = "/var/log/xray"
+DEFAULT_FLUSH_INTERVAL = 0.5
+DEFAULT_FLUSH_BYTES = 1024 * 1024
+MAX_FRAME_SIZE = 256 * 1024
+
+# <PRI>... тег xray-node-<name>: в RFC 3164 или APP-NAME в RFC 5424
+_TAG_RE = re.compile(rb"xray-node-([^\s:\[]+)")
+
+
+def split_frames(buf):
+    """
+    Разрезать буфер на syslog кадры (RFC 6587): octet-counting «LEN SP MSG»
+    и non-transparent framing по LF. Возвращает (кадры, остаток буфера).
+    """
+    frames = []
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        first = buf[pos]
+        if 0x31 <= first <= 0x39:  # octet-counting начинается с ненулевой цифры
+            sp = buf.find(b" ", pos, pos + 8)
+            if sp == -1:
+                if end - pos < 8:
+                    break
+            elif buf[pos:sp].isdigit():
+                length = int(buf[pos:sp])
+                if length > MAX_FRAME_SIZE:
+                    raise ValueError(f"слишком большой кадр: {length}")
+                if sp + 1 + length > end:
+                    break
+                frames.append(buf[sp + 1:sp + 1 + length].rstrip(b"\n"))
+                pos = sp + 1 + length
+                continue
+        nl = buf.find(b"\n", pos)
+        if nl == -1:
+            if end - pos > MAX_FRAME_SIZE:
+                raise ValueError("слишком длинная строка без LF")
+            break
+        if nl > pos:
+            frames.append(buf[pos:nl].rstrip(b"\r"))
+        pos = nl + 1
+    return frames, buf[pos:]
+
+
+def node_from_frame(frame):
+    m = _TAG_RE.search(frame, 0, 256)
+    return m.group(1).decode("utf-8", errors="replace") if m else "_unknown"
+
+
+class NodeWriters:
+    """
+    Буферизованные писатели по нодам: строки копятся в памяти и сбрасываются
+    одной записью на ноду раз в flush_interval или при достижении flush_bytes.
+    sinks получают {нода: [строки]} после каждого сброса.
+    source — метка в метриках (syslog, agent).
+    """
+
+    def __init__(self, output_dir=DEFAULT_OUTPUT_DIR, flush_bytes=DEFAULT_FLUSH_BYTES, sinks=None,
+                 source="syslog"):
+        self.output_dir = output_dir
+        self.source = source
+        self.flush_bytes = flush_bytes
+        self.sinks = list(sinks or [])
+        self._buffers = {}
+        self._sizes = {}
+        self._files = {}
+        self.lines = 0
+        self.bytes = 0
+        os.makedirs(output_dir, exist_ok=True)
+
+    def add(self, node, line):
+        buf = self._buffers.get(node)
+        if buf is None:
+            buf = self._buffers[node] = []
+            self._sizes[node] = 0
+        buf.append(line)
+        self._sizes[node] += len(line) + 1
+        self.lines += 1
+        self.bytes += len(line) + 1
+        if self._sizes[node] >= self.flush_bytes:
+            self.flush_node(node)
+
+    def _file(self, node):
+        f = self._files.get(node)
+        if f is None:
+            f = self._files[node] = open(os.path.join(self.output_dir, f"{node_file_name(node)}.log"), "ab")
+        return f
+
+    def flush_node(self, node):
+        lines = self._buffers.get(node)
+        if not lines:
+            return
+        size = self._sizes[node]
+        self._buffers[node] = []
+        self._sizes[node] = 0
+        f = self._file(node)
+        start = time.perf_counter()
+        f.write(b"\n".join(lines) + b"\n")
+        f.flush()
+        metrics.WRITE.observe(time.perf_counter() - start, target=self.source)
+        metrics.observe_batch(node, self.source, len(lines), size, last_line=lines[-1])
+        for sink in self.sinks:
+            try:
+                sink({node: lines})
+            except Exception as e:
+                print(f"Ошибка обработчика логов ноды {node}: {e}")
+
+    def flush(self):
+        for node in list(self._buffers):
+            self.flush_node(node)
+
+    def close(self):
+        self.flush()
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+
+
+class SyslogProtocol(asyncio.Protocol):
+    def __init__(self, server):
+        self.server = server
+        self.buf = b""
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.connections += 1
+
+    def connection_lost(self, exc):
+        self.server.connections -= 1
+
+    def data_received(self, data):
+        try:
+            frames, self.buf = split_frames(self.buf + data if self.buf else data)
+        except ValueError as e:
+            self.server.errors += 1
+            metrics.DROPS.inc(source="syslog", reason="bad_frame")
+            print(f"⚠️ Ошибка кадра syslog от {self.transport.get_extra_info('peername')}: {e}")
+            self.transport.close()
+            return
+        writers = self.server.writers
+        for frame in frames:
+            writers.add(node_from_frame(frame), frame)
+
+
+class ThreadedServerMixin:
+    """start_in_thread/shutdown для asyncio серверов с методами start()/stop()."""
+
+    _loop = None
+    _thread = None
+    thread_name = "asyncio-server"
+
+    def describe(self):
+        return f"{self.host}:{self.port}"
+
+    def start_in_thread(self):
+        """Запустить приёмник в отдельном потоке со своим event loop."""
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+        error = []
+
+        def runner():
+            asyncio.set_event_loop(self._loop)
+            try:
+                self._loop.run_until_complete(self.start())
+            except Exception as e:
+                error.append(e)
+                started.set()
+                return
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=runner, name=self.thread_name, daemon=True)
+        self._thread.start()
+        started.wait()
+        if error:
+            raise error[0]
+        print(f"✅ {self.describe()}")
+        return self._thread
+
+    def is_alive(self):
+        return bool(self._thread and self._thread.is_alive())
+
+    def shutdown(self, timeout=5):
+        """Остановить приёмник, запущенный через start_in_thread, со сбросом буферов."""
+        if self._loop is None or not self._loop.is_running():
+            return
+        asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result(timeout)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
+
+
+class SyslogServer(ThreadedServerMixin):
+    """
+    Встроенный asyncio приёмник syslog по TCP вместо imtcp rsyslog.
+    Пишет каждую ноду в свой файл <output_dir>/<name>.log.
+    """
+
+    def __init__(self, host="0.0.0.0", port=DEFAULT_SYSLOG_PORT, output_dir=DEFAULT_OUTPUT_DIR,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, sinks=None):
+        self.host = host
+        self.port = port
+        self.flush_interval = flush_interval
+        self.writers = NodeWriters(output_dir, sinks=sinks)
+        self.connections = 0
+        self.errors = 0
+        self._server = None
+        self._flusher = None
+
+    thread_name = "syslog-server"
+
+    def describe(self):
+        return f"Syslog приёмник слушает {self.host}:{self.port} → {self.writers.output_dir}"
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self._server = await loop.create_server(
+            lambda: SyslogProtocol(self), self.host, self.port, backlog=4096, reuse_address=True,
+        )
+        self._flusher = asyncio.create_task(self._flush_loop())
+        return self._server
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.writers.flush()
+
+    async def stop(self):
+        if self._flusher:
+            self._flusher.cancel()
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        self.writers.close()
+
+    async def serve_forever(self):
+        await self.start()
+        print(f"✅ {self.describe()}")
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+
+def run_syslog_server(host="0.0.0.0", port=DEFAULT_SYSLOG_PORT, output_dir=DEFAULT_OUTPUT_DIR, sinks=None):
+    """Блокирующий запуск приёмника (для отдельного потока или процесса)."""
+    server = SyslogServer(host, port, output_dir, sinks=sinks)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    return server
+
+
+async def generate_load(host, port, nodes=10, connections=100, lines=100000, octet_counting=True):
+    """
+    Нагрузочный генератор: connections TCP соединений шлют всего lines строк
+    в формате rsyslog-отправителя xray-node-<name>. Возвращает строк/с отправки.
+    """
+    per_conn = max(1, lines // connections)
+
+    async def sender(i):
+        _, writer = await asyncio.open_connection(host, port)
+        tag = f"xray-node-bench{i % nodes}"
+        out = []
+        for n in range(per_conn):
+            msg = (f"<190>Jan  2 15:04:05 bench {tag}: 2024/01/02 15:04:05.{n:06d} "
+                   f"from 10.0.{i % 256}.{n % 256}:{40000 + n % 20000} accepted tcp:example.com:443 "
+                   f"[VLESS_TCP >> DIRECT] email: user{n % 500}").encode()
+            out.append(b"%d %s" % (len(msg), msg) if octet_counting else msg + b"\n")
+            if len(out) >= 512:
+                writer.write(b"".join(out))
+                out = []
+                await writer.drain()
+        writer.write(b"".join(out))
+        await writer.drain()
+        writer.close()
+        await writer.wait_closed()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(sender(i) for i in range(connections)))
+    elapsed = time.perf_counter() - start
+    return per_conn * connections / elapsed if elapsed else 0.0
+
+
+def benchmark_syslog_server(output_dir, nodes=10, connections=100, lines=200000, port=0):
+    """
+    Локальный замер встроенного приёмника: поднимает сервер на свободном порту,
+    прогоняет generate_load и ждёт, пока все строки будут записаны на диск.
+    Для сравнения с rsyslog тот же generate_load можно натравить на :514.
+    """
+    async def run():
+        server = SyslogServer("127.0.0.1", port, output_dir, flush_interval=0.2)
+        srv = await server.start()
+        real_port = srv.sockets[0].getsockname()[1]
+        start = time.perf_counter()
+        send_rate = await generate_load("127.0.0.1", real_port, nodes, connections, lines)
+        expected = max(1, lines // connections) * connections
+        while server.writers.lines < expected:
+            await asyncio.sleep(0.01)
+        server.writers.flush()
+        elapsed = time.perf_counter() - start
+        await server.stop()
+        return {
+            "lines": server.writers.lines,
+            "bytes": server.writers.bytes,
+            "seconds": round(elapsed, 3),
+            "send_lines_per_s": round(send_rate),
+            "ingest_lines_per_s": round(server.writers.lines / elapsed),
+            "errors": server.errors,
+        }
+
+    return asyncio.run(run())
@@ -1,43 +1,222 @@
 import socket
 import os
 import json
-import requests
+import time
+import ipaddress
+from datetime import datetime
+from urllib.parse import quote, unquote
+from utils.xray_parser import parse_xray_line
+from utils.sinks import enrich_records
 
-def get_public_ip():
+STATE_DIR = os.environ.get("DDLOG_STATE_DIR", "/var/lib/ddlog-xray-forwarding")
+
+_DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_duration(value):
+    """'90s', '10m', '1h', '2d' или число секунд → секунды."""
+    value = str(value).strip().lower()
+    if value and value[-1] in _DURATION_UNITS:
+        return float(value[:-1]) * _DURATION_UNITS[value[-1]]
+    return float(value)
+
+
+_SIZE_UNITS = {"k": 1024, "m": 1024 ** 2, "g": 1024 ** 3, "t": 1024 ** 4}
+
+
+def parse_size(value):
+    """'500M', '50G' или число байт → байты."""
+    value = str(value).strip().lower().rstrip("b")
+    if value and value[-1] in _SIZE_UNITS:
+        return int(float(value[:-1]) * _SIZE_UNITS[value[-1]])
+    return int(value)
+
+
+def parse_time_arg(value, now=None):
+    """Момент времени: ISO ('2024-01-02T15:00') или «сколько назад» ('6h')."""
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return (now or time.time()) - parse_duration(value)
+
+
+def state_file(name):
+    """Путь к файлу состояния в STATE_DIR (каталог создаётся при необходимости)."""
+    os.makedirs(STATE_DIR, exist_ok=True)
+    return os.path.join(STATE_DIR, name)
+
+
+def node_file_name(node):
+    """
+    Имя ноды → имя файла/каталога: всё кроме [A-Za-z0-9_.~-] в %XX, обратимо
+    (node_from_file_name), так что разные ноды не сливаются в один файл.
+    """
+    name = quote(node or "_unknown", safe="")
+    if name in (".", ".."):
+        name = name.replace(".", "%2E")
+    return name
+
+
+def node_from_file_name(name):
+    return unquote(name)
+
+
+PUBLIC_IP_TTL = 24 * 3600
+PUBLIC_IP_TIMEOUT = 3
+PUBLIC_IP_URL = "https://api.ipify.org"
+
+
+def _local_public_ip():
+    """Публичный адрес на локальном интерфейсе (маршрут по умолчанию), без сети."""
     try:
-        response = requests.get('https://api.ipify.org')
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect(("192.0.2.1", 9))  # UDP connect пакетов не шлёт
+            ip = s.getsockname()[0]
+        return ip if ipaddress.ip_address(ip).is_global else None
+    except OSError:
+        return None
+
+
+def get_public_ip(override=None, ttl=PUBLIC_IP_TTL, timeout=PUBLIC_IP_TIMEOUT):
+    """
+    Публичный IP центрального сервера. Порядок: override / DDLOG_PUBLIC_IP,
+    адрес локального интерфейса, кэш на диске (ttl), затем api.ipify.org
+    с таймаутом. Если ничего не вышло — None (а не 127.0.0.1).
+    """
+    ip = override or os.environ.get("DDLOG_PUBLIC_IP")
+    if ip:
+        return ip
+    ip = _local_public_ip()
+    if ip:
+        return ip
+
+    try:
+        cache_path = state_file("public_ip.json")
+    except OSError:
+        cache_path = None
+    cached = read_json(cache_path) if cache_path else None
+    if cached and time.time() - cached.get("checked", 0) < ttl:
+        return cached["ip"]
+
+    try:
+        import requests  # импортируем только если реально идём в сеть
+
+        response = requests.get(PUBLIC_IP_URL, timeout=timeout)
         response.raise_for_status()
-        return response.text.strip()
+        ip = response.text.strip()
+        ipaddress.ip_address(ip)
     except Exception as e:
         print(f"Ошибка получения публичного IP: {e}")
-        return "127.0.0.1"
+        if cached:
+            print(f"Используем последний известный IP: {cached['ip']}")
+            return cached["ip"]
+        return None
+    if cache_path:
+        write_json_atomic(cache_path, {"ip": ip, "checked": time.time()})
+    return ip
+
+
+CONVERT_CHUNK_SIZE = 1024 * 1024
+CONVERT_BATCH_LINES = 10000
+
+
+def offset_state_path(json_path):
+    return f"{json_path}.offset"
+
 
-def convert_old_xray_log_to_json(log_path, json_path):
+def read_json(path):
+    """Прочитать JSON файл или None, если его нет или он битый."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def load_offset_state(state_path):
+    """Прочитать сохранённое состояние (inode + смещения) или None."""
+    return read_json(state_path)
+
+
+def write_json_atomic(path, data):
+    """Атомарно записать JSON через временный файл."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def save_offset_state(state_path, state):
+    write_json_atomic(state_path, state)
+
+
+def convert_old_xray_log_to_json(log_path, json_path, start_offset=None,
+                                 chunk_size=CONVERT_CHUNK_SIZE, batch_lines=CONVERT_BATCH_LINES):
     """
-    Конвертировать старый формат xray.out.log в JSON-формат с сохранением.
+    Потоково конвертировать xray.out.log в JSON lines (одна запись на строку).
+    Читает лог кусками по chunk_size, пишет пачками по batch_lines и после каждой
+    пачки сохраняет смещение в <json_path>.offset — прерванная конвертация
+    продолжается с того же места. start_offset позволяет явно задать байт начала.
     """
     if not os.path.exists(log_path):
         print(f"Файл лога {log_path} не найден.")
         return False
 
-    if os.path.exists(json_path):
+    state_path = offset_state_path(json_path)
+    state = load_offset_state(state_path)
+    if os.path.exists(json_path) and state is None and start_offset is None:
         print(f"JSON файл уже существует: {json_path}")
         return True
 
     try:
-        with open(log_path, "r", encoding="utf-8") as f:
-            lines = f.readlines()
+        with open(log_path, "rb") as src:
+            st = os.fstat(src.fileno())
+            offset, json_offset = 0, 0
+            if start_offset is not None:
+                offset = start_offset
+                json_offset = os.path.getsize(json_path) if os.path.exists(json_path) else 0
+            elif state and state.get("inode") == st.st_ino and state.get("offset", 0) <= st.st_size:
+                offset = state["offset"]
+                json_offset = state.get("json_offset", 0)
 
-        entries = []
-        for line in lines:
-            entries.append({"timestamp": None, "message": line.strip()})
+            if offset == st.st_size and os.path.exists(json_path):
+                print(f"JSON файл уже актуален: {json_path}")
+                return True
 
-        with open(json_path, "w", encoding="utf-8") as f:
-            for entry in entries:
-                json.dump(entry, f, ensure_ascii=False)
-                f.write("\n")
+            with open(json_path, "r+b" if os.path.exists(json_path) else "w+b") as dst:
+                # отбрасываем хвост, записанный после последнего сохранённого смещения
+                dst.truncate(json_offset)
+                dst.seek(json_offset)
+                src.seek(offset)
+                pending = b""
+                batch = []
+                while True:
+                    chunk = src.read(chunk_size)
+                    if not chunk:
+                        break
+                    lines = (pending + chunk).split(b"\n")
+                    pending = lines.pop()
+                    for raw in lines:
+                        offset += len(raw) + 1
+                        entry = parse_xray_line(raw.decode("utf-8", errors="replace"))
+                        enrich_records((entry,))
+                        batch.append(json.dumps(entry, ensure_ascii=False))
+                        if len(batch) >= batch_lines:
+                            json_offset = _write_batch(dst, batch, state_path, st.st_ino, offset)
+                            batch = []
+                # незавершённая последняя строка остаётся для tail/follower
+                json_offset = _write_batch(dst, batch, state_path, st.st_ino, offset)
         print(f"Конвертация выполнена: {json_path}")
         return True
     except Exception as e:
         print(f"Ошибка конвертации лога: {e}")
         return False
+
+
+def _write_batch(dst, batch, state_path, inode, offset):
+    if batch:
+        dst.write(("\n".join(batch) + "\n").encode("utf-8"))
+        dst.flush()
+    json_offset = dst.tell()
+    save_offset_state(state_path, {"inode": inode, "offset": offset, "json_offset": json_offset})
+    return json_offset
@@ -0,0 +1,168 @@
+import os
+import queue
+import re
+import shlex
+import signal
+import subprocess
+import threading
+import time
+from utils.follower import XRAY_LOG_PATH
+
+DEFAULT_TAIL_LINES = 100
+RENDER_INTERVAL = 0.2
+RECV_SIZE = 64 * 1024
+NODE_COLORS = ("cyan", "green", "yellow", "magenta", "blue", "red", "bright_cyan", "bright_green")
+
+_ERE_SPECIAL = re.compile(r"([.\[\]()*+?{}|^$\\])")
+
+
+def _ere_escape(value):
+    return _ERE_SPECIAL.sub(r"\\\1", value)
+
+
+def build_tail_command(path=XRAY_LOG_PATH, lines=DEFAULT_TAIL_LINES, since=None,
+                       email=None, ip=None, regex=None):
+    """
+    Shell-команда для ноды: tail с последних lines строк (или с момента since),
+    а фильтры выполняются там же через grep, чтобы по сети шли только совпадения.
+    since — unix-время; сравнивается с префиксом «YYYY/MM/DD HH:MM:SS» строк xray.
+    История до текущего размера файла проходит через awk один раз, дальше
+    tail отдаёт только новые байты — без пропусков на стыке и без awk на всё
+    время просмотра.
+    """
+    q = shlex.quote
+    if since is not None:
+        stamp = time.strftime("%Y/%m/%d %H:%M:%S", time.localtime(since))
+        parts = [
+            f"{{ size=$(stat -c %s {q(path)} 2>/dev/null || echo 0); "
+            f"head -c \"$size\" {q(path)} | awk -v s={q(stamp)} 'f || substr($0, 1, 19) >= s {{ f = 1; print }}'; "
+            f"tail -c +$((size + 1)) -F {q(path)}; }} 2>/dev/null",
+        ]
+    else:
+        parts = [f"tail -n {int(lines)} -F {q(path)} 2>/dev/null"]
+    patterns = []
+    if email:
+        patterns.append("email: " + _ere_escape(email) + "( |$)")
+    if ip:
+        patterns.append(r"from (tcp:|udp:)?\[?" + _ere_escape(ip) + r"\]?:")
+    if regex:
+        patterns.append(regex)
+    parts.extend(f"grep --line-buffered -E {q(p)}" for p in patterns)
+    return " | ".join(parts)
+
+
+class _Source:
+    """Поток байт с одной ноды: SSH канал или локальный процесс."""
+
+    def __init__(self, node, command):
+        self.node = node
+        self.proc = None
+        self.chan = None
+        if node.local:
+            self.proc = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE,
+                                         stderr=subprocess.DEVNULL, start_new_session=True)
+        else:
+            self.chan = node.ssh.get_transport().open_session()
+            try:
+                # с pty sshd при закрытии канала шлёт SIGHUP tail и grep, иначе они остаются жить на ноде
+                self.chan.get_pty()
+            except Exception:
+                self.chan.close()
+                self.chan = node.ssh.get_transport().open_session()
+            self.chan.exec_command(command)
+
+    def read(self):
+        if self.proc:
+            return os.read(self.proc.stdout.fileno(), RECV_SIZE)
+        return self.chan.recv(RECV_SIZE)
+
+    def close(self):
+        if self.proc:
+            # tail и grep в конвейере — гасим всю группу процессов
+            try:
+                os.killpg(self.proc.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        if self.chan:
+            self.chan.close()
+
+
+def _reader(source, out, stop):
+    pending = b""
+    try:
+        while not stop.is_set():
+            data = source.read()
+            if not data:
+                break
+            lines = (pending + data).split(b"\n")
+            pending = lines.pop()
+            if lines:
+                # pty превращает \n в \r\n
+                out.put((source.node.name, [line.rstrip(b"\r") for line in lines]))
+    except Exception as e:
+        if not stop.is_set():
+            out.put((source.node.name, [f"[ошибка чтения: {e}]".encode()]))
+    out.put((source.node.name, None))
+
+
+def follow_nodes(nodes, console=None, lines=DEFAULT_TAIL_LINES, since=None,
+                 email=None, ip=None, regex=None, path=XRAY_LOG_PATH):
+    """
+    Живой просмотр одной или нескольких нод в одном потоке вывода.
+    Строки копятся и выводятся пачкой раз в RENDER_INTERVAL, у каждой ноды свой цвет.
+    """
+    from rich.console import Console
+    from rich.text import Text
+
+    console = console or Console()
+    command = build_tail_command(path, lines, since, email, ip, regex)
+    out = queue.Queue()
+    stop = threading.Event()
+    sources = []
+    for node in nodes:
+        if not node.local and not node.connect_ssh():
+            continue
+        try:
+            source = _Source(node, command)
+        except Exception as e:
+            console.print(f"[red]Не удалось запустить просмотр на {node.name}: {e}[/red]")
+            continue
+        sources.append(source)
+        threading.Thread(target=_reader, args=(source, out, stop), daemon=True).start()
+    if not sources:
+        return
+
+    colors = {s.node.name: NODE_COLORS[i % len(NODE_COLORS)] for i, s in enumerate(sources)}
+    multi = len(sources) > 1
+    names = ", ".join(colors)
+    console.print(f"--- Просмотр логов '{names}' (Ctrl+C для выхода) ---")
+    alive = len(sources)
+    try:
+        while alive:
+            try:
+                batches = [out.get(timeout=RENDER_INTERVAL)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + RENDER_INTERVAL
+            while time.monotonic() < deadline:
+                try:
+                    batches.append(out.get_nowait())
+                except queue.Empty:
+                    time.sleep(0.02)
+            text = Text()
+            for name, chunk in batches:
+                if chunk is None:
+                    alive -= 1
+                    continue
+                for raw in chunk:
+                    if multi:
+                        text.append(f"[{name}] ", style=colors[name])
+                    text.append(raw.decode("utf-8", errors="replace") + "\n")
+            if text:
+                console.print(text, end="", markup=False, highlight=False, soft_wrap=True)
+    except KeyboardInterrupt:
+        console.print("\nВыход.")
+    finally:
+        stop.set()
+        for source in sources:
+            source.close()
@@ -0,0 +1,102 @@
+import re
+import time
+from datetime import datetime
+from functools import lru_cache
+
+# 2024/01/02 15:04:05.123456 from 1.2.3.4:5678 accepted tcp:example.com:443 [VLESS_TCP >> DIRECT] email: user@x
+_TS_RE = re.compile(r"(\d{4})/(\d{2})/(\d{2}) (\d{2}:\d{2}:\d{2}(?:\.\d+)?)\s+")
+_ACCESS_RE = re.compile(r"from\s+(?:(?:tcp|udp):)?(\S+)\s+(accepted|rejected)\s*(.*)$")
+_DEST_RE = re.compile(
+    r"^(?:(?P<network>tcp|udp):)?(?P<dest>\S+?)(?::(?P<dest_port>\d+))?(?=\s|$)"
+    r"(?:\s+\[(?P<route>[^\]]*)\])?"
+    r"(?:\s+email:\s*(?P<email>\S+))?"
+)
+_LEVEL_RE = re.compile(r"^\[(\w+)\]\s*")
+_TAG_RE = re.compile(r"xray-node-([^\s:\[]+)")
+
+
+def _split_host_port(value):
+    host, sep, port = value.rpartition(":")
+    if not sep or not port.isdigit():
+        return value.strip("[]"), None
+    return host.strip("[]"), int(port)
+
+
+def parse_xray_line(line):
+    """
+    Разобрать строку access/error лога xray в словарь.
+    Всегда есть поля timestamp и message, остальные — только если найдены.
+    Понимает и строки с syslog-префиксом rsyslog (тег xray-node-<name>).
+    """
+    message = line.strip()
+    record = {"timestamp": None, "message": message}
+
+    ts = _TS_RE.search(message)
+    if ts is None:
+        return record
+
+    if ts.start():
+        tag = _TAG_RE.search(message, 0, ts.start())
+        if tag:
+            record["node"] = tag.group(1)
+
+    year, month, day, clock = ts.groups()
+    record["timestamp"] = f"{year}-{month}-{day}T{clock}"
+    rest = message[ts.end():]
+
+    access = _ACCESS_RE.match(rest)
+    if access is None:
+        level = _LEVEL_RE.match(rest)
+        if level:
+            record["level"] = level.group(1).lower()
+        return record
+
+    src, status, tail = access.groups()
+    record["src_ip"], record["src_port"] = _split_host_port(src)
+    record["status"] = status
+
+    if status == "rejected":
+        if tail:
+            record["reason"] = tail.strip()
+        return record
+
+    dest = _DEST_RE.match(tail)
+    if dest is None:
+        return record
+    if dest.group("network"):
+        record["network"] = dest.group("network")
+    record["dest"] = dest.group("dest").strip("[]")
+    if dest.group("dest_port"):
+        record["dest_port"] = int(dest.group("dest_port"))
+    route = dest.group("route")
+    if route:
+        for sep in (">>", "->"):
+            if sep in route:
+                inbound, outbound = route.split(sep, 1)
+                record["inbound"] = inbound.strip()
+                record["outbound"] = outbound.strip()
+                break
+        else:
+            record["inbound"] = route.strip()
+    if dest.group("email"):
+        record["email"] = dest.group("email")
+    return record
+
+
+@lru_cache(maxsize=4096)
+def _second_epoch(second):
+    return datetime.fromisoformat(second).timestamp()
+
+
+def record_epoch(record, default=None):
+    """Unix-время записи по её timestamp (локальное время xray) или default."""
+    ts = record.get("timestamp")
+    if not ts:
+        return time.time() if default is None else default
+    try:
+        epoch = _second_epoch(ts[:19])
+    except ValueError:
+        return time.time() if default is None else default
+    if len(ts) > 20:
+        epoch += float("0" + ts[19:])
+    return epoch